@@ -0,0 +1,75 @@
+"""
+Image differencing used to analyze the molds.
+
+Shared by the Tk interface and the monitoring tools so that every entry point
+makes the same decision on the same image.
+"""
+from startup import LazyModule
+
+from capture import CAPTURE_SIZE
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+MIN_OBJECT_SIZE = 35
+# a starting point for the absdiff detector's noise_factor option
+NOISE_FACTOR = 3
+
+
+def scale_min_size(min_size, size, reference=CAPTURE_SIZE):
+    """
+    Returns min_size, given for frames of the reference size, for frames of size.
+
+    A defect's blob grows with the frame's area; min_size bounds its width
+    and height, so it grows with the square root of the area ratio.
+    """
+    ratio = size[0] * size[1] / float(reference[0] * reference[1])
+    return int(round(min_size * ratio ** 0.5))
+
+
+def threshold_map(noise, sens, factor=NOISE_FACTOR):
+    """
+    Returns a per-pixel threshold of sens plus factor standard deviations of noise.
+
+    With a noise map the sensitivity is the margin over each pixel's own
+    noise rather than the whole threshold, so the same value lets through
+    less than it does without one.
+    """
+    return numpy.clip(sens + factor * numpy.asarray(noise, numpy.float32), 0, 255).astype(numpy.uint8)
+
+
+def difference(base_gray, image_gray, sens):
+    """
+    Returns the binary mask of where image_gray differs from base_gray.
+
+    sens is either a single threshold or a per-pixel map from threshold_map().
+    """
+    diff = cv2.absdiff(base_gray, image_gray)
+    if getattr(sens, 'ndim', 0):
+        return cv2.compare(diff, sens, cv2.CMP_GT)
+    return cv2.threshold(diff, sens, 255, cv2.THRESH_BINARY)[1]
+
+
+def find_objects(thresh, min_size=MIN_OBJECT_SIZE, limit=None):
+    """
+    Returns the bounding boxes (x, y, w, h) of blobs wider and taller than min_size.
+
+    With limit, stops once that many are found; limit=1 is enough for a verdict.
+    """
+    # [-2] picks the contours on both OpenCV 3 (3 values) and OpenCV 4 (2 values)
+    conts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    boxes = []
+    for c in conts:
+        (x, y, w, h) = cv2.boundingRect(c)
+        if w > min_size and h > min_size:
+            boxes.append((x, y, w, h))
+            if len(boxes) == limit:
+                break
+    return boxes
+
+
+def annotate(image, boxes):
+    """Draws the bounding boxes onto image in place."""
+    for (x, y, w, h) in boxes:
+        cv2.rectangle(image, (x, y), (x + w, y + h), (255, 0, 0), 2)
+    return image
@@ -0,0 +1,188 @@
+"""
+Lossless on-disk format for the calibrated baseline.
+
+A baseline file holds the averaged mold image, and optionally the per-pixel
+noise (standard deviation) seen during calibration, as raw arrays behind a
+small JSON header. The header records the resolution, a hash of the camera
+settings the baseline was captured with, the number of frames averaged and
+when. Arrays are loaded through numpy.memmap, so nothing is decoded, and a
+baseline captured with other camera settings is rejected instead of being
+silently diffed against.
+
+Layout: MAGIC, header length (little-endian uint32), UTF-8 JSON header padded
+to ALIGN bytes, then each array at the offset given in the header.
+"""
+from datetime import datetime
+import hashlib
+import json
+import os
+import struct
+
+from startup import LazyModule
+
+import capture
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+BASELINE_FILE = 'baseline.wcb'
+MAGIC = b'WCBL'
+VERSION = 1
+ALIGN = 64
+
+
+class BaselineError(Exception):
+    """Raised when a baseline file cannot be read."""
+
+
+class BaselineMismatch(BaselineError):
+    """Raised when a baseline was captured with other camera settings."""
+
+
+def settings_hash(settings, size=capture.CAPTURE_SIZE):
+    """Returns a short hash of the camera settings and capture size."""
+    key = dict(settings, zoom=list(settings['zoom']), resolution=list(capture.resolution_for(size)),
+               size=list(size))
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save(path, arrays, settings, frames, size=capture.CAPTURE_SIZE, extra=None):
+    """
+    Writes arrays (a dict of name to array) to path with a provenance header.
+
+    The file is written next to path and renamed over it, so a reader never
+    sees a half-written baseline.
+    """
+    header = {
+        'version': VERSION,
+        'width': size[0],
+        'height': size[1],
+        'settings_hash': settings_hash(settings, size),
+        'settings': dict(settings, zoom=list(settings['zoom'])),
+        'frames': frames,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'arrays': [],
+    }
+    if extra:
+        header.update(extra)
+    arrays = [(name, numpy.ascontiguousarray(a)) for name, a in arrays.items()]
+    header['arrays'] = [{'name': name, 'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': 0}
+                        for name, a in arrays]
+    # leave room for the digits of the offsets, which are not known yet
+    offset = _align(len(MAGIC) + 4 + len(json.dumps(header)) + 20 * len(arrays))
+    for info, (name, a) in zip(header['arrays'], arrays):
+        info['offset'] = offset
+        offset = _align(offset + a.nbytes)
+    head = json.dumps(header).encode('utf-8')
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(MAGIC + struct.pack('<I', len(head)) + head)
+        for (name, a), info in zip(arrays, header['arrays']):
+            file.write(b'\0' * (info['offset'] - file.tell()))
+            file.write(a.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+    return header
+
+
+def read_header(path):
+    """Returns the JSON header of the baseline at path."""
+    with open(path, 'rb') as file:
+        start = file.read(len(MAGIC) + 4)
+        if len(start) < len(MAGIC) + 4 or start[:len(MAGIC)] != MAGIC:
+            raise BaselineError('{!r} is not a baseline file'.format(path))
+        length = struct.unpack('<I', start[len(MAGIC):])[0]
+        header = json.loads(file.read(length).decode('utf-8'))
+    if header.get('version') != VERSION:
+        raise BaselineError('unsupported baseline version {!r}'.format(header.get('version')))
+    return header
+
+
+class Baseline(object):
+    """
+    A baseline loaded from disk.
+
+    Attributes:
+        path: The file it was loaded from.
+        header: The provenance header.
+        arrays: A dict of name to read-only memory-mapped array.
+    """
+    def __init__(self, path, header, arrays):
+        self.path = path
+        self.header = header
+        self.arrays = arrays
+
+    @property
+    def mean(self):
+        """The averaged grayscale mold image."""
+        return self.arrays['mean']
+
+    @property
+    def noise(self):
+        """The per-pixel standard deviation, or None if it was not saved."""
+        return self.arrays.get('noise')
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+
+
+def load(path=BASELINE_FILE, settings=None, size=capture.CAPTURE_SIZE):
+    """
+    Memory-maps the baseline at path.
+
+    Raises BaselineError if it cannot be read and, if settings is given,
+    BaselineMismatch unless the baseline was captured with the same camera
+    settings and capture size.
+    """
+    try:
+        header = read_header(path)
+    except (OSError, ValueError, struct.error) as e:
+        raise BaselineError('cannot read baseline {!r}: {}'.format(path, e))
+    if settings is not None and header['settings_hash'] != settings_hash(settings, size):
+        raise BaselineMismatch(
+            'baseline {!r} was captured with other camera settings '
+            '({} frames at {}); recalibrate'.format(path, header['frames'], header['created']))
+    arrays = {}
+    try:
+        for info in header['arrays']:
+            arrays[info['name']] = numpy.memmap(path, dtype=numpy.dtype(info['dtype']), mode='r',
+                                                offset=info['offset'], shape=tuple(info['shape']))
+    except (ValueError, OSError) as e:
+        # e.g. a file cut short, so an array runs past its end
+        raise BaselineError('cannot read baseline {!r}: {}'.format(path, e))
+    return Baseline(path, header, arrays)
+
+
+def load_current(path=BASELINE_FILE, size=capture.CAPTURE_SIZE):
+    """Loads the baseline at path, checked against the saved camera settings."""
+    return load(path, capture.load_settings(), size)
+
+
+def accumulate(frames):
+    """
+    Averages grayscale frames into baseline arrays.
+
+    Returns a dict with the rounded mean image ('mean', uint8) and the
+    per-pixel standard deviation ('noise', float32), ready for save().
+    """
+    acc = acc_sq = None
+    n = 0
+    for gray in frames:
+        if acc is None:
+            acc = numpy.zeros(gray.shape, numpy.float64)
+            acc_sq = numpy.zeros(gray.shape, numpy.float64)
+        cv2.accumulate(gray, acc)
+        cv2.accumulateSquare(gray, acc_sq)
+        n += 1
+    if not n:
+        raise BaselineError('no frames to average')
+    mean = acc / n
+    noise = numpy.sqrt(numpy.maximum(acc_sq / n - mean * mean, 0)).astype(numpy.float32)
+    return {'mean': numpy.round(mean).astype(numpy.uint8), 'noise': noise}
@@ -0,0 +1,250 @@
+"""
+Golden-dataset regression harness for the mold analysis.
+
+Runs a detector configuration over a labelled dataset of clean and
+contaminated frames and reports detection accuracy (per-box and per-frame
+precision/recall), the per-frame latency distribution and throughput. Given a
+reference report from an earlier run, it fails when accuracy or speed regress
+by more than a tolerance.
+
+A dataset is a directory holding baseline.png, the frames as lossless PNGs and
+labels.json:
+
+    {"frames": [{"file": "0001.png", "boxes": [[x, y, w, h], ...]}, ...]}
+
+where frames without contamination have no boxes. Use --make-synthetic to
+generate one from the simulated camera, or export your own captures in this
+layout.
+
+    python bench.py --make-synthetic golden/ --frames 500
+    python bench.py golden/ --save-reference golden/reference.json
+    python bench.py golden/ --reference golden/reference.json
+    python bench.py golden/ --tiles 2x2 --reference golden/reference.json
+    python bench.py golden/ --detector ssim --option block=16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from startup import LazyModule
+
+import analysis
+import detectors
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+LABELS_FILE = 'labels.json'
+BASELINE_IMAGE = 'baseline.png'
+IOU_MATCH = 0.3
+
+
+class Dataset(object):
+    """
+    A labelled set of frames loaded into memory.
+
+    Attributes:
+        path: The dataset directory.
+        base_gray: The clean baseline image.
+        frames: A list of (file name, grayscale image, list of truth boxes).
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, LABELS_FILE)) as file:
+            labels = json.load(file)
+        self.base_gray = self._read(BASELINE_IMAGE)
+        self.frames = [(f['file'], self._read(f['file']), [tuple(b) for b in f['boxes']])
+                       for f in labels['frames']]
+
+    def _read(self, name):
+        image = cv2.imread(os.path.join(self.path, name), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise SystemExit('cannot read {!r} from the dataset'.format(name))
+        return image
+
+
+def make_synthetic(path, n, seed=0, defect_rate=0.5):
+    """Writes a dataset of n frames from the simulated camera to path."""
+    import simulate
+
+    os.makedirs(path, exist_ok=True)
+    camera = simulate.SimulatedCamera(defect_rate=defect_rate, seed=seed)
+    cv2.imwrite(os.path.join(path, BASELINE_IMAGE), camera.background())
+    frames = []
+    for i in range(1, n + 1):
+        image, boxes = camera.capture_gray()
+        name = '{:04}.png'.format(i)
+        cv2.imwrite(os.path.join(path, name), image)
+        frames.append({'file': name, 'boxes': [list(b) for b in boxes]})
+    with open(os.path.join(path, LABELS_FILE), 'w') as file:
+        json.dump({'frames': frames, 'source': 'synthetic', 'seed': seed}, file, indent=1)
+
+
+def make_detector(name=detectors.DEFAULT, sens=25, min_size=analysis.MIN_OBJECT_SIZE, **options):
+    """
+    Returns detect(base_gray, image_gray) -> boxes for the given configuration.
+
+    name is a detector from detectors.DETECTORS; options are passed to it.
+    The detector is built on the first call, from that call's baseline, with
+    min_size (given for capture.CAPTURE_SIZE frames) scaled to its size.
+    """
+    built = {}
+
+    def detect(base_gray, image_gray):
+        detector = built.get(id(base_gray))
+        if detector is None:
+            h, w = base_gray.shape[:2]
+            detector = built[id(base_gray)] = detectors.create(
+                name, base_gray, sens, analysis.scale_min_size(min_size, (w, h)), **options)
+        return detector.detect(image_gray).boxes
+    return detect
+
+
+def iou(a, b):
+    """Returns the intersection over union of boxes a and b."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def match(found, truth, threshold=IOU_MATCH):
+    """Returns the number of found boxes greedily matched to a truth box."""
+    pairs = sorted(((iou(f, t), i, j) for i, f in enumerate(found) for j, t in enumerate(truth)),
+                   reverse=True)
+    used_f, used_t = set(), set()
+    for score, i, j in pairs:
+        if score < threshold:
+            break
+        if i not in used_f and j not in used_t:
+            used_f.add(i)
+            used_t.add(j)
+    return len(used_f)
+
+
+def _ratio(num, den):
+    return round(num / float(den), 4) if den else 1.0
+
+
+def run(dataset, detect, warmup=5, repeat=1):
+    """Runs detect over every frame of dataset and returns the report."""
+    for _, image, _ in dataset.frames[:warmup]:
+        detect(dataset.base_gray, image)
+
+    latencies = []
+    tp = n_found = n_truth = 0
+    frame_tp = frame_fp = frame_fn = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for _, image, truth in dataset.frames:
+            t = time.perf_counter()
+            found = detect(dataset.base_gray, image)
+            latencies.append(time.perf_counter() - t)
+            tp += match(found, truth)
+            n_found += len(found)
+            n_truth += len(truth)
+            frame_tp += 1 if found and truth else 0
+            frame_fp += 1 if found and not truth else 0
+            frame_fn += 1 if truth and not found else 0
+    elapsed = time.perf_counter() - started
+
+    ms = numpy.array(latencies) * 1000.0
+    return {
+        'frames': len(latencies),
+        'box_precision': _ratio(tp, n_found),
+        'box_recall': _ratio(tp, n_truth),
+        'frame_precision': _ratio(frame_tp, frame_tp + frame_fp),
+        'frame_recall': _ratio(frame_tp, frame_tp + frame_fn),
+        'latency_ms': {
+            'mean': round(float(ms.mean()), 3),
+            'p50': round(float(numpy.percentile(ms, 50)), 3),
+            'p90': round(float(numpy.percentile(ms, 90)), 3),
+            'p99': round(float(numpy.percentile(ms, 99)), 3),
+            'max': round(float(ms.max()), 3),
+        },
+        'throughput_fps': round(len(latencies) / elapsed, 1),
+    }
+
+
+def compare(report, reference, accuracy_tolerance=0.02, speed_tolerance=0.2, slack_ms=0.1):
+    """
+    Returns a list of regressions of report against reference.
+
+    Accuracy may drop by accuracy_tolerance (absolute). p50/p90 latency and the
+    time per frame implied by the throughput may grow by speed_tolerance
+    (relative) plus slack_ms, so timer noise on very fast detectors does not
+    fail the run.
+    """
+    failures = []
+    for key in ('box_precision', 'box_recall', 'frame_precision', 'frame_recall'):
+        if report[key] < reference[key] - accuracy_tolerance:
+            failures.append('{} fell from {} to {}'.format(key, reference[key], report[key]))
+    for key in ('p50', 'p90'):
+        old, new = reference['latency_ms'][key], report['latency_ms'][key]
+        if new > old * (1 + speed_tolerance) + slack_ms:
+            failures.append('{} latency rose from {} ms to {} ms'.format(key, old, new))
+    old, new = reference['throughput_fps'], report['throughput_fps']
+    if 1000.0 / new > 1000.0 / old * (1 + speed_tolerance) + slack_ms:
+        failures.append('throughput fell from {} to {} fps'.format(old, new))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure detection speed and accuracy on a labelled dataset.')
+    parser.add_argument('dataset', help='dataset directory')
+    parser.add_argument('--make-synthetic', action='store_true', help='generate a synthetic dataset and exit')
+    parser.add_argument('--frames', type=int, default=300, help='frames in a synthetic dataset')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sensitivity', type=int, default=25)
+    parser.add_argument('--min-size', type=int, default=analysis.MIN_OBJECT_SIZE,
+                        help='for 400x250 frames; scaled to the size of the dataset')
+    parser.add_argument('--detector', choices=sorted(detectors.DETECTORS), default=detectors.DEFAULT)
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='detector option, e.g. block=16; may be repeated')
+    parser.add_argument('--tiles', type=lambda t: tuple(int(n) for n in t.lower().split('x')),
+                        help='analyze in ROWSxCOLS tiles on a thread pool')
+    parser.add_argument('--workers', type=int, help='threads for --tiles')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the dataset')
+    parser.add_argument('--reference', help='report to compare against')
+    parser.add_argument('--save-reference', help='write the report here')
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.02)
+    parser.add_argument('--speed-tolerance', type=float, default=0.2)
+    parser.add_argument('--slack-ms', type=float, default=0.1, help='absolute latency slack')
+    args = parser.parse_args()
+
+    if args.make_synthetic:
+        make_synthetic(args.dataset, args.frames, args.seed)
+        return 0
+
+    options = dict(detectors.parse_option(o) for o in args.option)
+    if args.tiles:
+        options.update(tiles=args.tiles, workers=args.workers)
+    detect = make_detector(args.detector, args.sensitivity, args.min_size, **options)
+    report = run(Dataset(args.dataset), detect, repeat=args.repeat)
+    report['config'] = {'detector': args.detector, 'sensitivity': args.sensitivity,
+                        'min_size': args.min_size,
+                        'options': {k: list(v) if isinstance(v, tuple) else v for k, v in options.items()}}
+    print(json.dumps(report, indent=2))
+
+    if args.save_reference:
+        with open(args.save_reference, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.reference:
+        with open(args.reference) as file:
+            reference = json.load(file)
+        failures = compare(report, reference, args.accuracy_tolerance, args.speed_tolerance,
+                           args.slack_ms)
+        for failure in failures:
+            print('REGRESSION: ' + failure, file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
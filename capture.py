@@ -0,0 +1,191 @@
+"""
+Camera setup shared by the Tk interface and the headless service.
+
+Nothing in here depends on Tk, so it can be used on presses that run without a
+screen.
+"""
+import json
+import logging
+import threading
+
+from startup import LazyModule
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+picamera = LazyModule('picamera')
+
+SETTINGS_FILE = 'camerasettings.json'
+# what the camera captures at, before resizing to the analysis size; larger
+# analysis sizes are captured at that size, up to the sensor's full
+# resolution (3280x2464 on the v2 camera module, 2592x1944 on v1)
+RESOLUTION = (640, 368)
+CAPTURE_SIZE = (400, 250)
+# the settings that are PiCamera attributes; the rest (see rectify.py) are not
+CAMERA_KEYS = ('brightness', 'contrast', 'rotation', 'sharpness', 'shutter_speed', 'zoom')
+
+log = logging.getLogger('wincup.capture')
+
+
+def load_settings(profile='custom'):
+    """Returns the camera settings of profile from SETTINGS_FILE."""
+    with open(SETTINGS_FILE) as file:
+        settings = json.load(file)
+    settings[profile]['zoom'] = tuple(settings[profile]['zoom'])
+    return settings[profile]
+
+
+def resolution_for(size=None):
+    """Returns the resolution to capture frames of size at: RESOLUTION, or size when it is larger."""
+    if size is None or (size[0] <= RESOLUTION[0] and size[1] <= RESOLUTION[1]):
+        return RESOLUTION
+    return tuple(size)
+
+
+def init_camera(camera, size=None):
+    """Takes in a PiCamera object and applies settings to it, for frames of size."""
+    for k, v in load_settings().items():
+        if k in CAMERA_KEYS:
+            setattr(camera, k, v)
+    camera.resolution = resolution_for(size)
+    camera.awb_mode = 'auto'
+    return camera
+
+
+class _BufferWriter(object):
+    """File-like output that copies camera data straight into a preallocated buffer."""
+    def __init__(self, buf):
+        self.view = memoryview(buf)
+        self.pos = 0
+
+    def write(self, data):
+        n = max(0, min(len(data), len(self.view) - self.pos))
+        self.view[self.pos:self.pos + n] = data[:n]
+        self.pos += n
+        # anything past the end of the buffer (the U/V planes when only
+        # grayscale is wanted) is dropped
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def yuv_size(size):
+    """Returns the (width, height) picamera pads a YUV capture of size to."""
+    w, h = size
+    return (w + 31) // 32 * 32, (h + 15) // 16 * 16
+
+
+class CameraSource(object):
+    """
+    Keeps a PiCamera open between cycles and captures frames from it.
+
+    Frames are captured as YUV420 into a buffer allocated once, and the
+    luminance (Y) plane is handed out as a grayscale view of it, so a cycle
+    needs no colour conversion and no new arrays. The U/V planes are only kept
+    when color is True, for displaying or archiving the image.
+
+    Attributes:
+        camera: The PiCamera, with the saved settings applied.
+        size: The (width, height) the captures are resized to.
+        color: Whether color_image() is available.
+        video: Whether frames come from the video port, which is faster but
+            noisier; good for previews, not for analysis.
+    """
+    def __init__(self, size=CAPTURE_SIZE, color=False, video=False):
+        self.camera = init_camera(picamera.PiCamera(), size)
+        self.size = size
+        self.color = color
+        self.video = video
+        w, h = size
+        fw, fh = yuv_size(size)
+        self._buf = numpy.empty(fw * fh * 3 // 2 if color else fw * fh, numpy.uint8)
+        self._y = self._buf[:fw * fh].reshape(fh, fw)[:h, :w]
+        self._writer = _BufferWriter(self._buf)
+
+    def read_gray(self):
+        """
+        Captures a frame and returns its Y plane.
+
+        The returned array is a view that the next capture overwrites; copy it
+        to keep it.
+        """
+        self._writer.pos = 0
+        self.camera.capture(self._writer, format='yuv', resize=self.size,
+                            use_video_port=self.video)
+        return self._y
+
+    def release(self):
+        """Finishes with the last frame read; it is always intact, as nothing captures meanwhile."""
+        return True
+
+    def apply(self, name, value):
+        """Changes the camera setting name on the open camera; later captures use it."""
+        setattr(self.camera, name, tuple(value) if name == 'zoom' else value)
+
+    def color_image(self):
+        """Returns the last capture as a new RGB array."""
+        if not self.color:
+            raise ValueError('CameraSource was opened without color')
+        w, h = self.size
+        fw, fh = yuv_size(self.size)
+        rgb = cv2.cvtColor(self._buf.reshape(fh * 3 // 2, fw), cv2.COLOR_YUV2RGB_I420)
+        return rgb[:h, :w]
+
+    def close(self):
+        self.camera.close()
+
+
+class LivePreview(object):
+    """
+    Captures frames continuously on a thread for a live view of the camera.
+
+    Settings changed with apply() reach the running camera immediately, so
+    the next frame shows their effect without reopening the camera.
+
+    Attributes:
+        source: The CameraSource, opened on the video port.
+        seq: The number of frames captured so far.
+    """
+    def __init__(self, size=CAPTURE_SIZE):
+        self.source = CameraSource(size, color=True, video=True)
+        self.seq = 0
+        self._frame = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='preview', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            try:
+                for name, value in pending.items():
+                    self.source.apply(name, value)
+                self.source.read_gray()
+                frame = self.source.color_image()
+            except Exception:
+                if not self._stop.is_set():
+                    log.exception('preview capture failed')
+                return
+            self._frame = frame
+            self.seq += 1
+
+    def apply(self, name, value):
+        """Changes a camera setting before the next preview frame; does not block."""
+        self.apply_all({name: value})
+
+    def apply_all(self, values):
+        """Changes the settings in values, a dict of name to value, all before the same preview frame."""
+        with self._lock:
+            self._pending.update(values)
+
+    def latest(self):
+        """Returns (seq, RGB frame) of the newest frame, or (0, None) before the first."""
+        return self.seq, self._frame
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.source.close()
@@ -0,0 +1,269 @@
+"""
+Checkpoints of the running analysis, for fast crash recovery.
+
+While analyzing, the whole state of the run is saved every SAVE_EVERY
+seconds and once more when it stops:
+
+    arrays   the baseline (mean, noise), the threshold map derived from it,
+             the rectifier's remap tables, the heatmap counts and anything the
+             detector has learned (e.g. the MOG2 background)
+    header   the recipe, the detector with its sensitivity, size filter and
+             options, and the counters of the cycles, the trigger scheduler,
+             the detector and the heatmap
+
+A checkpoint is a baseline file (see baseline.py) of kind 'checkpoint': it is
+written next to its path and renamed over it, so a crash mid-write leaves the
+previous checkpoint intact, and it carries the camera settings hash, so a
+checkpoint taken with other settings is refused. It also records the recipe
+and which calibration of the baseline it was taken with: once the product is
+switched or the baseline recalibrated, the checkpoint is stale and the run
+starts afresh. Its arrays are memory-mapped on load; nothing is decoded or
+recomputed and no recalibration is needed. A mapped checkpoint stays valid
+when the next one replaces the file.
+
+Start with --resume to go straight back into analysis from the last
+checkpoint (see service.py and wincup.py), or inspect it with
+
+    python checkpoint.py
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+from startup import LazyModule
+
+import baseline
+import capture
+import detectors
+import heatmap as heatmaps
+import rectify
+
+numpy = LazyModule('numpy')
+
+CHECKPOINT_FILE = 'checkpoint.wcb'
+SAVE_EVERY = 30.0
+KIND = 'checkpoint'
+_DETECTOR = 'detector.'
+
+
+class StaleCheckpoint(baseline.BaselineError):
+    """Raised when a checkpoint is of another recipe or of an older calibration."""
+
+
+def provenance(path):
+    """
+    Returns what identifies the baseline at path, to be saved as the
+    baseline field of a checkpoint: its path, settings hash and creation time.
+    """
+    try:
+        header = baseline.read_header(path)
+    except (OSError, ValueError, struct.error) as e:
+        raise baseline.BaselineError('cannot read baseline {!r}: {}'.format(path, e))
+    return {'path': path, 'settings_hash': header['settings_hash'], 'created': header['created']}
+
+
+def collect(detector, scheduler=None, heatmap=None, rectifier=None, options=None, **fields):
+    """
+    Returns the arrays and the state of a run, for Checkpointer.save().
+
+    options are the detector's options as given by the user; fields (the
+    recipe, the baseline's provenance(), the cycle counts, ...) are saved
+    with the state as they are.
+    """
+    arrays = {'mean': detector.base_gray}
+    if detector.noise is not None:
+        arrays['noise'] = detector.noise
+    if isinstance(getattr(detector, 'limit', None), numpy.ndarray):
+        arrays['limit'] = detector.limit
+    if rectifier is not None:
+        arrays.update(rectifier.arrays())
+    counters, learned = detector.state()
+    arrays.update((_DETECTOR + name, a) for name, a in learned.items())
+    state = dict(fields)
+    state['detector'] = {
+        'name': detector.name,
+        'sensitivity': detector.sens,
+        'min_size': detector.min_size,
+        # arrays, such as a recipe's threshold map, are saved as arrays
+        'options': {k: v for k, v in (options or {}).items() if not hasattr(v, 'shape')},
+        'counters': counters,
+    }
+    if scheduler is not None:
+        state['trigger'] = scheduler.counters()
+    if heatmap is not None:
+        arrays['heatmap'] = heatmap.counts
+        state['heatmap'] = {'cell': heatmap.cell, 'cycles': heatmap.cycles, 'started': heatmap.started,
+                            'path': heatmap.path}
+    return arrays, state
+
+
+class Checkpoint(object):
+    """
+    A checkpoint loaded from disk.
+
+    Attributes:
+        path: The file it was loaded from.
+        header: The header; see baseline.py.
+        arrays: A dict of name to read-only memory-mapped array.
+        state: The recipe, detector and counters it was saved with.
+    """
+    def __init__(self, path, header, arrays):
+        self.path = path
+        self.header = header
+        self.arrays = arrays
+        self.state = header['state']
+
+    @property
+    def size(self):
+        return (self.header['width'], self.header['height'])
+
+    @property
+    def settings(self):
+        return self.header['settings']
+
+    @property
+    def mean(self):
+        return self.arrays['mean']
+
+    @property
+    def noise(self):
+        return self.arrays.get('noise')
+
+    def check(self, recipe, baseline_path):
+        """
+        Raises StaleCheckpoint unless the checkpoint is of recipe (a name, or
+        None for none) and of the baseline now at baseline_path (None when
+        there is none, e.g. when simulating), as it was calibrated then.
+        """
+        if self.state.get('recipe') != recipe:
+            raise StaleCheckpoint('checkpoint {!r} is of recipe {!r}, not {!r}'.format(
+                self.path, self.state.get('recipe'), recipe))
+        saved = self.state.get('baseline')
+        current = None if baseline_path is None else provenance(baseline_path)
+        if saved != current:
+            raise StaleCheckpoint('checkpoint {!r} is of baseline {}, not {}'.format(
+                self.path, _describe(saved), _describe(current)))
+
+    def rectifier(self):
+        """Returns the saved rectify.Rectifier, or None."""
+        return rectify.from_arrays(self.arrays)
+
+    def detector(self):
+        """Returns a new detector as it was saved, counters and learned arrays included."""
+        saved = self.state['detector']
+        options = dict(saved['options'])
+        if 'limit' in self.arrays:
+            options.setdefault('limit', self.arrays['limit'])
+        detector = detectors.create(saved['name'], self.mean, saved['sensitivity'], saved['min_size'],
+                                    self.noise, **options)
+        learned = {name[len(_DETECTOR):]: a for name, a in self.arrays.items() if name.startswith(_DETECTOR)}
+        detector.restore(saved['counters'], learned)
+        return detector
+
+    def heatmap(self, path=None, every=heatmaps.SAVE_EVERY):
+        """Returns the saved heatmap.Heatmap, saved to path (by default where it was), or None."""
+        saved = self.state.get('heatmap')
+        if saved is None:
+            return None
+        heatmap = heatmaps.Heatmap(self.size, saved['cell'], path or saved['path'], self.settings, every)
+        heatmap.counts[:] = self.arrays['heatmap']
+        heatmap.cycles = saved['cycles']
+        heatmap.started = saved['started']
+        return heatmap
+
+
+def _describe(source):
+    return 'none' if source is None else '{path!r} of {created}'.format(**source)
+
+
+def load(path=CHECKPOINT_FILE, settings=None, size=capture.CAPTURE_SIZE):
+    """
+    Memory-maps the checkpoint at path.
+
+    Raises baseline.BaselineError if it cannot be read or, when settings are
+    given, was saved with other camera settings or size.
+    """
+    saved = baseline.load(path, settings, size)
+    if saved.header.get('kind') != KIND:
+        raise baseline.BaselineError('{!r} is not a checkpoint'.format(path))
+    return Checkpoint(path, saved.header, saved.arrays)
+
+
+class Checkpointer(object):
+    """
+    Saves checkpoints of a run, at most every so many seconds.
+
+    Attributes:
+        path: The checkpoint file.
+        settings: The camera settings the run uses.
+        size: The (width, height) of its frames.
+        every: The seconds between saves by autosave(), 0 for none.
+        saves: The number of checkpoints written.
+        seconds: How long the last one took.
+    """
+    def __init__(self, path=CHECKPOINT_FILE, settings=None, size=capture.CAPTURE_SIZE, every=SAVE_EVERY):
+        self.path = path
+        self.settings = settings
+        self.size = size
+        self.every = every
+        self.saves = 0
+        self.seconds = 0.0
+        self._saved = time.monotonic()
+
+    def save(self, arrays, state):
+        """Writes a checkpoint of arrays and state, e.g. from collect()."""
+        start = time.monotonic()
+        state = dict(state, saved=time.time())
+        baseline.save(self.path, arrays, self.settings, state.get('cycles', 0), self.size,
+                      extra={'kind': KIND, 'state': state})
+        self._saved = time.monotonic()
+        self.seconds = self._saved - start
+        self.saves += 1
+
+    def autosave(self, collect):
+        """Saves collect()'s arrays and state if the last save was more than every seconds ago."""
+        if self.every and time.monotonic() - self._saved >= self.every:
+            self.save(*collect())
+
+    def snapshot(self):
+        return {
+            'path': self.path,
+            'saves': self.saves,
+            'last_ms': round(self.seconds * 1000.0, 2),
+            'age_s': round(time.monotonic() - self._saved, 1),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or remove the analysis checkpoint.')
+    parser.add_argument('--path', default=CHECKPOINT_FILE, help='checkpoint file')
+    parser.add_argument('--clear', action='store_true', help='remove it, so --resume starts afresh')
+    args = parser.parse_args()
+
+    if args.clear:
+        if os.path.exists(args.path):
+            os.remove(args.path)
+        print('Checkpoint {} removed.'.format(args.path))
+        return 0
+    try:
+        saved = load(args.path)
+    except baseline.BaselineError as e:
+        print(e, file=sys.stderr)
+        return 1
+    state = saved.state
+    print('{}: saved {}, {} cycles'.format(args.path, time.ctime(state['saved']), state.get('cycles', 0)))
+    print('  recipe:   {}'.format(state.get('recipe')))
+    print('  baseline: {}'.format(_describe(state.get('baseline'))))
+    print('  detector: {name} at sensitivity {sensitivity}, options {options}'.format(**state['detector']))
+    print('  arrays:   {}'.format(', '.join(sorted(saved.arrays))))
+    try:
+        load(args.path, capture.load_settings(), saved.size)
+    except baseline.BaselineError as e:
+        print('  cannot resume: {}'.format(e))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""
+Pluggable detectors for finding contamination in a mold image.
+
+Every detector is built from the calibrated baseline and returns a Detection
+for each frame, timed the same way, so detectors can be compared on the golden
+dataset (bench.py --detector) and chosen per product in its recipe.
+
+A verdict only needs one blob. detect(image, first=True) stops at the first
+one found so the reject signal can go out straight away; finish() finds the
+rest of the boxes later, for annotating, off the time-critical path.
+
+state() returns a detector's running counters and anything it has learned,
+and restore() continues from them, so a checkpoint (see checkpoint.py) can
+carry a run across a restart.
+
+Registered detectors:
+    absdiff  Absolute difference against the baseline with a fixed
+             threshold of sens; the reference implementation. With
+             noise_factor=N (e.g. 3) and a baseline with a noise map, the
+             threshold is raised per pixel by N times its calibration
+             noise. Can run in parallel tiles (tiles=(rows, cols), see
+             tiles.py).
+    ssim     Block-wise structural similarity against the baseline; tolerant
+             of small global brightness changes. A block is changed when its
+             SSIM falls below 1 - sens / 100.
+    mog2     OpenCV's MOG2 background subtractor seeded with the baseline and
+             slowly adapting to drift; a pixel is changed when it differs by
+             more than about sens gray levels from the learned background.
+"""
+from ast import literal_eval
+import threading
+import time
+
+from startup import LazyModule
+
+import analysis
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+DEFAULT = 'absdiff'
+DETECTORS = {}
+
+
+def register(name):
+    """Class decorator adding a Detector to DETECTORS under name."""
+    def decorator(cls):
+        cls.name = name
+        DETECTORS[name] = cls
+        return cls
+    return decorator
+
+
+def create(name, base_gray, sens=25, min_size=analysis.MIN_OBJECT_SIZE, noise=None, **options):
+    """Returns the detector registered as name, built from the baseline."""
+    try:
+        cls = DETECTORS[name]
+    except KeyError:
+        raise ValueError('unknown detector {!r}; choose from {}'.format(name, ', '.join(sorted(DETECTORS))))
+    return cls(base_gray, sens, min_size, noise, **options)
+
+
+def parse_option(text):
+    """Returns (key, value) from a KEY=VALUE command line option; value as a literal if it is one."""
+    key, _, value = text.partition('=')
+    try:
+        return key, literal_eval(value)
+    except (ValueError, SyntaxError):
+        return key, value
+
+
+class Detection(object):
+    """
+    The result of one detector on one frame.
+
+    Attributes:
+        detector: The name of the detector.
+        boxes: The bounding boxes (x, y, w, h) of the contamination found.
+        mask: The binary mask the boxes were found in, or None. It belongs to
+            the Detection; the detector does not reuse it.
+        seconds: How long the detection took.
+        complete: Whether boxes holds every box, or only the first (see Detector.finish()).
+    """
+    def __init__(self, detector, boxes, mask, seconds, complete=True):
+        self.detector = detector
+        self.boxes = boxes
+        self.mask = mask
+        self.seconds = seconds
+        self.complete = complete
+
+    @property
+    def reject(self):
+        return bool(self.boxes)
+
+
+class Detector(object):
+    """
+    Base class of the detectors.
+
+    Subclasses implement _detect(image_gray, limit) -> (boxes, mask), where
+    limit is passed on to analysis.find_objects().
+
+    Attributes:
+        base_gray: The calibrated baseline.
+        sens: The sensitivity; each detector documents how it reads it.
+        min_size: The smallest width and height of a blob that is rejected.
+        noise: The per-pixel calibration noise, or None.
+        count: The number of frames detected.
+        total: The seconds spent detecting them.
+        worst: The slowest detection, in seconds.
+    """
+    name = None
+
+    def __init__(self, base_gray, sens=25, min_size=analysis.MIN_OBJECT_SIZE, noise=None):
+        self.base_gray = base_gray
+        self.sens = sens
+        self.min_size = min_size
+        self.noise = noise
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def detect(self, image_gray, first=False):
+        """
+        Returns the Detection for image_gray.
+
+        With first, stops at the first box found; the Detection is then
+        incomplete if it has one and a mask to find the others in.
+        """
+        start = time.perf_counter()
+        boxes, mask = self._detect(image_gray, 1 if first else None)
+        seconds = time.perf_counter() - start
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+        return Detection(self.name, boxes, mask, seconds, not (first and boxes and mask is not None))
+
+    def finish(self, detection):
+        """Finds the rest of the boxes of a Detection made with first; safe on any thread."""
+        if not detection.complete:
+            detection.boxes = analysis.find_objects(detection.mask, self.min_size)
+            detection.complete = True
+        return detection
+
+    def _detect(self, image_gray, limit=None):
+        raise NotImplementedError
+
+    def state(self):
+        """Returns the running counters and a dict of learned arrays, e.g. for a checkpoint."""
+        return {'count': self.count, 'total': self.total, 'worst': self.worst}, {}
+
+    def restore(self, counters, arrays):
+        """Continues from the state() of an earlier run."""
+        self.count = counters.get('count', 0)
+        self.total = counters.get('total', 0.0)
+        self.worst = counters.get('worst', 0.0)
+
+    def snapshot(self):
+        """Returns the detector's timing as a dict."""
+        return {
+            'detector': self.name,
+            'frames': self.count,
+            'mean_ms': round(self.total / self.count * 1000.0, 3) if self.count else None,
+            'max_ms': round(self.worst * 1000.0, 3),
+        }
+
+    def close(self):
+        pass
+
+
+@register('absdiff')
+class AbsDiffDetector(Detector):
+    """
+    Thresholds the absolute difference against the baseline.
+
+    Attributes:
+        noise_factor: How many standard deviations of the calibration noise
+            raise each pixel's threshold, or None for sens alone.
+        limit: sens, raised per pixel by the calibration noise with noise_factor.
+        tiles: The tiles.TiledDifference used for tiled runs, or None.
+    """
+    def __init__(self, base_gray, sens=25, min_size=analysis.MIN_OBJECT_SIZE, noise=None,
+                 limit=None, tiles=None, workers=None, noise_factor=None):
+        Detector.__init__(self, base_gray, sens, min_size, noise)
+        self.noise_factor = noise_factor
+        if limit is None:
+            limit = sens
+            if noise is not None and noise_factor:
+                limit = analysis.threshold_map(noise, sens, noise_factor)
+        self.limit = limit
+        self.tiles = None
+        if tiles:
+            import tiles as tiling
+            self.tiles = tiling.TiledDifference(base_gray.shape, tuple(tiles), workers=workers)
+
+    def _detect(self, image_gray, limit=None):
+        if self.tiles is not None:
+            # the tiles are searched in parallel, so there is no stopping early
+            return self.tiles.find_objects(self.base_gray, image_gray, self.limit, self.min_size), None
+        mask = analysis.difference(self.base_gray, image_gray, self.limit)
+        return analysis.find_objects(mask, self.min_size, limit), mask
+
+    def close(self):
+        if self.tiles is not None:
+            self.tiles.close()
+
+
+@register('ssim')
+class SSIMDetector(Detector):
+    """
+    Compares block-wise structural similarity with the baseline.
+
+    Block means, variances and the covariance are taken with area
+    resampling, so a frame costs a handful of vectorized passes. The
+    baseline's block statistics are computed once.
+
+    Attributes:
+        block: The side of the square blocks, in pixels.
+        threshold: Blocks with a lower SSIM than this are changed.
+    """
+    C1 = (0.01 * 255) ** 2
+    C2 = (0.03 * 255) ** 2
+
+    def __init__(self, base_gray, sens=25, min_size=analysis.MIN_OBJECT_SIZE, noise=None,
+                 block=8, threshold=None):
+        Detector.__init__(self, base_gray, sens, min_size, noise)
+        self.block = block
+        self.threshold = 1.0 - sens / 100.0 if threshold is None else threshold
+        h, w = base_gray.shape
+        self._blocks = (w // block, h // block)
+        self._crop = (h // block * block, w // block * block)
+        self._x = self._crop_float(base_gray)
+        self._mu_x = self._mean(self._x)
+        self._var_x = self._mean(self._x * self._x) - self._mu_x * self._mu_x
+
+    def _crop_float(self, image):
+        h, w = self._crop
+        return image[:h, :w].astype(numpy.float32)
+
+    def _mean(self, image):
+        return cv2.resize(image, self._blocks, interpolation=cv2.INTER_AREA)
+
+    def similarity(self, image_gray):
+        """Returns the SSIM of each block of image_gray against the baseline."""
+        y = self._crop_float(image_gray)
+        mu_x, mu_y = self._mu_x, self._mean(y)
+        var_y = self._mean(y * y) - mu_y * mu_y
+        cov = self._mean(self._x * y) - mu_x * mu_y
+        return (((2 * mu_x * mu_y + self.C1) * (2 * cov + self.C2)) /
+                ((mu_x * mu_x + mu_y * mu_y + self.C1) * (self._var_x + var_y + self.C2)))
+
+    def _detect(self, image_gray, limit=None):
+        changed = (self.similarity(image_gray) < self.threshold).astype(numpy.uint8) * 255
+        h, w = self._crop
+        mask = numpy.zeros(self.base_gray.shape, numpy.uint8)
+        mask[:h, :w] = cv2.resize(changed, (w, h), interpolation=cv2.INTER_NEAREST)
+        return analysis.find_objects(mask, self.min_size, limit), mask
+
+
+@register('mog2')
+class MOG2Detector(Detector):
+    """
+    Segments the frame with OpenCV's MOG2 background subtractor.
+
+    The model is seeded with the baseline; learning_rate lets it follow slow
+    drift such as the lamp warming up. Morphological opening removes
+    speckle before the blobs are measured.
+
+    Attributes:
+        learning_rate: How fast the background adapts, 0 to keep the baseline.
+        var_threshold: The squared Mahalanobis distance at which a pixel is foreground.
+    """
+    VAR_INIT = 15.0
+
+    def __init__(self, base_gray, sens=25, min_size=analysis.MIN_OBJECT_SIZE, noise=None,
+                 learning_rate=0.001, var_threshold=None, history=500):
+        Detector.__init__(self, base_gray, sens, min_size, noise)
+        self.learning_rate = learning_rate
+        self.var_threshold = sens * sens / self.VAR_INIT if var_threshold is None else var_threshold
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(history, self.var_threshold, False)
+        self.subtractor.setVarInit(self.VAR_INIT)
+        self.subtractor.apply(base_gray, learningRate=1.0)
+        self._kernel = numpy.ones((3, 3), numpy.uint8)
+        # state() may be called from another thread than detect()
+        self._lock = threading.Lock()
+
+    def _detect(self, image_gray, limit=None):
+        with self._lock:
+            mask = self.subtractor.apply(image_gray, learningRate=self.learning_rate)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+        return analysis.find_objects(mask, self.min_size, limit), mask
+
+    def state(self):
+        counters, arrays = Detector.state(self)
+        # the model itself cannot be saved, but its background image seeds
+        # a new one with the drift learned so far
+        with self._lock:
+            arrays['background'] = self.subtractor.getBackgroundImage()
+        return counters, arrays
+
+    def restore(self, counters, arrays):
+        Detector.restore(self, counters, arrays)
+        if 'background' in arrays:
+            with self._lock:
+                self.subtractor.apply(numpy.asarray(arrays['background']), learningRate=1.0)
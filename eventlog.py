@@ -0,0 +1,128 @@
+"""
+Structured event logging.
+
+Events are ordinary log records on the 'wincup' loggers whose message is the
+event name and whose fields ride along in the record:
+
+    eventlog.event(log, 'verdict', cycle=12, verdict='reject', objects=2)
+
+EventLog puts a QueueHandler on the 'wincup' logger. A call on the trigger
+thread only builds the record and puts it on an in-memory queue; a
+QueueListener thread encodes it as one JSON object per line and writes it to
+a size-rotated file, so no disk I/O happens on the caller's thread.
+
+    {"ts": "2026-10-18T21:24:35.069", "level": "INFO", "logger": "wincup.gui",
+     "event": "verdict", "cycle": 12, "verdict": "reject", "objects": 2}
+"""
+from datetime import datetime
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+
+LOG_FILE = os.path.join('logs', 'wincup.jsonl')
+MAX_BYTES = 5 * 1024 * 1024
+BACKUPS = 5
+
+
+def event(logger, name, level=logging.INFO, **fields):
+    """Logs the event name with fields to logger."""
+    if logger.isEnabledFor(level):
+        logger.log(level, name, extra={'fields': fields})
+
+
+def _jsonable(value):
+    # numpy scalars and arrays, mostly
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one line of JSON, with the event's fields at the top level."""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=_jsonable)
+
+
+class EventFormatter(logging.Formatter):
+    """Formats a record as text followed by the event's fields as key=value pairs."""
+    def format(self, record):
+        text = logging.Formatter.format(self, record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join('{}={}'.format(k, v) for k, v in fields.items())
+        return text
+
+
+class _EventQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the writer thread."""
+    def prepare(self, record):
+        # the stock prepare() formats and copies every record on the
+        # caller's thread; only what cannot cross threads is resolved here
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class EventLog(object):
+    """
+    Writes the records of a logger tree as JSON lines from a background thread.
+
+    Attributes:
+        path: The log file, rotated to path.1, path.2, ... at max_bytes; None for none.
+        logger: The logger the queue handler is attached to.
+        level: The lowest level written.
+        handlers: The handlers the background thread writes to.
+    """
+    def __init__(self, path=LOG_FILE, max_bytes=MAX_BYTES, backups=BACKUPS,
+                 level=logging.INFO, logger='wincup', console=None):
+        """console, if given, is a stream that also gets every record as text."""
+        self.path = path
+        self.logger = logging.getLogger(logger)
+        self.level = level
+        self.handlers = []
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                          encoding='utf-8', delay=True)
+            handler.setFormatter(JSONFormatter())
+            self.handlers.append(handler)
+        if console is not None:
+            handler = logging.StreamHandler(console)
+            handler.setFormatter(EventFormatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+            self.handlers.append(handler)
+        self.queue = queue.SimpleQueue()
+        self.handler = _EventQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, *self.handlers)
+
+    def start(self):
+        if self.logger.level == logging.NOTSET or self.logger.level > self.level:
+            self.logger.setLevel(self.level)
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """Detaches the handler and writes out everything still queued."""
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
@@ -14,331 +14,150 @@ CON_EXPLAIN = 'The scale of difference between\nblack and white.\nHigher is more
 SHA_EXPLAIN = 'The harshness of edges.\nHigher is sharper.'
 SHU_EXPLAIN = 'How fast the image is captured\nmeasured in microseconds.\nHigher is slower.'
 
-class BrightnessFrame(ttk.Frame):
+# The manually tunable camera settings, keyed by their PiCamera attribute.
+# A parameter has either a numeric range stepped by delta or a list of choices.
+PARAMETERS = {
+    'brightness': {'label': 'Brightness', 'explain': BRI_EXPLAIN,
+                   'minimum': 0, 'maximum': 100, 'delta': BRI_DELTA},
+    'contrast': {'label': 'Contrast', 'explain': CON_EXPLAIN,
+                 'minimum': -100, 'maximum': 100, 'delta': CON_DELTA},
+    'sharpness': {'label': 'Sharpness', 'explain': SHA_EXPLAIN,
+                  'minimum': -100, 'maximum': 100, 'delta': SHA_DELTA},
+    'shutter_speed': {'label': 'Shutter Speed', 'explain': SHU_EXPLAIN,
+                      'minimum': SHU_MIN, 'maximum': SHU_MAX, 'delta': SHU_DELTA},
+    'rotation': {'label': 'Rotation', 'choices': (0, 90, 180, 270), 'unit': 'deg'},
+}
+
+_INTEGER = re.compile('^-?[0-9]+$')
+
+
+class ParameterFrame(ttk.Frame):
     """
-    This class builds a frame for manipulating the 'brightness' setting.
+    This class builds a frame for manipulating one camera setting.
 
-    Attributes:
-        master: The master or parent widget for this frame.
-        value: The value for the 'brightness' setting.
-    """
-    def __init__(self, master, var, *args, **kwargs):
-        """
-        Inits BrightnessFrame with master and value.
-        Creates entry and buttons for 'brightness' value.
-        """
-        ttk.Frame.__init__(self, master, *args, **kwargs)
-        vcmd = (master.register(self.onValidate), '%P')
-        self.master = master
-        self.value = var
-
-        self.label = ttk.Label(self, text='Brightness:', font='-weight bold')
-        self.explain = ttk.Label(self, text=BRI_EXPLAIN, font='-size 10')
-        self.buttona = ttk.Button(self, text='+', command=self.add, width=2)
-        self.buttons = ttk.Button(self, text='-', command=self.sub, width=2)
-        self.entry = ttk.Entry(self, width=5, validate='all',
-                               validatecommand=vcmd, textvariable=self.value)
-
-        self.label.grid(row=1, column=1, sticky='w', columnspan=5)
-        self.explain.grid(row=2, column=1, sticky='w', columnspan=5)
-        self.entry.grid(row=3, column=2)
-        self.buttona.grid(row=3, column=3)
-        self.buttons.grid(row=3, column=4)
-
-        self.rowconfigure(0, weight=1)
-        self.rowconfigure(4, weight=1)
-        self.columnconfigure(0, weight=1)
-        self.columnconfigure(5, weight=1)
-
-    def add(self):
-        """Adds BRI_DELTA to value and updates entry."""
-        val = int(self.value.get())
-        if val >= 100 - BRI_DELTA:
-            val = 100
-        elif val < 100 - BRI_DELTA and val >= 0:
-            val += BRI_DELTA
-        else:
-            val = 0
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
-
-    def sub(self):
-        """Subtracts BRI_DELTA from value and updates entry."""
-        val = int(self.value.get())
-        if val > 100:
-            val = 100
-        elif val <= 100 and val >= BRI_DELTA + 0:
-            val -= BRI_DELTA
-        else:
-            val = 0
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
-
-    def onValidate(self, value):
-        """Checks if 0 <= value <= 100"""
-        p = re.compile('^[0-9]$|^[1-9][0-9]$|^100$')
-        if p.match(value):
-            return True
-        return False
-
-class ContrastFrame(ttk.Frame):
-    """
-    This class builds a frame for manipulating the 'contrast' setting.
+    The widgets are built from the setting's entry in PARAMETERS: an entry
+    with +/- buttons for a numeric range, or radio buttons for a list of
+    choices. Every change is clamped to the range and passed to on_change,
+    so it can be applied to a running camera straight away.
 
     Attributes:
         master: The master or parent widget for this frame.
-        value: The value for the 'contrast' setting.
+        name: The name of the setting, a key of PARAMETERS.
+        value: The variable holding the setting.
+        spec: The setting's entry in PARAMETERS.
+        on_change: Called as on_change(name, value) after every change, or None.
+        buttons: The setting's buttons, a list either way: + and - for a
+            range, one radio button per choice.
     """
-    def __init__(self, master, var, *args, **kwargs):
+    def __init__(self, master, name, var, on_change=None, *args, **kwargs):
         """
-        Inits ContrastFrame with master and value.
-        Creates entry and buttons for 'contrast' value.
+        Inits ParameterFrame with master, name and value.
+        Creates the widgets for the setting.
         """
         ttk.Frame.__init__(self, master, *args, **kwargs)
-        vcmd = (master.register(self.onValidate), '%P')
         self.master = master
+        self.name = name
         self.value = var
+        self.spec = PARAMETERS[name]
+        self.on_change = on_change
 
-        self.label = ttk.Label(self, text='Contrast:', font='-weight bold')
-        self.explain = ttk.Label(self, text=CON_EXPLAIN, font='-size 10')
-        self.buttona = ttk.Button(self, text='+', command=self.add, width=2)
-        self.buttons = ttk.Button(self, text='-', command=self.sub, width=2)
-        self.entry = ttk.Entry(self, width=5, validate='all',
+        self.label = ttk.Label(self, text=self.spec['label'] + ':', font='-weight bold')
+        if 'choices' in self.spec:
+            self._init_choices()
+        else:
+            self._init_range()
+
+    def _init_range(self):
+        vcmd = (self.master.register(self.onValidate), '%P')
+        self.explain = ttk.Label(self, text=self.spec['explain'], font='-size 10')
+        self.button_add = ttk.Button(self, text='+', command=self.add, width=2)
+        self.button_sub = ttk.Button(self, text='-', command=self.sub, width=2)
+        self.buttons = [self.button_add, self.button_sub]
+        self.entry = ttk.Entry(self, width=5, validate='key',
                                validatecommand=vcmd, textvariable=self.value)
+        self.entry.bind('<Return>', self.commit)
+        self.entry.bind('<FocusOut>', self.commit)
 
         self.label.grid(row=1, column=1, sticky='w', columnspan=5)
         self.explain.grid(row=2, column=1, sticky='w', columnspan=5)
         self.entry.grid(row=3, column=2)
-        self.buttona.grid(row=3, column=3)
-        self.buttons.grid(row=3, column=4)
+        self.button_add.grid(row=3, column=3)
+        self.button_sub.grid(row=3, column=4)
 
         self.rowconfigure(0, weight=1)
         self.rowconfigure(4, weight=1)
         self.columnconfigure(0, weight=1)
         self.columnconfigure(5, weight=1)
 
-    def add(self):
-        """Adds 10 to value and updates entry."""
-        val = int(self.value.get())
-        if val >= 100 - CON_DELTA:
-            val = 100
-        elif val < 100 - CON_DELTA and val >= -100:
-            val += CON_DELTA
-        else:
-            val = 0
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
-
-    def sub(self):
-        """Subtracts 10 from value and updates entry."""
-        val = int(self.value.get())
-        if val > 100:
-            val = 100
-        elif val <= 100 and val >= CON_DELTA - 100:
-            val -= CON_DELTA
-        else:
-            val = -100
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
-
-    def onValidate(self, value):
-        """Checks if -100 <= value <= 100"""
-        p = re.compile('^0$|^-?[1-9]$|^-?[1-9][0-9]$|^-?100$')
-        if p.match(value):
-            return True
-        return False
-
-class RotationFrame(ttk.Frame):
-    """
-    This class builds a frame for manipulating the 'rotation' setting.
-
-    Attributes:
-        master: The master or parent widget for this frame.
-        value: The value for the 'rotation' setting.
-    """
-    def __init__(self, master, var, *args, **kwargs):
-        """
-        Inits RotationFrame with master and value.
-        Creates radio buttons for 'rotation' options.
-        """
-        ttk.Frame.__init__(self, master, *args, **kwargs)
-        self.master = master
-        self.value = var
-
-        self.label = ttk.Label(self, text='Rotation:', font='-weight bold')
-        self.rb1 = ttk.Radiobutton(self, text='0 deg', value=0,
-                                   variable=self.value)
-        self.rb2 = ttk.Radiobutton(self, text='90 deg', value=90,
-                                   variable=self.value)
-        self.rb3 = ttk.Radiobutton(self, text='180 deg', value=180,
-                                   variable=self.value)
-        self.rb4 = ttk.Radiobutton(self, text='270 deg', value=270,
-                                   variable=self.value)
+    def _init_choices(self):
+        unit = self.spec.get('unit', '')
+        self.buttons = []
+        for choice in self.spec['choices']:
+            rb = ttk.Radiobutton(self, text='{} {}'.format(choice, unit).strip(), value=choice,
+                                 variable=self.value, command=self.commit)
+            self.buttons.append(rb)
 
         self.label.grid(row=1, column=1, sticky='w', columnspan=2)
-        self.rb1.grid(row=2, column=2, sticky='w')
-        self.rb2.grid(row=3, column=2, sticky='w')
-        self.rb3.grid(row=4, column=2, sticky='w')
-        self.rb4.grid(row=5, column=2, sticky='w')
+        for i, rb in enumerate(self.buttons):
+            rb.grid(row=i + 2, column=2, sticky='w')
 
         self.rowconfigure(0, weight=1)
-        self.rowconfigure(6, weight=1)
+        self.rowconfigure(len(self.buttons) + 2, weight=1)
         self.columnconfigure(0, weight=1)
         self.columnconfigure(3, weight=1)
 
-class SharpnessFrame(ttk.Frame):
-    """
-    This class builds a frame for manipulating the 'sharpness' setting.
-
-    Attributes:
-        master: The master or parent widget for this frame.
-        value: The value for the 'sharpness' setting.
-    """
-    def __init__(self, master, var, *args, **kwargs):
-        """
-        Inits SharpnessFrame with master and value.
-        Creates entry and buttons for 'sharpness' value.
-        """
-        ttk.Frame.__init__(self, master, *args, **kwargs)
-        vcmd = (master.register(self.onValidate), '%P')
-        self.master = master
-        self.value = var
-
-        self.label = ttk.Label(self, text='Sharpness:', font='-weight bold')
-        self.explain = ttk.Label(self, text=SHA_EXPLAIN, font='-size 10')
-        self.buttona = ttk.Button(self, text='+', command=self.add, width=2)
-        self.buttons = ttk.Button(self, text='-', command=self.sub, width=2)
-        self.entry = ttk.Entry(self, width=5, validate='all',
-                               validatecommand=vcmd, textvariable=self.value)
-
-        self.label.grid(row=1, column=1, sticky='w', columnspan=5)
-        self.explain.grid(row=2, column=1, sticky='w', columnspan=5)
-        self.entry.grid(row=3, column=2)
-        self.buttona.grid(row=3, column=3)
-        self.buttons.grid(row=3, column=4)
-
-        self.rowconfigure(0, weight=1)
-        self.rowconfigure(4, weight=1)
-        self.columnconfigure(0, weight=1)
-        self.columnconfigure(5, weight=1)
+    def clamp(self, val):
+        """Returns val limited to the setting's range, or its nearest choice."""
+        if 'choices' in self.spec:
+            return min(self.spec['choices'], key=lambda c: abs(c - val))
+        return max(self.spec['minimum'], min(self.spec['maximum'], val))
+
+    def get(self):
+        """Returns the current value, clamped; the minimum while the entry is empty."""
+        try:
+            val = int(self.value.get())
+        except (tk.TclError, ValueError):
+            val = self.spec['choices'][0] if 'choices' in self.spec else self.spec['minimum']
+        return self.clamp(val)
+
+    def set(self, val):
+        """Sets the value, clamped, and reports it to on_change."""
+        val = self.clamp(val)
+        self.value.set(val)
+        if self.on_change is not None:
+            self.on_change(self.name, val)
 
     def add(self):
-        """Adds 10 to value and updates entry."""
-        val = int(self.value.get())
-        if val >= 100 - SHA_DELTA:
-            val = 100
-        elif val < 100 - SHA_DELTA and val >= -100:
-            val += SHA_DELTA
-        else:
-            val =-100
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
+        """Adds the setting's delta to value."""
+        self.set(self.get() + self.spec['delta'])
 
     def sub(self):
-        """Subtracts 10 from value and updates entry."""
-        val = int(self.value.get())
-        if val > 100:
-            val = 100
-        elif val <= 100 and val >= SHA_DELTA - 100:
-            val -= SHA_DELTA
-        else:
-            val = 0
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
+        """Subtracts the setting's delta from value."""
+        self.set(self.get() - self.spec['delta'])
 
-    def onValidate(self, value):
-        """Checks if -100 <= value <= 100"""
-        p = re.compile('^0$|^-?[1-9]$|^-?[1-9][0-9]$|^-?100$')
-        if p.match(value):
-            return True
-        return False
+    def commit(self, event=None):
+        """Applies a typed or selected value."""
+        self.set(self.get())
 
-class ShutterSpeedFrame(ttk.Frame):
-    """
-    This class builds a frame for manipulating the 'shutter_speed' setting.
-
-    Attributes:
-        master: The master or parent widget for this frame.
-        value: The value for the 'shutter_speed' setting.
-    """
-    def __init__(self, master, var, *args, **kwargs):
-        """
-        Inits ShutterSpeedFrame with master and value.
-        Creates entry and buttons for 'shutter_speed' value.
+    def onValidate(self, value):
         """
-        ttk.Frame.__init__(self, master, *args, **kwargs)
-        vcmd = (master.register(self.onValidate), '%P')
-        self.master = master
-        self.value = var
-
-        self.label = ttk.Label(self, text='Shutter Speed:', font='-weight bold')
-        self.explain = ttk.Label(self, text=SHU_EXPLAIN, font='-size 10')
-        self.buttona = ttk.Button(self, text='+', command=self.add, width=2)
-        self.buttons = ttk.Button(self, text='-', command=self.sub, width=2)
-        self.entry = ttk.Entry(self, width=5, validate='all',
-                               validatecommand=vcmd, textvariable=self.value)
+        Checks if value can be typed into the entry.
 
-        self.label.grid(row=1, column=1, sticky='w', columnspan=5)
-        self.explain.grid(row=2, column=1, sticky='w', columnspan=5)
-        self.entry.grid(row=3, column=2)
-        self.buttona.grid(row=3, column=3)
-        self.buttons.grid(row=3, column=4)
-
-        self.rowconfigure(0, weight=1)
-        self.rowconfigure(4, weight=1)
-        self.columnconfigure(0, weight=1)
-        self.columnconfigure(5, weight=1)
-
-    def add(self):
-        """Adds SHU_DELTA to value and updates entry."""
-        val = int(self.value.get())
-        if val >= SHU_MAX - SHU_DELTA:
-            val = SHU_MAX
-        elif val < SHU_MAX - SHU_DELTA and val >= SHU_MIN:
-            val += SHU_DELTA
-        else:
-            val = SHU_MIN
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
-
-    def sub(self):
-        """Subtracts SHU_DELTA from value and updates entry."""
-        val = int(self.value.get())
-        if val > SHU_MAX:
-            val = SHU_MAX
-        elif val <= SHU_MAX and val >= SHU_DELTA + SHU_MIN:
-            val -= SHU_DELTA
-        else:
-            val = vSHU_MIN
-        self.entry.delete(0, 'end')
-        self.entry.insert(0, val)
-        self.value.set(val)
-
-    def onValidate(self, value):
-        """Checks if SHU_MIN <= value <= SHU_MAX"""
-        if int(value) >= SHU_MIN and int(value) <= SHU_MAX:
+        Partial input is allowed (an empty entry, a lone '-' for settings that
+        go below zero, or a number on its way into the range); commit() clamps
+        it once the entry is left.
+        """
+        low, high = min(self.spec['minimum'], 0), self.spec['maximum']
+        if value == '' or (value == '-' and low < 0):
             return True
-        return False
+        if not _INTEGER.match(value):
+            return False
+        return low <= int(value) <= high
+
 
 if __name__ == '__main__':
     root = tk.Tk()
-    bri = BrightnessFrame(root, tk.IntVar())
-    con = ContrastFrame(root, tk.IntVar())
-    rot = RotationFrame(root, tk.IntVar())
-    sha = SharpnessFrame(root, tk.IntVar())
-    shu = ShutterSpeedFrame(root, tk.IntVar())
-
-    bri.pack()
-    con.pack()
-    rot.pack()
-    sha.pack()
-    shu.pack()
+    for name in PARAMETERS:
+        ParameterFrame(root, name, tk.IntVar(), on_change=lambda n, v: print(n, v)).pack()
 
     root.mainloop()
@@ -0,0 +1,237 @@
+"""
+Defect heatmap accumulated over a shift.
+
+Every cycle's threshold mask is reduced to a coarse grid of CELL x CELL pixel
+cells, and each cell the mask touched gets one count added. The counts live in
+one fixed-size integer array, and the reduction is written into preallocated
+buffers, so a heatmap costs the same few kilobytes after a million cycles as
+after one. Spots that fail over and over stand out. A single splash does not.
+
+The heatmap is saved next to the baseline it belongs to, in the baseline file
+format (see baseline.py): periodically while analyzing and once more on
+shutdown. A heatmap saved with other camera settings no longer lines up with
+the mold and is started afresh.
+
+    python heatmap.py --recipe cup-12oz --png heatmap.png --csv heatmap.csv
+"""
+import argparse
+from datetime import datetime
+import os
+import sys
+import time
+
+from startup import LazyModule
+
+import baseline
+import capture
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+HEATMAP_FILE = 'heatmap.wcb'
+CELL = 8
+SAVE_EVERY = 60.0
+ALPHA = 0.5
+
+
+def path_for(baseline_path):
+    """Returns the heatmap file kept next to the baseline at baseline_path."""
+    return os.path.join(os.path.dirname(baseline_path), HEATMAP_FILE)
+
+
+class Heatmap(object):
+    """
+    Counts, per cell of the frame, the cycles whose mask touched it.
+
+    Attributes:
+        size: The (width, height) of the frames.
+        cell: The side of a cell, in pixels.
+        counts: The counts, uint32, one per cell (rows x columns).
+        cycles: The number of cycles added.
+        started: When the first of them was added, as an ISO timestamp.
+        path: The file it is saved to, or None to keep it in memory only.
+        settings: The camera settings it is saved with.
+        every: The seconds between saves by autosave().
+    """
+    def __init__(self, size=capture.CAPTURE_SIZE, cell=CELL, path=None, settings=None, every=SAVE_EVERY):
+        self.size = size
+        self.cell = cell
+        w, h = size
+        shape = (-(-h // cell), -(-w // cell))
+        self.counts = numpy.zeros(shape, numpy.uint32)
+        self.cycles = 0
+        self.started = None
+        self.path = path
+        self.settings = settings
+        self.every = every
+        # the mask padded to whole cells: area resampling by an integer
+        # factor is several times faster than by a fractional one
+        self._padded = numpy.zeros((shape[0] * cell, shape[1] * cell), numpy.uint8)
+        self._small = numpy.empty(shape, numpy.uint8)
+        self._hit = numpy.empty(shape, numpy.bool_)
+        self._saved = time.monotonic()
+
+    @classmethod
+    def load(cls, path, settings=None, size=capture.CAPTURE_SIZE):
+        """
+        Returns the heatmap saved at path.
+
+        Raises baseline.BaselineError if it cannot be read or, when settings
+        are given, was saved with other settings or size.
+        """
+        saved = baseline.load(path, settings, size)
+        header = saved.header
+        if header.get('kind') != 'heatmap':
+            raise baseline.BaselineError('{!r} is not a heatmap'.format(path))
+        heatmap = cls((header['width'], header['height']), header['cell'], path, header['settings'])
+        heatmap.counts[:] = saved.arrays['counts']
+        heatmap.cycles = header['frames']
+        heatmap.started = header.get('started')
+        return heatmap
+
+    @classmethod
+    def open(cls, path, settings, size=capture.CAPTURE_SIZE, cell=CELL, every=SAVE_EVERY):
+        """Returns the heatmap saved at path, or a new one if there is none for these settings."""
+        try:
+            heatmap = cls.load(path, settings, size)
+        except baseline.BaselineError:
+            return cls(size, cell, path, settings, every)
+        if heatmap.cell != cell:
+            return cls(size, cell, path, settings, every)
+        heatmap.settings = settings
+        heatmap.every = every
+        return heatmap
+
+    def add(self, detection):
+        """Adds a detectors.Detection: its mask, or its boxes if it has no mask."""
+        if detection.mask is not None:
+            self.add_mask(detection.mask)
+        else:
+            self.add_boxes(detection.boxes)
+
+    def add_mask(self, mask):
+        """Adds one cycle's binary mask; every cell with a set pixel counts."""
+        # area resampling averages each cell; any set pixel leaves it above 0
+        h, w = mask.shape
+        self._padded[:h, :w] = mask
+        rows, cols = self.counts.shape
+        cv2.resize(self._padded, (cols, rows), dst=self._small, interpolation=cv2.INTER_AREA)
+        numpy.greater(self._small, 0, out=self._hit)
+        self._count()
+
+    def add_boxes(self, boxes):
+        """Adds one cycle's bounding boxes, for detectors that keep no mask."""
+        self._hit[:] = False
+        for (x, y, w, h) in boxes:
+            self._hit[y // self.cell:-(-(y + h) // self.cell), x // self.cell:-(-(x + w) // self.cell)] = True
+        self._count()
+
+    def _count(self):
+        numpy.add(self.counts, self._hit, out=self.counts, casting='unsafe')
+        self.cycles += 1
+        if self.started is None:
+            self.started = datetime.now().isoformat(timespec='seconds')
+
+    def rates(self):
+        """Returns the fraction of cycles that touched each cell."""
+        return self.counts / float(max(self.cycles, 1))
+
+    def hottest(self, n=5):
+        """Returns up to n (x, y, w, h, count) pixel regions of the cells counted most, hottest first."""
+        flat = numpy.argsort(self.counts, axis=None)[::-1][:n]
+        cells = []
+        for row, col in zip(*numpy.unravel_index(flat, self.counts.shape)):
+            count = int(self.counts[row, col])
+            if count:
+                cells.append((int(col) * self.cell, int(row) * self.cell, self.cell, self.cell, count))
+        return cells
+
+    def overlay(self, image, alpha=ALPHA):
+        """Returns a copy of image (RGB or grayscale) with the counted cells colored, hot in red."""
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        else:
+            image = image.copy()
+        peak = int(self.counts.max())
+        if not peak:
+            return image
+        h, w = image.shape[:2]
+        level = (self.counts * (255.0 / peak)).astype(numpy.uint8)
+        level = cv2.resize(level, (self.counts.shape[1] * self.cell, self.counts.shape[0] * self.cell),
+                           interpolation=cv2.INTER_NEAREST)[:h, :w]
+        color = cv2.cvtColor(cv2.applyColorMap(level, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+        blended = cv2.addWeighted(image, 1.0 - alpha, color, alpha, 0)
+        numpy.copyto(image, blended, where=(level > 0)[..., None])
+        return image
+
+    def save(self):
+        """Writes the heatmap to its path, if it has one."""
+        self._saved = time.monotonic()
+        if self.path is None:
+            return
+        baseline.save(self.path, {'counts': self.counts}, self.settings, self.cycles, self.size,
+                      extra={'kind': 'heatmap', 'cell': self.cell, 'started': self.started})
+
+    def autosave(self):
+        """Saves the heatmap if the last save was more than every seconds ago."""
+        if self.every and time.monotonic() - self._saved >= self.every:
+            self.save()
+
+    def reset(self):
+        self.counts[:] = 0
+        self.cycles = 0
+        self.started = None
+
+    def snapshot(self):
+        """Returns a summary of the heatmap as a dict."""
+        return {
+            'cycles': self.cycles,
+            'started': self.started,
+            'cells_hit': int(numpy.count_nonzero(self.counts)),
+            'max_count': int(self.counts.max()),
+            'hottest': self.hottest(3),
+        }
+
+
+def main():
+    import recipes
+
+    parser = argparse.ArgumentParser(description='Export or reset the defect heatmap.')
+    parser.add_argument('--recipe', help='the heatmap of this product, default the active one')
+    parser.add_argument('--path', help='heatmap file, instead of a recipe\'s')
+    parser.add_argument('--png', help='write the heatmap over the baseline image here')
+    parser.add_argument('--csv', help='write the counts per cell here')
+    parser.add_argument('--top', type=int, default=5, help='print the N hottest cells')
+    parser.add_argument('--reset', action='store_true', help='start the heatmap afresh')
+    args = parser.parse_args()
+
+    base_path = recipes.baseline_path() if args.recipe is None else recipes.load_recipe(args.recipe).baseline_path
+    path = args.path or path_for(base_path)
+    try:
+        heatmap = Heatmap.load(path)
+    except baseline.BaselineError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.reset:
+        heatmap.reset()
+        heatmap.save()
+        print('Heatmap {} reset.'.format(path))
+        return 0
+    print('{}: {} cycles since {}'.format(path, heatmap.cycles, heatmap.started))
+    for x, y, w, h, count in heatmap.hottest(args.top):
+        print('  x={:<4} y={:<4} {:>7} cycles  {:6.2%}'.format(x, y, count, count / float(heatmap.cycles)))
+    if args.csv:
+        numpy.savetxt(args.csv, heatmap.counts, fmt='%d', delimiter=',')
+    if args.png:
+        w, h = heatmap.size
+        try:
+            image = numpy.array(baseline.load(base_path, heatmap.settings, heatmap.size).mean)
+        except baseline.BaselineError:
+            image = numpy.zeros((h, w), numpy.uint8)
+        cv2.imwrite(args.png, cv2.cvtColor(heatmap.overlay(image), cv2.COLOR_RGB2BGR))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
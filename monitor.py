@@ -0,0 +1,345 @@
+"""
+Monitoring server for the mold analysis.
+
+Serves the latest analyzed frame as an MJPEG stream, the current verdict as
+JSON and the latency/reject counters over plain HTTP, so a supervisor can
+watch the press without walking to the screen. The analysis loop only ever
+writes into a LatestResult slot; JPEG encoding and all network I/O happen on
+the server's own thread, so slow or numerous clients never add latency to a
+cycle.
+
+Run `python monitor.py --simulate` to serve a simulated camera on localhost.
+"""
+import argparse
+from datetime import datetime
+import json
+import threading
+import time
+
+from startup import LazyModule
+
+asyncio = LazyModule('asyncio')
+cv2 = LazyModule('cv2')
+
+BOUNDARY = b'frame'
+KEEPALIVE = 5.0
+SEND_TIMEOUT = 10.0
+INDEX_PAGE = b"""<html><head><title>Mold Analysis</title></head><body>
+<h1>Mold Analysis</h1><img src="/stream.mjpg"><pre id="v"></pre>
+<script>setInterval(function(){fetch('/verdict').then(function(r){return r.text()})
+.then(function(t){document.getElementById('v').textContent=t})},1000)</script>
+</body></html>"""
+
+
+class AnalysisStats(object):
+    """Running latency and reject counters for the analysis loop."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.cycles = 0
+        self.rejects = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.total_ms = 0.0
+
+    def record(self, latency, rejected):
+        """Adds one cycle that took latency seconds."""
+        ms = latency * 1000.0
+        with self.lock:
+            self.cycles += 1
+            self.rejects += 1 if rejected else 0
+            self.last_ms = ms
+            self.max_ms = max(self.max_ms, ms)
+            self.total_ms += ms
+
+    def snapshot(self):
+        """Returns the counters as a dict."""
+        with self.lock:
+            return {
+                'uptime_s': round(time.time() - self.started, 1),
+                'cycles': self.cycles,
+                'rejects': self.rejects,
+                'latency_last_ms': round(self.last_ms, 2),
+                'latency_max_ms': round(self.max_ms, 2),
+                'latency_avg_ms': round(self.total_ms / self.cycles, 2) if self.cycles else 0.0,
+            }
+
+
+class LatestResult(object):
+    """
+    Single slot holding the newest analysis result.
+
+    publish() only swaps references under a lock, so its cost to the analysis
+    loop does not depend on how many clients are reading. Frames are RGB
+    ordered, the same as what is shown on the screen.
+
+    Attributes:
+        stats: The AnalysisStats updated by publish().
+        metrics: Extra counters for /metrics, as a dict of name to a callable
+            returning a JSON-serializable snapshot.
+    """
+    def __init__(self):
+        self.stats = AnalysisStats()
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self._seq = 0
+        self._frame = None
+        self._verdict = None
+        self._jpeg = (0, None)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def publish(self, frame, boxes, latency):
+        """Stores the annotated frame and verdict of a finished cycle."""
+        rejected = bool(boxes)
+        verdict = {
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'reject': rejected,
+            'objects': len(boxes),
+            'boxes': [list(map(int, b)) for b in boxes],
+            'latency_ms': round(latency * 1000.0, 2),
+        }
+        with self._lock:
+            self._seq += 1
+            verdict['seq'] = self._seq
+            self._frame = frame
+            self._verdict = verdict
+        self.stats.record(latency, rejected)
+
+    def snapshot(self):
+        """Returns the counters of stats and of every entry in metrics."""
+        snapshot = self.stats.snapshot()
+        for name, metric in list(self.metrics.items()):
+            snapshot[name] = metric()
+        return snapshot
+
+    def verdict(self):
+        """Returns the verdict of the latest cycle, or None before the first one."""
+        with self._lock:
+            return self._verdict
+
+    def jpeg(self, quality=80):
+        """Returns (seq, JPEG bytes) of the latest frame, encoding it at most once."""
+        with self._lock:
+            seq, frame = self._seq, self._frame
+        if frame is None:
+            return seq, None
+        with self._encode_lock:
+            if self._jpeg[0] != seq:
+                bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) if frame.ndim == 3 else frame
+                ok, buf = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if ok:
+                    self._jpeg = (seq, buf.tobytes())
+            return self._jpeg
+
+
+class MonitorServer(object):
+    """
+    Asyncio HTTP server publishing a LatestResult.
+
+    Attributes:
+        latest: The LatestResult to serve.
+        host: The interface to listen on; only this machine by default, as
+            the server has no authentication.
+        port: The port to listen on; 0 picks a free port, read back after start().
+        max_fps: The highest frame rate sent to any single MJPEG client.
+        keepalive: Seconds after which an MJPEG client is sent the last
+            frame again while there is no new one, so a client that is gone
+            without closing the connection is noticed.
+        send_timeout: Seconds a client may take to accept a frame before it
+            is dropped.
+        streams: The MJPEG clients connected.
+        error: The exception that kept the server from listening, if any.
+    """
+    def __init__(self, latest, host='127.0.0.1', port=8000, max_fps=5, keepalive=KEEPALIVE,
+                 send_timeout=SEND_TIMEOUT):
+        self.latest = latest
+        self.host = host
+        self.port = port
+        self.max_fps = max_fps
+        self.keepalive = keepalive
+        self.send_timeout = send_timeout
+        self.streams = 0
+        self.loop = None
+        self.thread = None
+        self.error = None
+        self._server = None
+        self._handlers = set()
+        self._closing = False
+        self._ready = threading.Event()
+
+    def start(self):
+        """
+        Runs the server on a daemon thread and returns once it is listening;
+        raises the error, e.g. an OSError for a port in use, if it cannot.
+        """
+        self.thread = threading.Thread(target=self._run, name='monitor', daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+        return self
+
+    def stop(self):
+        """Closes the server and waits for its thread to exit."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            self.loop = loop
+        except Exception as e:
+            self.error = e
+            loop.close()
+            return
+        finally:
+            # start() waits for this, whether or not the server is listening
+            self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self._server.close()
+            # streams never end by themselves; wait_closed() waits for
+            # them on newer Pythons, and the loop must not close under them.
+            # The flag ends a stream whose wait_for() swallowed the cancel.
+            self._closing = True
+            for task in self._handlers:
+                task.cancel()
+            if self._handlers:
+                self.loop.run_until_complete(asyncio.wait(list(self._handlers)))
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+            self.loop.close()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) > 1 else '/'
+            if path == '/':
+                await self._respond(writer, 'text/html', INDEX_PAGE)
+            elif path == '/verdict':
+                await self._respond_json(writer, self.latest.verdict())
+            elif path == '/metrics':
+                await self._respond_json(writer, self.latest.snapshot())
+            elif path == '/snapshot.jpg':
+                await self._snapshot(writer)
+            elif path == '/stream.mjpg':
+                await self._stream(reader, writer)
+            else:
+                await self._respond(writer, 'text/plain', b'Not Found', status='404 Not Found')
+        except (ConnectionError, asyncio.CancelledError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(task)
+
+    async def _respond(self, writer, content_type, body, status='200 OK'):
+        head = 'HTTP/1.0 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nCache-Control: no-cache\r\n\r\n'
+        writer.write(head.format(status, content_type, len(body)).encode('latin-1') + body)
+        await writer.drain()
+
+    async def _respond_json(self, writer, obj):
+        await self._respond(writer, 'application/json', json.dumps(obj).encode('utf-8'))
+
+    async def _snapshot(self, writer):
+        seq, jpeg = await self.loop.run_in_executor(None, self.latest.jpeg)
+        if jpeg is None:
+            await self._respond(writer, 'text/plain', b'No frame yet', status='503 Service Unavailable')
+        else:
+            await self._respond(writer, 'image/jpeg', jpeg)
+
+    async def _stream(self, reader, writer):
+        """
+        Sends each new frame until the client goes away: it closes the
+        connection, stops accepting frames for send_timeout, or, silently
+        gone, makes a keep-alive resend fail.
+        """
+        writer.write(b'HTTP/1.0 200 OK\r\nCache-Control: no-cache\r\n'
+                     b'Content-Type: multipart/x-mixed-replace; boundary=' + BOUNDARY + b'\r\n\r\n')
+        # the client sends nothing more, so this returns once it hangs up
+        closed = self.loop.create_task(reader.read())
+        self.streams += 1
+        interval = 1.0 / self.max_fps
+        sent = 0
+        last = None
+        resent = self.loop.time()
+        try:
+            while not (self._closing or closed.done() or writer.is_closing()):
+                started = self.loop.time()
+                if self.latest.seq != sent:
+                    sent, last = await self.loop.run_in_executor(None, self.latest.jpeg)
+                    if last is not None:
+                        await self._send_frame(writer, last)
+                        resent = started
+                elif last is not None and started - resent >= self.keepalive:
+                    await self._send_frame(writer, last)
+                    resent = started
+                await asyncio.wait([closed], timeout=max(0.0, interval - (self.loop.time() - started)))
+        finally:
+            self.streams -= 1
+            closed.cancel()
+            if closed.done() and not closed.cancelled():
+                # retrieved, so a reset connection is not logged as unhandled
+                closed.exception()
+
+    async def _send_frame(self, writer, jpeg):
+        writer.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                     + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+        # a slow client only ever blocks its own coroutine here, and not for long
+        await asyncio.wait_for(writer.drain(), self.send_timeout)
+
+
+def run_simulation(latest, period, sens):
+    """Feeds latest from a SimulatedCamera every period seconds, forever."""
+    import analysis
+    import simulate as sim
+
+    camera = sim.SimulatedCamera()
+    base_gray = camera.background()
+    while True:
+        start = time.monotonic()
+        image_gray = camera.read_gray()
+        boxes = analysis.find_objects(analysis.difference(base_gray, image_gray, sens))
+        image = analysis.annotate(camera.color_image(), boxes)
+        latest.publish(image, boxes, time.monotonic() - start)
+        time.sleep(period)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the mold analysis monitor.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-fps', type=float, default=5)
+    parser.add_argument('--simulate', action='store_true', help='analyze a simulated camera')
+    parser.add_argument('--period', type=float, default=0.5, help='simulated press cycle in seconds')
+    args = parser.parse_args()
+
+    latest = LatestResult()
+    server = MonitorServer(latest, args.host, args.port, args.max_fps).start()
+    print('Serving on http://{}:{}/'.format(args.host, server.port))
+    try:
+        if args.simulate:
+            run_simulation(latest, args.period, 25)
+        else:
+            server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+"""
+Verdict output from a dedicated high-priority thread.
+
+The red and green LED pins can be wired into the press's stop circuit, so the
+time from the switch to the pins matters more than anything else in a cycle.
+OutputController owns the two pins on a thread that does nothing but drive
+them. The thread raises itself to SCHED_FIFO where the OS allows it (running
+as root or with CAP_SYS_NICE) and to a lower nice value otherwise, so the
+kernel wakes it ahead of the capture, Tk and the X server.
+
+signal() does not touch the pins, which may be slow: it queues the verdict,
+notifies the thread through a threading.Condition and returns. The thread
+sleeps on the condition while there is nothing to do, so it costs nothing
+between cycles. It still needs the GIL to write a pin, so under pure-Python
+load the handoff from signal() to the pins can take up to the interpreter's
+switch interval (5 ms by default); `python output.py` measures it.
+
+Every trigger-in (arm()) and signal-out is timestamped with time.monotonic().
+The delay from signal() to the pins (handoff) and from the switch to the pins
+(latency) are kept as histograms next to the counters. With a deadline, a
+trigger that gets no verdict in time is answered with reject, so a stalled or
+crashed analysis stops the press instead of letting it run unchecked. That
+reject holds: a verdict that comes in afterwards for the same or an older
+trigger is dropped and counted, so a late pass cannot restart the press.
+
+Run `python output.py` to measure the jitter against simulated pins, under
+GIL and CPU load.
+"""
+import argparse
+from bisect import bisect_right
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import eventlog
+
+PRIORITY = 50
+NICE = -10
+EDGES_MS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100)
+RING = 64
+WAIT = 0.05
+POLICIES = ('normal', 'nice', 'fifo')
+
+_PASS, _REJECT, _ARM, _OFF, _STOP = range(5)
+
+log = logging.getLogger('wincup.output')
+
+
+class Histogram(object):
+    """
+    Counts durations into fixed millisecond buckets.
+
+    Attributes:
+        edges: The upper bounds of the buckets, in milliseconds; a last bucket
+            holds everything above.
+        values: The bucket counts followed by the count, total, minimum and
+            maximum; a list, or a slice of shared memory to share it.
+    """
+    def __init__(self, edges=EDGES_MS, values=None):
+        self.edges = edges
+        self.values = [0.0] * self.length(edges) if values is None else values
+        self._count = len(edges) + 1
+        self.values[self._count + 2] = float('inf')
+
+    @staticmethod
+    def length(edges=EDGES_MS):
+        """The number of values a histogram with these edges keeps."""
+        return len(edges) + 5
+
+    @property
+    def counts(self):
+        return [int(n) for n in self.values[:self._count]]
+
+    @property
+    def count(self):
+        return int(self.values[self._count])
+
+    def add(self, seconds):
+        ms = seconds * 1000.0
+        v, i = self.values, self._count
+        v[bisect_right(self.edges, ms)] += 1
+        v[i] += 1
+        v[i + 1] += ms
+        v[i + 2] = min(v[i + 2], ms)
+        v[i + 3] = max(v[i + 3], ms)
+
+    def percentile(self, q):
+        """
+        Returns an upper bound of the q-th percentile in milliseconds: the
+        upper edge of its bucket, or the maximum if that is lower.
+        """
+        count = self.count
+        if not count:
+            return None
+        high = round(self.values[self._count + 3], 3)
+        seen = 0
+        for edge, n in zip(self.edges, self.counts):
+            seen += n
+            if seen >= count * q / 100.0:
+                return min(edge, high)
+        return high
+
+    def snapshot(self):
+        """Returns the counts and summary as a dict."""
+        count, total, low, high = self.values[self._count:self._count + 4]
+        labels = ['<{}'.format(e) for e in self.edges] + ['>={}'.format(self.edges[-1])]
+        return {
+            'count': int(count),
+            'mean_ms': round(total / count, 3) if count else None,
+            'min_ms': round(low, 3) if count else None,
+            'max_ms': round(high, 3),
+            'jitter_ms': round(high - low, 3) if count else None,
+            'p99_ms': self.percentile(99),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+def elevate(priority=PRIORITY, nice=NICE):
+    """
+    Raises the calling thread's scheduling priority as far as allowed;
+    returns what it got. On Linux both calls apply to the calling thread
+    only; elsewhere they may raise the whole process.
+    """
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return 'fifo'
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, nice)
+        return 'nice'
+    except (AttributeError, OSError):
+        return 'normal'
+
+
+class OutputController(object):
+    """
+    Drives the verdict pins from a dedicated thread.
+
+    Attributes:
+        pins: The (reject, pass) pins, e.g. the red and green LEDs.
+        priority: The SCHED_FIFO priority asked for, or None to leave the scheduling alone.
+        deadline: Seconds after arm() by which a verdict must be out, or None.
+        timeout: Seconds to wait for the thread to start and stop.
+        policy: The scheduling the thread got, one of POLICIES.
+        requested: The verdicts handed to the thread.
+        signals: The verdicts the thread has handled, put out or dropped.
+        late: The triggers the deadline answered with reject.
+        dropped: The verdicts dropped because the deadline had answered their trigger.
+        handoff: The Histogram of the delays from signal() to the pins.
+        latency: The Histogram of the delays from the trigger-in to the pins.
+    """
+    def __init__(self, factory, pins, priority=PRIORITY, deadline=None, edges=EDGES_MS, timeout=2.0,
+                 **kwargs):
+        """
+        Opens factory(pin, **kwargs) for each of pins, e.g. gpiozero.LED or
+        simulate.SimulatedLED, and starts the thread driving them.
+        """
+        self.pins = pins
+        self.priority = priority
+        self.deadline = deadline
+        self.timeout = timeout
+        self.policy = 'normal'
+        self.requested = 0
+        self.signals = 0
+        self.late = 0
+        self.dropped = 0
+        self.handoff = Histogram(edges)
+        self.latency = Histogram(edges)
+        self.verdict = None
+        self._leds = []
+        try:
+            for pin in pins:
+                self._leds.append(factory(pin, **kwargs))
+        except Exception:
+            for led in self._leds:
+                led.close()
+            raise
+        self._lock = threading.Lock()
+        # the thread waits on _wake for messages, signaled() on _done for verdicts
+        self._wake = threading.Condition(self._lock)
+        self._done = threading.Condition(self._lock)
+        self._messages = collections.deque()
+        # signal-out time of each of the last RING verdicts, None if dropped
+        self._outs = {}
+        self._closed = False
+        self._ready = threading.Event()
+        self.thread = threading.Thread(target=self._drive, name='output', daemon=True)
+        self.thread.start()
+        self._ready.wait(timeout)
+
+    @property
+    def alive(self):
+        """Whether the output thread is running."""
+        return not self._closed and self.thread.is_alive()
+
+    def _set(self, reject):
+        led_r, led_g = self._leds
+        if reject:
+            led_r.on()
+            led_g.off()
+        else:
+            led_r.off()
+            led_g.on()
+
+    def _drive(self):
+        if self.priority is not None:
+            self.policy = elevate(self.priority)
+        self._ready.set()
+        # trigger-ins still waiting for a verdict, oldest first, the trigger-in
+        # of the last verdict and that of the last one the deadline expired
+        armed = collections.deque()
+        answered = expired = 0.0
+        try:
+            while True:
+                with self._lock:
+                    while not self._messages:
+                        if self.deadline is None or not armed:
+                            self._wake.wait()
+                            continue
+                        left = armed[0] + self.deadline - time.monotonic()
+                        if left <= 0:
+                            break
+                        self._wake.wait(left)
+                    messages, self._messages = self._messages, collections.deque()
+                for kind, triggered, called in messages:
+                    if kind == _ARM:
+                        # the verdict can beat the arm() from the switch's thread
+                        if triggered > answered:
+                            armed.append(triggered)
+                    elif kind == _PASS or kind == _REJECT:
+                        answered = max(answered, triggered)
+                        while armed and armed[0] <= answered:
+                            armed.popleft()
+                        out = None
+                        if not (triggered and triggered <= expired):
+                            self._set(kind == _REJECT)
+                            out = time.monotonic()
+                        with self._lock:
+                            if out is None:
+                                # the fail-safe has answered it already; the
+                                # pins keep its reject
+                                self.dropped += 1
+                            else:
+                                self.handoff.add(out - called)
+                                if triggered:
+                                    self.latency.add(out - triggered)
+                                self.verdict = 'reject' if kind == _REJECT else 'pass'
+                            self.signals += 1
+                            self._outs[self.signals] = out
+                            self._outs.pop(self.signals - RING, None)
+                            self._done.notify_all()
+                    elif kind == _OFF:
+                        armed.clear()
+                        for led in self._leds:
+                            led.off()
+                        with self._lock:
+                            self.verdict = None
+                    else:
+                        return
+                if self.deadline is not None and armed and time.monotonic() >= armed[0] + self.deadline:
+                    # fail safe: nothing came in time, so stop the press
+                    expired = armed.popleft()
+                    self._set(True)
+                    with self._lock:
+                        self.verdict = 'reject'
+                        self.late += 1
+        finally:
+            for led in self._leds:
+                led.close()
+            with self._lock:
+                self._done.notify_all()
+
+    def _send(self, kind, triggered=None):
+        with self._lock:
+            if self._closed:
+                return self.requested
+            if kind == _PASS or kind == _REJECT:
+                self.requested += 1
+            self._messages.append((kind, triggered or 0.0, time.monotonic()))
+            self._wake.notify()
+            return self.requested
+
+    def arm(self, triggered):
+        """Records a trigger-in at time.monotonic() triggered, which the deadline then runs from."""
+        self._send(_ARM, triggered)
+
+    def signal(self, reject, triggered=None):
+        """
+        Hands a verdict to the output thread and returns its number, for signaled().
+
+        triggered is the trigger-in it answers. The call does not wait for
+        the pins.
+        """
+        request = self._send(_REJECT if reject else _PASS, triggered)
+        if self.deadline is not None and triggered is not None:
+            waited = time.monotonic() - triggered
+            if waited > self.deadline:
+                eventlog.event(log, 'signal_late', level=logging.WARNING,
+                               waited_ms=round(waited * 1000.0, 2), deadline_ms=self.deadline * 1000.0)
+        return request
+
+    def signaled(self, request, timeout=WAIT):
+        """
+        Returns the time.monotonic() the pins were set for verdict request.
+
+        Waits up to timeout seconds for it; returns None if it is not out
+        yet, was dropped because the deadline had answered its trigger
+        already, or is so long ago that its time has been forgotten.
+        """
+        with self._lock:
+            self._done.wait_for(lambda: self.signals >= request or not self.thread.is_alive(), timeout)
+            return self._outs.get(request)
+
+    def off(self):
+        """Turns both pins off and forgets the pending triggers."""
+        self._send(_OFF)
+
+    def snapshot(self):
+        """Returns the counters and histograms as a dict."""
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'verdict': self.verdict,
+                'requested': self.requested,
+                'signals': self.signals,
+                'late': self.late,
+                'dropped': self.dropped,
+                'handoff': self.handoff.snapshot(),
+                'latency': self.latency.snapshot(),
+                'alive': not self._closed and self.thread.is_alive(),
+            }
+
+    def close(self):
+        """Stops the output thread, which closes the pins."""
+        if self._closed:
+            return
+        self._send(_STOP)
+        with self._lock:
+            self._closed = True
+        if self.thread is not threading.current_thread():
+            self.thread.join(self.timeout)
+
+
+def _spin(stop):
+    # pure Python, so it holds the GIL like annotating and Tk do
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _press(controller, presses, cycles, period):
+    # the switch's thread: arms the trigger-in and hands it to the analysis
+    for _ in range(cycles):
+        triggered = time.monotonic()
+        presses.put(triggered)
+        if controller is not None:
+            controller.arm(triggered)
+        time.sleep(max(0.0, period - (time.monotonic() - triggered)))
+
+
+def _burn(stop):
+    while not stop.is_set():
+        pass
+
+
+def main():
+    import simulate
+
+    parser = argparse.ArgumentParser(description='Measure verdict output jitter on simulated pins.')
+    parser.add_argument('--cycles', type=int, default=2000, help='verdicts to put out')
+    parser.add_argument('--period', type=float, default=0.005, help='seconds between triggers')
+    parser.add_argument('--work', type=float, default=0.001, help='seconds of analysis per cycle')
+    parser.add_argument('--threads', type=int, default=2, help='threads contending for the GIL')
+    parser.add_argument('--procs', type=int, default=1, help='processes contending for the CPU')
+    parser.add_argument('--pin-delay', type=float, default=0.0, help='seconds a simulated pin write takes')
+    parser.add_argument('--priority', type=int, default=PRIORITY, help='SCHED_FIFO priority, 0 for none')
+    parser.add_argument('--direct', action='store_true',
+                        help='drive the pins on the analysis thread instead, for comparison')
+    args = parser.parse_args()
+
+    controller = led_r = led_g = None
+    if args.direct:
+        led_r = simulate.SimulatedLED(5, args.pin_delay)
+        led_g = simulate.SimulatedLED(6, args.pin_delay)
+        latency = Histogram()
+    else:
+        controller = OutputController(simulate.SimulatedLED, (5, 6), args.priority or None, delay=args.pin_delay)
+    stop = threading.Event()
+    stop_procs = multiprocessing.Event()
+    load = [threading.Thread(target=_spin, args=(stop,), daemon=True) for _ in range(args.threads)]
+    load += [multiprocessing.Process(target=_burn, args=(stop_procs,), daemon=True) for _ in range(args.procs)]
+    for worker in load:
+        worker.start()
+    presses = queue.Queue()
+    switch = threading.Thread(target=_press, args=(controller, presses, args.cycles, args.period), daemon=True)
+    switch.start()
+    try:
+        for i in range(args.cycles):
+            triggered = presses.get()
+            # the analysis, holding the GIL
+            while time.monotonic() - triggered < args.work:
+                pass
+            reject = i % 5 == 0
+            if controller is not None:
+                controller.signal(reject, triggered)
+            else:
+                (led_r.on if reject else led_r.off)()
+                (led_g.off if reject else led_g.on)()
+                latency.add(time.monotonic() - triggered)
+    finally:
+        stop.set()
+        stop_procs.set()
+        for worker in load:
+            worker.join()
+        if controller is not None:
+            # let the last verdicts out before reading the histograms
+            controller.signaled(controller.requested)
+            report = controller.snapshot()
+            controller.close()
+    if controller is None:
+        report = {'policy': 'direct', 'latency': latency.snapshot()}
+    report['config'] = vars(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+On-demand profiling of the analysis loop.
+
+ProfileSession wraps the cycle handler. While it is off the wrapper costs one
+attribute check per cycle. Switched on (F9 in the GUI, SIGUSR1 for the
+service), it profiles the next cycles with cProfile, takes tracemalloc and
+live-object snapshots before and after, and writes the reports to a
+timestamped directory under PROFILE_DIR. It switches itself off after a number
+of cycles or a time limit, whichever comes first, so it can be left to run on
+a production press. The snapshots and reports are then taken on a thread of
+their own: the last sampled cycle only unhooks the profiler, so no cycle
+waits for them, though they still share the GIL with it while they are
+written.
+
+Only the thread running the cycle handler is profiled: a cProfile profiler
+cannot be shared between threads, and only one can be enabled at a time on
+Python 3.12+. The follow-up work after the verdict (boxes, annotation,
+display, logging) runs on another thread and is not sampled; the memory and
+object snapshots still cover it.
+
+Reports written per session:
+    cpu.txt      cProfile stats, by cumulative and by own time
+    cpu.prof     the raw stats, for pstats or snakeviz
+    memory.txt   tracemalloc allocation growth by line and by traceback
+    objects.txt  growth in live object counts by type (e.g. PhotoImage)
+    summary.json cycles sampled, duration and peak traced memory
+"""
+import cProfile
+from collections import Counter
+from datetime import datetime
+import gc
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+PROFILE_DIR = 'profiles'
+TOP = 40
+
+log = logging.getLogger('wincup.profiling')
+
+
+def _count_objects():
+    return Counter(type(o).__name__ for o in gc.get_objects())
+
+
+class ProfileSession(object):
+    """
+    Samples cycles with cProfile and tracemalloc on demand.
+
+    Attributes:
+        cycles: How many cycles a session samples.
+        max_seconds: How long a session may run before it stops itself.
+        frames: The traceback depth tracemalloc records.
+        active: Whether a session is running.
+        last_dir: The report directory of the latest session.
+    """
+    def __init__(self, cycles=50, max_seconds=300, frames=10):
+        self.cycles = cycles
+        self.max_seconds = max_seconds
+        self.frames = frames
+        self.active = False
+        self.last_dir = None
+        self._lock = threading.Lock()
+        # held while a cycle is profiled, so stop() waits for it to finish
+        self._sampling = threading.Lock()
+        # the session's profiler, and the same one while cycles are still
+        # to be sampled
+        self._session = None
+        self._profiler = None
+        self._timer = None
+
+    def wrap(self, handler):
+        """Returns handler, profiled while a session is active; wrap only one handler."""
+        def wrapped(*args, **kwargs):
+            if self.active:
+                return self._sample(handler, *args, **kwargs)
+            return handler(*args, **kwargs)
+        return wrapped
+
+    def toggle(self, *args):
+        """Starts a session, or stops the running one; safe as a signal handler."""
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        """Starts a session."""
+        with self._lock:
+            if self.active:
+                return
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start(self.frames)
+            self._snapshot = tracemalloc.take_snapshot()
+            self._objects = _count_objects()
+            self._session = self._profiler = cProfile.Profile()
+            self._sampled = 0
+            self._start = time.monotonic()
+            self._timer = threading.Timer(self.max_seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            self.active = True
+        log.info('profiling the next %d cycles (at most %d s)', self.cycles, self.max_seconds)
+
+    def _sample(self, handler, *args, **kwargs):
+        with self._sampling:
+            # stop() may have taken the profiler away since active was checked
+            profiler = self._profiler
+            if profiler is None:
+                return handler(*args, **kwargs)
+            profiler.enable()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self._sampled += 1
+                if self._sampled >= self.cycles:
+                    # no more cycles are sampled; the reports would hold up
+                    # the cycle thread, so stop() writes them on its own
+                    self._profiler = None
+                    threading.Thread(target=self.stop, name='profiling', daemon=True).start()
+
+    def stop(self):
+        """Stops the running session and writes its reports; the caller waits for them."""
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+            with self._sampling:
+                self._profiler = None
+            profiler, self._session = self._session, None
+            self._timer.cancel()
+            duration = time.monotonic() - self._start
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+            objects = _count_objects()
+            path = os.path.join(PROFILE_DIR, datetime.now().strftime('%Y%m%d-%H%M%S'))
+            os.makedirs(path, exist_ok=True)
+            self._write_cpu(path, profiler)
+            self._write_memory(path, snapshot)
+            self._write_objects(path, objects)
+            with open(os.path.join(path, 'summary.json'), 'w') as file:
+                json.dump({'cycles': self._sampled, 'seconds': round(duration, 1),
+                           'traced_peak_bytes': peak}, file, indent=4)
+            self.last_dir = path
+            self._snapshot = None
+        log.info('profiled %d cycles; reports in %s', self._sampled, path)
+
+    def _write_cpu(self, path, profiler):
+        profiler.dump_stats(os.path.join(path, 'cpu.prof'))
+        out = io.StringIO()
+        try:
+            stats = pstats.Stats(profiler, stream=out)
+        except TypeError:
+            # no cycle was sampled, so there are no stats
+            out.write('No cycles were sampled.\n')
+        else:
+            stats.sort_stats('cumulative').print_stats(TOP)
+            stats.sort_stats('tottime').print_stats(TOP)
+        with open(os.path.join(path, 'cpu.txt'), 'w') as file:
+            file.write(out.getvalue())
+
+    def _write_memory(self, path, snapshot):
+        with open(os.path.join(path, 'memory.txt'), 'w') as file:
+            file.write('Allocation growth by line:\n')
+            for stat in snapshot.compare_to(self._snapshot, 'lineno')[:TOP]:
+                file.write('{}\n'.format(stat))
+            file.write('\nAllocation growth by traceback:\n')
+            for stat in snapshot.compare_to(self._snapshot, 'traceback')[:10]:
+                file.write('\n{}\n'.format(stat))
+                for line in stat.traceback.format():
+                    file.write('{}\n'.format(line))
+
+    def _write_objects(self, path, objects):
+        growth = objects.copy()
+        growth.subtract(self._objects)
+        with open(os.path.join(path, 'objects.txt'), 'w') as file:
+            file.write('{:<40} {:>10} {:>10}\n'.format('type', 'growth', 'live'))
+            for name, delta in growth.most_common(TOP):
+                if delta <= 0:
+                    break
+                file.write('{:<40} {:>10} {:>10}\n'.format(name, delta, objects[name]))
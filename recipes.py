@@ -0,0 +1,287 @@
+"""
+Named per-product recipes.
+
+A recipe bundles everything a product needs on the press: the camera settings
+(including the zoom), the sensitivity, the size filter and a calibrated
+baseline. Each one lives in RECIPE_DIR/<name>/ as recipe.json plus a baseline
+file. Activating a recipe copies its camera settings into the 'custom' profile
+of camerasettings.json and records its name there, so a changeover no longer
+needs the settings wizard or a recalibration.
+
+RecipeCache keeps recently used baselines, and the threshold maps derived
+from them, in memory so switching back to a product takes milliseconds. It is
+bounded by a memory budget and evicts the least recently used recipe first.
+"""
+from collections import OrderedDict
+import json
+import os
+import re
+import shutil
+
+from startup import LazyModule
+
+import analysis
+import baseline
+import capture
+import detectors
+import rectify
+
+numpy = LazyModule('numpy')
+
+RECIPE_DIR = 'recipes'
+RECIPE_FILE = 'recipe.json'
+CACHE_BUDGET = 64 * 1024 * 1024
+
+_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9 _.-]{0,63}$')
+
+
+class RecipeError(Exception):
+    """Raised when a recipe does not exist or cannot be saved."""
+
+
+class Recipe(object):
+    """
+    One product's settings.
+
+    Attributes:
+        name: The name of the recipe, also its directory name.
+        settings: The camera settings, in the same form as the 'custom' profile.
+        sensitivity: The threshold used on the difference image.
+        min_size: The smallest width and height of a blob that is rejected.
+        detector: The name of the detector, a key of detectors.DETECTORS.
+        options: Extra options for the detector.
+    """
+    def __init__(self, name, settings, sensitivity=25, min_size=analysis.MIN_OBJECT_SIZE,
+                 detector=detectors.DEFAULT, options=None):
+        self.name = name
+        self.settings = dict(settings, zoom=tuple(settings['zoom']))
+        self.sensitivity = sensitivity
+        self.min_size = min_size
+        self.detector = detector
+        self.options = dict(options or {})
+
+    @property
+    def path(self):
+        return os.path.join(RECIPE_DIR, self.name)
+
+    @property
+    def baseline_path(self):
+        return os.path.join(self.path, baseline.BASELINE_FILE)
+
+    def to_dict(self):
+        return {
+            'settings': dict(self.settings, zoom=list(self.settings['zoom'])),
+            'sensitivity': self.sensitivity,
+            'min_size': self.min_size,
+            'detector': self.detector,
+            'options': self.options,
+        }
+
+    @classmethod
+    def from_dict(cls, name, d):
+        return cls(name, d['settings'], d.get('sensitivity', 25),
+                   d.get('min_size', analysis.MIN_OBJECT_SIZE),
+                   d.get('detector', detectors.DEFAULT), d.get('options'))
+
+
+def list_recipes():
+    """Returns the names of the saved recipes."""
+    if not os.path.isdir(RECIPE_DIR):
+        return []
+    return sorted(name for name in os.listdir(RECIPE_DIR)
+                  if os.path.isfile(os.path.join(RECIPE_DIR, name, RECIPE_FILE)))
+
+
+def load_recipe(name):
+    """Returns the saved recipe called name."""
+    try:
+        with open(os.path.join(RECIPE_DIR, name, RECIPE_FILE)) as file:
+            return Recipe.from_dict(name, json.load(file))
+    except (OSError, ValueError, KeyError) as e:
+        raise RecipeError('cannot load recipe {!r}: {}'.format(name, e))
+
+
+def save_recipe(recipe, baseline_src=None):
+    """Writes recipe to disk, copying the baseline file baseline_src in if given."""
+    if not _NAME.match(recipe.name):
+        raise RecipeError('invalid recipe name {!r}'.format(recipe.name))
+    os.makedirs(recipe.path, exist_ok=True)
+    if baseline_src is not None and os.path.abspath(baseline_src) != os.path.abspath(recipe.baseline_path):
+        shutil.copyfile(baseline_src, recipe.baseline_path + '.tmp')
+        os.replace(recipe.baseline_path + '.tmp', recipe.baseline_path)
+    tmp = os.path.join(recipe.path, RECIPE_FILE + '.tmp')
+    with open(tmp, 'w') as file:
+        json.dump(recipe.to_dict(), file, indent=4, sort_keys=True)
+    os.replace(tmp, os.path.join(recipe.path, RECIPE_FILE))
+
+
+def _read_settings_file():
+    with open(capture.SETTINGS_FILE) as file:
+        return json.load(file)
+
+
+def _write_settings_file(settings):
+    tmp = capture.SETTINGS_FILE + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(settings, file, indent=4, sort_keys=True)
+    os.replace(tmp, capture.SETTINGS_FILE)
+
+
+def active_name():
+    """Returns the name of the active recipe, or None."""
+    return _read_settings_file().get('recipe')
+
+
+def activate(name):
+    """Makes the recipe called name (or no recipe, for None) active and returns it."""
+    settings = _read_settings_file()
+    recipe = None
+    if name is not None:
+        recipe = load_recipe(name)
+        settings['custom'] = recipe.to_dict()['settings']
+    settings['recipe'] = name
+    _write_settings_file(settings)
+    return recipe
+
+
+def _merge(profile, values):
+    for k, v in values.items():
+        if v is None:
+            profile.pop(k, None)
+        else:
+            profile[k] = v
+
+
+def update_settings(values):
+    """
+    Merges values into the 'custom' profile, and into the active recipe's
+    settings; a value of None removes the setting.
+    """
+    settings = _read_settings_file()
+    _merge(settings['custom'], values)
+    _write_settings_file(settings)
+    if settings.get('recipe') is not None:
+        recipe = load_recipe(settings['recipe'])
+        _merge(recipe.settings, values)
+        save_recipe(recipe)
+
+
+def baseline_path():
+    """Returns the baseline file of the active recipe, or the default one."""
+    name = active_name()
+    if name is None:
+        return baseline.BASELINE_FILE
+    return os.path.join(RECIPE_DIR, name, baseline.BASELINE_FILE)
+
+
+class LoadedRecipe(object):
+    """
+    A recipe with its baseline held in memory.
+
+    Attributes:
+        recipe: The Recipe.
+        mean: The baseline image.
+        noise: The per-pixel calibration noise, or None.
+        rectifier: The rectify.Rectifier the baseline was calibrated with, or None.
+        settings_hash: The hash of the camera settings the baseline was captured with.
+    """
+    def __init__(self, recipe, base):
+        self.recipe = recipe
+        self.settings_hash = base.header['settings_hash']
+        self.mean = numpy.array(base.mean)
+        self.noise = None if base.noise is None else numpy.array(base.noise)
+        self.rectifier = rectify.from_arrays(base.arrays)
+        self._limits = {}
+
+    def limit(self, sens=None, noise_factor=None):
+        """
+        Returns the threshold for sens (the recipe's by default), raised by
+        noise_factor times the noise if given; maps are cached per value.
+        """
+        sens = self.recipe.sensitivity if sens is None else sens
+        if self.noise is None or not noise_factor:
+            return sens
+        if (sens, noise_factor) not in self._limits:
+            self._limits[sens, noise_factor] = analysis.threshold_map(self.noise, sens, noise_factor)
+        return self._limits[sens, noise_factor]
+
+    def detector(self, sens=None, name=None, options=None):
+        """
+        Returns a new detector for this recipe.
+
+        name and options default to the recipe's (its options only go with
+        its own detector); an absdiff detector with a noise_factor option
+        gets the cached threshold map.
+        """
+        sens = self.recipe.sensitivity if sens is None else sens
+        name = name or self.recipe.detector
+        if options is None:
+            options = self.recipe.options if name == self.recipe.detector else {}
+        options = dict(options)
+        if name == 'absdiff' and options.get('noise_factor'):
+            options.setdefault('limit', self.limit(sens, options['noise_factor']))
+        return detectors.create(name, self.mean, sens, self.recipe.min_size, self.noise, **options)
+
+    @property
+    def nbytes(self):
+        n = self.mean.nbytes + sum(a.nbytes for a in self._limits.values())
+        n += self.rectifier.nbytes if self.rectifier is not None else 0
+        return n + (self.noise.nbytes if self.noise is not None else 0)
+
+
+class RecipeCache(object):
+    """
+    Least recently used cache of LoadedRecipes bounded by budget bytes.
+
+    The most recently used recipe is always kept, even if it alone is over
+    the budget.
+    """
+    def __init__(self, budget=CACHE_BUDGET):
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, name, size=capture.CAPTURE_SIZE):
+        """
+        Returns the LoadedRecipe called name for analyzing at size, loading it on a miss.
+
+        The recipe file is read on every call: an entry whose baseline was
+        captured with other settings than the recipe has now, or at another
+        size, is reloaded, so the baseline is checked against them again,
+        and a hit gets the recipe as it is now, with its edited sensitivity,
+        detector, ...
+        """
+        recipe = load_recipe(name)
+        entry = self._entries.get(name)
+        if entry is not None and entry.settings_hash == baseline.settings_hash(recipe.settings, size):
+            entry.recipe = recipe
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return entry
+        self._entries.pop(name, None)
+        self.misses += 1
+        base = baseline.load(recipe.baseline_path, recipe.settings, size)
+        entry = LoadedRecipe(recipe, base)
+        self._entries[name] = entry
+        self.trim()
+        return entry
+
+    def invalidate(self, name):
+        """Drops name, e.g. after it was recalibrated."""
+        self._entries.pop(name, None)
+
+    def trim(self):
+        """Evicts least recently used entries until the cache fits the budget."""
+        while len(self._entries) > 1 and self.nbytes > self.budget:
+            self._entries.popitem(last=False)
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,281 @@
+"""
+Lens and perspective correction of the captured frames.
+
+The camera looks at the mold at an angle through a wide lens, so the zoomed
+region is neither square to the mold nor free of barrel distortion. The
+correction is described by two optional entries of a settings profile:
+
+    lens     {'matrix': 3x3 camera matrix, 'dist': distortion coefficients,
+             'size': [width, height] it was measured at, 'zoom': the zoom
+             it was measured through}, measured once with a checkerboard
+             (see main()); the matrix is scaled to the size the frames are
+             analyzed at. It only fits frames of the same zoom, so the
+             settings pages drop it, like the corners, when the zoom
+             changes
+    corners  the four corners of the mold area in the lens-corrected,
+             zoomed frame, as fractions of its width and height, in the
+             order top left, top right, bottom right, bottom left; picked on
+             the zoom page or taken from a checkerboard
+
+build() turns them into a pair of fixed-point remap tables, once. The tables
+are saved in the baseline next to the image they were used to calibrate, so
+analysis loads them instead of solving the geometry again, and every frame
+costs a single cv2.remap(). As both entries are part of the settings, and so
+of the baseline's settings hash, changing them requires a recalibration.
+
+    python rectify.py --pattern 9x6 --frames 15
+"""
+import argparse
+import json
+import sys
+import time
+
+from startup import LazyModule
+
+import capture
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+KEYS = ('lens', 'corners')
+MAP_ARRAYS = ('map1', 'map2')
+
+
+class Rectifier(object):
+    """
+    Warps frames with precomputed remap tables.
+
+    Attributes:
+        map1: The fixed-point source coordinates (int16, h x w x 2).
+        map2: The interpolation table indices (uint16, h x w).
+        size: The (width, height) of the rectified frames.
+    """
+    def __init__(self, map1, map2):
+        self.map1 = map1
+        self.map2 = map2
+        self.size = (map1.shape[1], map1.shape[0])
+
+    def apply(self, image, out=None):
+        """Returns image rectified, written into out if given."""
+        return cv2.remap(image, self.map1, self.map2, cv2.INTER_LINEAR, dst=out)
+
+    def arrays(self):
+        """Returns the tables as arrays for baseline.save()."""
+        return {'map1': self.map1, 'map2': self.map2}
+
+    @property
+    def nbytes(self):
+        return self.map1.nbytes + self.map2.nbytes
+
+
+def _grid(size):
+    w, h = size
+    xs, ys = numpy.meshgrid(numpy.arange(w, dtype=numpy.float32), numpy.arange(h, dtype=numpy.float32))
+    return xs, ys
+
+
+def lens_matrix(lens, size):
+    """
+    Returns the camera matrix of lens for frames of size.
+
+    A lens measured before its size was saved was measured at
+    capture.CAPTURE_SIZE, the default size of capture.CameraSource.
+    """
+    matrix = numpy.array(lens['matrix'], numpy.float64)
+    width, height = lens.get('size', capture.CAPTURE_SIZE)
+    # fx, cx and fy, cy
+    matrix[0, [0, 2]] *= size[0] / float(width)
+    matrix[1, [1, 2]] *= size[1] / float(height)
+    return matrix
+
+
+def lens_maps(lens, size):
+    """Returns float maps from lens-corrected to raw pixel coordinates."""
+    matrix = lens_matrix(lens, size)
+    dist = numpy.array(lens['dist'], numpy.float64)
+    new = cv2.getOptimalNewCameraMatrix(matrix, dist, size, 0)[0]
+    return cv2.initUndistortRectifyMap(matrix, dist, None, new, size, cv2.CV_32FC1)
+
+
+def undistort(image, lens):
+    """Returns image with only the lens distortion corrected, e.g. for picking corners."""
+    h, w = image.shape[:2]
+    map_x, map_y = lens_maps(lens, (w, h))
+    return cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR)
+
+
+def perspective_maps(corners, size):
+    """Returns float maps taking the quadrilateral corners onto the whole frame."""
+    w, h = size
+    src = numpy.array([(x * (w - 1), y * (h - 1)) for x, y in corners], numpy.float32)
+    dst = numpy.array([(0, 0), (w - 1, 0), (w - 1, h - 1), (0, h - 1)], numpy.float32)
+    m = cv2.getPerspectiveTransform(dst, src)
+    xs, ys = _grid(size)
+    d = m[2, 0] * xs + m[2, 1] * ys + m[2, 2]
+    map_x = ((m[0, 0] * xs + m[0, 1] * ys + m[0, 2]) / d).astype(numpy.float32)
+    map_y = ((m[1, 0] * xs + m[1, 1] * ys + m[1, 2]) / d).astype(numpy.float32)
+    return map_x, map_y
+
+
+def build(settings, size=capture.CAPTURE_SIZE):
+    """Returns the Rectifier for the lens and corners of settings, or None if it has neither."""
+    lens, corners = settings.get('lens'), settings.get('corners')
+    if not lens and not corners:
+        return None
+    if corners:
+        map_x, map_y = perspective_maps(corners, size)
+    else:
+        map_x, map_y = _grid(size)
+    if lens:
+        # output -> lens-corrected coordinates -> raw coordinates
+        lens_x, lens_y = lens_maps(lens, size)
+        map_x, map_y = (cv2.remap(lens_x, map_x, map_y, cv2.INTER_LINEAR),
+                        cv2.remap(lens_y, map_x, map_y, cv2.INTER_LINEAR))
+    map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return Rectifier(map1, map2)
+
+
+def from_arrays(arrays):
+    """Returns the Rectifier saved in a baseline's arrays, or None if it has none."""
+    if 'map1' not in arrays:
+        return None
+    return Rectifier(numpy.array(arrays['map1']), numpy.array(arrays['map2']))
+
+
+def order_corners(points):
+    """Returns four (x, y) points ordered top left, top right, bottom right, bottom left."""
+    points = sorted(points, key=lambda p: p[0] + p[1])
+    tl, br = points[0], points[-1]
+    tr, bl = sorted(points[1:3], key=lambda p: p[1])
+    return [tl, tr, br, bl]
+
+
+class RectifiedSource(object):
+    """
+    Wraps a frame source so every frame comes out rectified.
+
+    Attributes:
+        source: The wrapped source, e.g. a capture.CameraSource.
+        rectifier: The Rectifier applied to its frames.
+    """
+    def __init__(self, source, rectifier):
+        self.source = source
+        self.rectifier = rectifier
+        w, h = rectifier.size
+        self._gray = numpy.empty((h, w), numpy.uint8)
+
+    def read_gray(self):
+        """Captures a frame and returns it rectified; the next call overwrites it."""
+        return self.rectifier.apply(self.source.read_gray(), self._gray)
+
+    def color_image(self):
+        """Returns the last capture rectified, as a new RGB array, or None if the source has none."""
+        image = self.source.color_image()
+        return None if image is None else self.rectifier.apply(image)
+
+    def release(self):
+        return self.source.release()
+
+    def close(self):
+        self.source.close()
+
+    def __getattr__(self, name):
+        # counters and the like of the wrapped source
+        return getattr(self.source, name)
+
+
+def wrap(source, rectifier):
+    """Returns source rectified by rectifier, or source itself for None."""
+    return source if rectifier is None else RectifiedSource(source, rectifier)
+
+
+def calibrate_checkerboard(images, pattern):
+    """
+    Measures the lens and the mold plane from grayscale views of a checkerboard.
+
+    pattern is the (columns, rows) of inner corners. The board should lie on
+    the mold in the last image. Returns a dict with 'lens' and 'corners': the
+    corners are chosen so the rectified frame looks square onto the board's
+    plane and still shows the whole field of view.
+    """
+    cols, rows = pattern
+    board = numpy.zeros((cols * rows, 3), numpy.float32)
+    board[:, :2] = numpy.mgrid[0:cols, 0:rows].T.reshape(-1, 2)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    object_points, image_points = [], []
+    for image in images:
+        found, points = cv2.findChessboardCorners(image, pattern)
+        if found:
+            points = cv2.cornerSubPix(image, points, (5, 5), (-1, -1), criteria)
+            object_points.append(board)
+            image_points.append(points)
+    if not image_points:
+        raise ValueError('no {}x{} checkerboard found'.format(cols, rows))
+    h, w = images[0].shape[:2]
+    # radial k1, k2 only: the higher terms overfit a handful of views
+    flags = cv2.CALIB_FIX_K3 | cv2.CALIB_ZERO_TANGENT_DIST
+    _, matrix, dist, _, _ = cv2.calibrateCamera(object_points, image_points, (w, h), None, None, flags=flags)
+    lens = {'matrix': matrix.tolist(), 'dist': dist.ravel().tolist(), 'size': [w, h]}
+
+    # the board in the last view, in lens-corrected pixels
+    new = cv2.getOptimalNewCameraMatrix(matrix, dist, (w, h), 0)[0]
+    seen = cv2.undistortPoints(image_points[-1], matrix, dist, P=new).reshape(-1, 2)
+    plane = cv2.findHomography(seen, board[:, :2])[0]
+    # the whole frame seen square onto the plane, fitted back into the frame
+    frame = numpy.array([[(0, 0), (w - 1, 0), (w - 1, h - 1), (0, h - 1)]], numpy.float32)
+    flat = cv2.perspectiveTransform(frame, plane)[0]
+    x0, y0 = flat.min(axis=0)
+    x1, y1 = flat.max(axis=0)
+    scale = min((w - 1) / (x1 - x0), (h - 1) / (y1 - y0))
+    fit = numpy.array([[scale, 0, -x0 * scale], [0, scale, -y0 * scale], [0, 0, 1]])
+    to_frame = numpy.linalg.inv(fit.dot(plane))
+    out = numpy.array([[(0, 0), (w - 1, 0), (w - 1, h - 1), (0, h - 1)]], numpy.float32)
+    corners = cv2.perspectiveTransform(out, to_frame)[0]
+    corners = [[round(float(x) / (w - 1), 4), round(float(y) / (h - 1), 4)] for x, y in corners]
+    return {'lens': lens, 'corners': corners}
+
+
+def main():
+    import recipes
+
+    parser = argparse.ArgumentParser(description='Measure lens and perspective correction with a checkerboard.')
+    parser.add_argument('--pattern', default='9x6', help='inner corners as COLSxROWS')
+    parser.add_argument('--frames', type=int, default=15, help='views to capture; move the board between them')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between views')
+    parser.add_argument('--lens-only', action='store_true', help='keep the current corners')
+    parser.add_argument('--clear', action='store_true', help='remove the correction and exit')
+    args = parser.parse_args()
+
+    if args.clear:
+        recipes.update_settings({'lens': None, 'corners': None})
+        print('Correction removed; recalibrate the baseline.')
+        return 0
+    pattern = tuple(int(n) for n in args.pattern.lower().split('x'))
+    # the views are zoomed like the frames analyzed, so the lens only fits
+    # this zoom
+    zoom = capture.load_settings()['zoom']
+    source = capture.CameraSource()
+    images = []
+    try:
+        for i in range(args.frames):
+            print('view {}/{}; leave the board on the mold for the last one'.format(i + 1, args.frames))
+            images.append(source.read_gray().copy())
+            time.sleep(args.interval)
+    finally:
+        source.close()
+    try:
+        values = calibrate_checkerboard(images, pattern)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    values['lens']['zoom'] = list(zoom)
+    if args.lens_only:
+        del values['corners']
+    recipes.update_settings(values)
+    print(json.dumps(values, indent=4))
+    print('Saved; recalibrate the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
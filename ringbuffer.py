@@ -0,0 +1,270 @@
+"""
+Capture in a separate process, feeding analysis through shared memory.
+
+Tk event handling and OpenCV share the GIL with the camera when they run in
+one process, so a slow redraw can stall frame acquisition. CaptureProcess runs
+the frame source in a child process that captures continuously into a
+FrameRing: a fixed number of frame slots in multiprocessing.shared_memory,
+each stamped with the sequence number of the frame it holds. The analysis
+process reads a slot as a numpy view straight out of the shared block, so
+frames are never copied or pickled between the processes.
+
+Each slot's stamp is cleared before it is rewritten and set again afterwards.
+A reader checks the stamp after it is done with a frame; if it changed, the
+slot was recycled mid-read and the frame is counted as overwritten. Frames
+that were captured but never analyzed are counted as dropped; with a
+triggered press most frames are, so that count is a measure of how much
+spare capture capacity there is, not an error.
+
+The stamps and the newest sequence number are only ever stored and read
+with the ring's multiprocessing.Condition held. Its lock orders the memory
+accesses around it, so a reader that sees a frame's sequence number also
+sees the frame, which bare stores to shared memory would not guarantee
+between processes; the frame data itself is copied outside the lock. A
+reader waiting for a frame sleeps on the condition until the child
+publishes one.
+
+read_gray() hands out the newest complete frame at once, so a trigger does
+not wait for the next capture, and only waits when the reader has had that
+frame already. The frame may have been exposed just before the trigger: on
+a press lit only for the capture, keep the light on. A ring with color
+fills every frame's RGB slot, in the child; the RGB copy has to be taken
+before the frame is released, and its stamp is checked just like the
+grayscale frame's.
+
+The switch stays in the analysis process: its callback only takes the time
+and hands the press to the scheduler, and the frame it needs is already in
+the ring.
+
+CaptureProcess has the same read_gray()/color_image()/release()/close()
+interface as capture.CameraSource, so the service can use either.
+"""
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+
+from startup import LazyModule
+
+numpy = LazyModule('numpy')
+
+SLOTS = 8
+
+# header layout, in int64 words, followed by one stamp per slot
+_SEQ, _SLOTS, _WIDTH, _HEIGHT, _COLOR = range(5)
+_HEADER = 8
+_WRITING = -1
+
+log = logging.getLogger('wincup.ringbuffer')
+
+
+class FrameRing(object):
+    """
+    A ring of grayscale (and optionally RGB) frame slots in shared memory.
+
+    Created without a name it allocates the block and its condition; pass
+    the name and the condition of an existing ring to attach to it from
+    another process.
+
+    Attributes:
+        name: The shared memory block's name.
+        size: The (width, height) of the frames.
+        slots: The number of frame slots.
+        color: Whether each slot also holds an RGB frame.
+        cond: The multiprocessing.Condition the stamps are published under.
+    """
+    def __init__(self, size=None, slots=SLOTS, color=False, name=None, cond=None):
+        self.cond = cond or multiprocessing.Condition()
+        if name is None:
+            w, h = size
+            nbytes = (_HEADER + slots) * 8 + slots * w * h * (4 if color else 1)
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._owner = True
+            header = numpy.ndarray(_HEADER, numpy.int64, self.shm.buf)
+            header[:] = 0
+            header[_SLOTS], header[_WIDTH], header[_HEIGHT], header[_COLOR] = slots, w, h, color
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._header = numpy.ndarray(_HEADER, numpy.int64, self.shm.buf)
+        self.name = self.shm.name
+        self.slots = int(self._header[_SLOTS])
+        self.size = (int(self._header[_WIDTH]), int(self._header[_HEIGHT]))
+        self.color = bool(self._header[_COLOR])
+        w, h = self.size
+        offset = _HEADER * 8
+        self._stamps = numpy.ndarray(self.slots, numpy.int64, self.shm.buf, offset)
+        if name is None:
+            self._stamps[:] = _WRITING
+        offset += self.slots * 8
+        self._gray = numpy.ndarray((self.slots, h, w), numpy.uint8, self.shm.buf, offset)
+        offset += self._gray.nbytes
+        self._rgb = (numpy.ndarray((self.slots, h, w, 3), numpy.uint8, self.shm.buf, offset)
+                     if self.color else None)
+
+    @property
+    def seq(self):
+        """The sequence number of the newest complete frame; 0 before the first."""
+        with self.cond:
+            return int(self._header[_SEQ])
+
+    def write(self, gray, rgb=None):
+        """Copies a frame into the next slot and returns its sequence number."""
+        with self.cond:
+            seq = int(self._header[_SEQ]) + 1
+            slot = seq % self.slots
+            self._stamps[slot] = _WRITING
+        self._gray[slot] = gray
+        if self._rgb is not None and rgb is not None:
+            self._rgb[slot] = rgb
+        with self.cond:
+            self._stamps[slot] = seq
+            self._header[_SEQ] = seq
+            self.cond.notify_all()
+        return seq
+
+    def newer(self, seq, timeout=1.0):
+        """Returns the sequence number of the newest complete frame after seq, waiting for one if need be."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self._header[_SEQ] > seq, timeout):
+                raise TimeoutError('no frame after {} from the capture process in {} s'.format(seq, timeout))
+            return int(self._header[_SEQ])
+
+    def gray(self, seq):
+        """Returns frame seq's grayscale slot as a view into shared memory."""
+        return self._gray[seq % self.slots]
+
+    def rgb(self, seq):
+        """Returns frame seq's RGB slot as a view into shared memory."""
+        if self._rgb is None:
+            raise ValueError('FrameRing was created without color')
+        return self._rgb[seq % self.slots]
+
+    def valid(self, seq):
+        """Returns whether frame seq is still in its slot, i.e. has not been overwritten."""
+        with self.cond:
+            return int(self._stamps[seq % self.slots]) == seq
+
+    def close(self):
+        # the views must go before the block can be closed
+        self._header = self._stamps = self._gray = self._rgb = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _capture(name, cond, factory, kwargs, period, stop):
+    """Runs in the child process: captures from factory(**kwargs) into the ring called name."""
+    ring = FrameRing(name=name, cond=cond)
+    source = factory(size=ring.size, **kwargs)
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            gray = source.read_gray()
+            ring.write(gray, source.color_image() if ring.color else None)
+            if period:
+                time.sleep(max(0.0, period - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        ring.close()
+
+
+class CaptureProcess(object):
+    """
+    Runs a frame source in a child process and reads its frames from a FrameRing.
+
+    Attributes:
+        ring: The FrameRing the child writes to.
+        size: The (width, height) of the frames.
+        color: Whether color_image() is available.
+        read: The number of frames handed out by read_gray().
+        dropped: The frames captured between two reads that were never read.
+        overwritten: The frames whose slot was recycled before they were released.
+    """
+    def __init__(self, factory, size, color=False, slots=SLOTS, period=0.0, timeout=2.0, source_kwargs=None):
+        """
+        Starts the child process, which opens factory(size=size, **source_kwargs);
+        period is the shortest time between captures, for sources that do
+        not pace themselves. color only decides whether the ring keeps color
+        frames; a source that takes a color flag needs it in source_kwargs.
+        """
+        self.size = size
+        self.color = color
+        self.timeout = timeout
+        self.read = 0
+        self.dropped = 0
+        self.overwritten = 0
+        self.ring = FrameRing(size, slots, color)
+        self._seq = 0
+        self._last = 0
+        self._stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_capture, name='capture', daemon=True,
+            args=(self.ring.name, self.ring.cond, factory, source_kwargs or {}, period, self._stop))
+        self.process.start()
+
+    def read_gray(self):
+        """
+        Returns the newest complete frame, or waits for the next one if the
+        newest was read already.
+
+        The returned array is a view into shared memory that the capture
+        process reuses once the ring comes round; copy it to keep it, and
+        call release() when done with it.
+        """
+        self.release()
+        seq = self.ring.newer(self._last, self.timeout)
+        if self._last:
+            self.dropped += seq - self._last - 1
+        self._seq = self._last = seq
+        self.read += 1
+        return self.ring.gray(seq)
+
+    def color_image(self):
+        """
+        Returns the frame in use as a new RGB array, or None if its slot was
+        rewritten while it was copied; call it before release().
+        """
+        if not self.color:
+            raise ValueError('CaptureProcess was started without color')
+        if not self._seq:
+            raise ValueError('color_image() needs a frame that was read and not yet released')
+        rgb = self.ring.rgb(self._seq).copy()
+        # release() counts the frame as overwritten
+        return rgb if self.ring.valid(self._seq) else None
+
+    def release(self):
+        """
+        Finishes with the last frame read and returns whether it stayed intact.
+
+        A frame whose slot was rewritten while it was in use is counted as
+        overwritten; anything computed from it may mix two frames.
+        """
+        if not self._seq:
+            return True
+        intact = self.ring.valid(self._seq)
+        if not intact:
+            self.overwritten += 1
+            log.warning('frame %d was overwritten while in use; use more slots', self._seq)
+        self._seq = 0
+        return intact
+
+    def snapshot(self):
+        """Returns the capture counters as a dict."""
+        return {
+            'captured': self.ring.seq,
+            'read': self.read,
+            'dropped': self.dropped,
+            'overwritten': self.overwritten,
+            'alive': self.process.is_alive(),
+        }
+
+    def close(self):
+        self._stop.set()
+        self.process.join(self.timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.ring.close()
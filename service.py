@@ -0,0 +1,517 @@
+"""
+Headless mold analysis service.
+
+Runs the trigger -> analyze -> LED loop without Tk or an X session, for presses
+where nobody watches the screen. It loads the saved camera settings and the
+calibrated baseline, keeps the camera open between cycles, and logs every
+verdict. SIGTERM and SIGINT stop it cleanly, so it can run under systemd (see
+wincup-headless.service), and SIGUSR1 toggles profiling (see profiling.py).
+
+To analyze at the sensor's full resolution (3280x2464 on the v2 camera
+module, 2592x1944 on v1), calibrate and run with the same --size, and split
+the work over the cores with --tiles (see tiles.py). The size filter (the
+recipe's min_size, or the default) is given for the GUI's 400x250 frames and
+scaled up to --size, so it keeps to the same defects:
+
+    python service.py --size 3280x2464 --calibrate 30
+    python service.py --size 3280x2464 --tiles 2x2
+
+With --capture-process the camera runs in a child process that captures
+continuously into shared memory (see ringbuffer.py), so capture never waits
+on analysis. Calibrate with the same flag, as it captures from the video port,
+which goes up to 1920x1080 only.
+
+If the settings carry a lens or perspective correction (see rectify.py), the
+calibration saves its remap tables with the baseline and every frame is
+rectified with them before it is analyzed.
+
+A cycle signals its verdict on the LEDs as soon as the detector finds a first
+blob; finding the other boxes, annotating, publishing and logging follow on
+another thread (see trigger.Followup), and the log reports the
+trigger-to-signal latency (signal_ms) apart from the whole cycle (cycle_ms).
+The red and green LEDs are driven from a high-priority output thread (see
+output.py), which answers a trigger with reject if no verdict comes within
+--signal-deadline milliseconds; --direct-output drives them from the trigger
+thread instead.
+
+Every cycle's mask is added to a defect heatmap kept next to the baseline and
+saved every --heatmap-every seconds and on shutdown (see heatmap.py).
+
+The whole state of the run is checkpointed every --checkpoint-every seconds
+and on shutdown (see checkpoint.py). After a crash or a reboot, --resume
+carries on from the last checkpoint with its detector and counters, without
+loading the recipe or recalibrating. A checkpoint of another --recipe or of a
+baseline calibrated since is not resumed; the run starts afresh instead:
+
+    python service.py --resume
+
+Run `python service.py --simulate` to try it without a Raspberry Pi.
+"""
+import argparse
+import logging
+import signal
+import sys
+import threading
+import time
+
+from startup import LazyModule
+
+import analysis
+import baseline
+import capture
+import checkpoint
+from profiling import ProfileSession
+import detectors
+import eventlog
+import heatmap
+import output
+import recipes
+import rectify
+import ringbuffer
+import trigger
+
+gpio = LazyModule('gpiozero')
+
+SWITCH_PIN = 26
+LED_RED_PIN = 5
+LED_GREEN_PIN = 6
+LED_FLASH_PIN = 19
+
+log = logging.getLogger('wincup.service')
+
+
+class AnalysisService(object):
+    """
+    Analyzes a mold every time the machine's switch is pressed.
+
+    Attributes:
+        camera: The frame source; anything with read_gray(), release(), color_image() and close().
+        switch: The machine's switch; anything with a when_pressed callback.
+        led_r: The LED lit when contamination is found, if there is no output.
+        led_g: The LED lit when the mold is clean, if there is no output.
+        led_flash: The light switched on while capturing.
+        base_gray: The calibrated grayscale baseline.
+        sens: The sensitivity of the detector.
+        min_size: The smallest width and height of a blob that is rejected.
+        detector: The detectors.Detector that finds contamination in a frame.
+        options: The detector's options.
+        latest: An optional monitor.LatestResult to publish annotated frames to.
+        heatmap: An optional heatmap.Heatmap every detection is added to.
+        output: An optional output.OutputController that drives the red and
+            green LEDs instead of led_r and led_g.
+        checkpoint: An optional checkpoint.Checkpointer the run is saved with.
+        recipe: The name of the recipe analyzed, for the checkpoints.
+        baseline: The checkpoint.provenance() of the baseline analyzed against,
+            for the checkpoints.
+        scheduler: The TriggerScheduler that runs analyze() for each press.
+        followup: The trigger.Followup that runs report() after each verdict.
+        profiler: The ProfileSession sampling analyze() on demand.
+    """
+    def __init__(self, camera, switch, led_r, led_g, led_flash, base_gray,
+                 sens=25, noise=None, min_size=analysis.MIN_OBJECT_SIZE, latest=None, policy=trigger.COALESCE, debounce=0.05,
+                 detector=detectors.DEFAULT, options=None, heatmap=None, output=None, checkpoint=None,
+                 recipe=None, baseline=None):
+        """detector is the name of a detector, or a detectors.Detector to use as it is."""
+        self.camera = camera
+        self.switch = switch
+        self.led_r = led_r
+        self.led_g = led_g
+        self.led_flash = led_flash
+        self.base_gray = base_gray
+        self.sens = sens
+        self.min_size = min_size
+        self.options = dict(options or {})
+        if isinstance(detector, detectors.Detector):
+            self.detector = detector
+        else:
+            self.detector = detectors.create(detector, base_gray, sens, min_size, noise, **self.options)
+        self.latest = latest
+        self.heatmap = heatmap
+        self.output = output
+        self.checkpoint = checkpoint
+        self.recipe = recipe
+        self.baseline = baseline
+        self.cycles = 0
+        self.rejects = 0
+        self.profiler = ProfileSession()
+        self.scheduler = trigger.TriggerScheduler(self.profiler.wrap(self.analyze), policy, debounce)
+        self.followup = trigger.Followup(self.report)
+        if latest is not None:
+            latest.metrics['trigger'] = self.scheduler.snapshot
+            latest.metrics['followup'] = self.followup.snapshot
+            latest.metrics['detector'] = self.detector.snapshot
+            if hasattr(camera, 'snapshot'):
+                latest.metrics['capture'] = camera.snapshot
+            if heatmap is not None:
+                latest.metrics['heatmap'] = heatmap.snapshot
+            if output is not None:
+                latest.metrics['output'] = output.snapshot
+            if checkpoint is not None:
+                latest.metrics['checkpoint'] = checkpoint.snapshot
+        self._stop = threading.Event()
+
+    def analyze(self, cycle=None):
+        """
+        Captures and analyzes one mold and drives the LEDs as soon as the
+        verdict is known; the rest of the cycle goes to report(). Returns
+        the Detection, whose boxes report() completes.
+        """
+        start = time.monotonic()
+        self.led_flash.on()
+        image_gray = self.camera.read_gray()
+        self.led_flash.off()
+        detection = self.detector.detect(image_gray, first=True)
+
+        triggered = start if cycle is None else cycle.triggered
+        request = None
+        if self.output is not None:
+            request = self.output.signal(detection.reject, triggered)
+        elif detection.reject:
+            self.led_r.on()
+            self.led_g.off()
+        else:
+            self.led_r.off()
+            self.led_g.on()
+        signaled = time.monotonic()
+        if cycle is not None:
+            cycle.signaled = signaled
+
+        self.cycles += 1
+        self.rejects += 1 if detection.reject else 0
+        # the frame is only ours until it is released
+        image = self.camera.color_image() if self.latest is not None else None
+        self.camera.release()
+        self.followup.submit(self.cycles, detection, image, triggered, start, signaled, request)
+        return detection
+
+    def report(self, index, detection, image, triggered, start, signaled, request=None):
+        """Completes a cycle after its verdict: boxes, annotation, publishing, logging, heatmap."""
+        if request is not None:
+            # the time the output thread actually set the pins
+            signaled = self.output.signaled(request) or signaled
+        boxes = self.detector.finish(detection).boxes
+        if image is not None:
+            self.latest.publish(analysis.annotate(image, boxes), boxes, signaled - start)
+        eventlog.event(log, 'verdict', cycle=index, verdict='reject' if boxes else 'pass',
+                       objects=len(boxes), boxes=boxes, detector=detection.detector,
+                       detect_ms=round(detection.seconds * 1000.0, 2),
+                       signal_ms=round((signaled - triggered) * 1000.0, 2),
+                       cycle_ms=round((time.monotonic() - triggered) * 1000.0, 2))
+        if self.heatmap is not None:
+            self.heatmap.add(detection)
+            self.heatmap.autosave()
+        if self.checkpoint is not None:
+            self.checkpoint.autosave(self.state)
+
+    def state(self):
+        """Returns the arrays and state of the run, for a checkpoint."""
+        # a rectify.RectifiedSource has one
+        rectifier = getattr(self.camera, 'rectifier', None)
+        return checkpoint.collect(self.detector, self.scheduler, self.heatmap, rectifier, self.options,
+                                  recipe=self.recipe, baseline=self.baseline, cycles=self.cycles,
+                                  rejects=self.rejects)
+
+    def restore(self, saved):
+        """Continues the counters of the checkpoint.Checkpoint saved."""
+        self.cycles = saved.state.get('cycles', 0)
+        self.rejects = saved.state.get('rejects', 0)
+        self.scheduler.restore(saved.state.get('trigger', {}))
+
+    def on_press(self):
+        """Hands a press to the scheduler and starts the output's deadline for it."""
+        cycle = self.scheduler.trigger()
+        if cycle is not None and self.output is not None:
+            self.output.arm(cycle.triggered)
+
+    def run(self):
+        """Analyzes a mold on every accepted trigger until stop() is called."""
+        log.info('waiting for the switch')
+        self.scheduler.start()
+        self.switch.when_pressed = self.on_press
+        while not self._stop.wait(0.5):
+            pass
+        self.scheduler.stop()
+        self.switch.when_pressed = None
+        self.followup.stop()
+        if self.heatmap is not None:
+            self.heatmap.save()
+        if self.checkpoint is not None:
+            self.checkpoint.save(*self.state())
+        eventlog.event(log, 'stopped', cycles=self.cycles, rejects=self.rejects,
+                       trigger=self.scheduler.snapshot(), followup=self.followup.snapshot(),
+                       detector=self.detector.snapshot(),
+                       output=self.output.snapshot() if self.output is not None else None)
+
+    def stop(self, *args):
+        """Asks run() to return; safe to use as a signal handler."""
+        self._stop.set()
+
+    def close(self):
+        self.followup.stop()
+        for device in (self.switch, self.led_r, self.led_g, self.led_flash, self.camera, self.output):
+            if device is not None:
+                device.close()
+        self.detector.close()
+
+
+def calibrate(camera, path, frames, size):
+    """Averages frames from camera into a baseline saved at path."""
+    started = time.monotonic()
+    eventlog.event(log, 'calibration_started', frames=frames, path=path, size=size)
+    settings = capture.load_settings()
+    rectifier = rectify.build(settings, size)
+    camera = rectify.wrap(camera, rectifier)
+    arrays = baseline.accumulate(camera.read_gray() for _ in range(frames))
+    if rectifier is not None:
+        arrays.update(rectifier.arrays())
+    baseline.save(path, arrays, settings, frames, size)
+    eventlog.event(log, 'calibration_finished', frames=frames, path=path,
+                   seconds=round(time.monotonic() - started, 2),
+                   noise_mean=round(float(arrays['noise'].mean()), 3),
+                   noise_max=round(float(arrays['noise'].max()), 3))
+
+
+def open_camera(args, color=False):
+    """Returns the frame source chosen by the command line arguments."""
+    if args.simulate:
+        import simulate
+        factory, kwargs = simulate.SimulatedCamera, {}
+    else:
+        factory, kwargs = capture.CameraSource, {'color': color}
+    if args.capture_process:
+        if not args.simulate:
+            kwargs['video'] = True
+        return ringbuffer.CaptureProcess(factory, args.size, color, args.slots,
+                                         period=1.0 / 30 if args.simulate else 0.0, source_kwargs=kwargs)
+    return factory(args.size, **kwargs)
+
+
+def load_baseline(path, size=capture.CAPTURE_SIZE):
+    """Returns the baseline saved by the calibration, checked against the camera settings."""
+    try:
+        return baseline.load_current(path, size)
+    except baseline.BaselineError as e:
+        raise SystemExit('{}; calibrate first.'.format(e))
+
+
+def load_recipe(name, size=capture.CAPTURE_SIZE):
+    """Activates the recipe called name and returns it with its baseline for size loaded."""
+    try:
+        recipes.activate(name)
+        return recipes.RecipeCache().get(name, size)
+    except (recipes.RecipeError, baseline.BaselineError) as e:
+        raise SystemExit('{}; calibrate first.'.format(e))
+
+
+def baseline_path(args):
+    """Returns the baseline file the arguments analyze against, or None when simulating."""
+    if args.simulate:
+        return None
+    if args.recipe:
+        try:
+            return recipes.load_recipe(args.recipe).baseline_path
+        except recipes.RecipeError as e:
+            raise SystemExit('{}; calibrate first.'.format(e))
+    return args.baseline
+
+
+def load_checkpoint(path, size=capture.CAPTURE_SIZE, recipe=None, base_path=None):
+    """
+    Returns the checkpoint at path if it fits the camera settings and is of
+    recipe and the baseline now at base_path; None, logged, otherwise.
+    """
+    try:
+        saved = checkpoint.load(path, capture.load_settings(), size)
+        saved.check(recipe, base_path)
+        return saved
+    except baseline.BaselineError as e:
+        eventlog.event(log, 'resume_failed', level=logging.WARNING, path=path, error=str(e))
+        return None
+
+
+def _pair(text):
+    a, b = text.lower().split('x')
+    return int(a), int(b)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the mold analysis without a screen.')
+    parser.add_argument('--baseline', default=baseline.BASELINE_FILE, help='calibrated baseline file')
+    parser.add_argument('--recipe', help='analyze with this saved product recipe')
+    parser.add_argument('--sensitivity', type=int, help='the least grey-level difference counted; '
+                        'default 25, or the recipe\'s. With --option noise_factor={} it is the margin '
+                        'over that many times the calibration noise at each pixel'.format(analysis.NOISE_FACTOR))
+    parser.add_argument('--monitor-port', type=int, default=0,
+                        help='port for the monitoring server, 0 to disable')
+    parser.add_argument('--monitor-host', default='127.0.0.1',
+                        help='interface for the monitoring server, e.g. 0.0.0.0 for all')
+    parser.add_argument('--policy', choices=trigger.POLICIES, default=trigger.COALESCE,
+                        help='what to do with a trigger that arrives mid-cycle')
+    parser.add_argument('--debounce', type=float, default=0.05, help='switch debounce in seconds')
+    parser.add_argument('--size', type=_pair, default=capture.CAPTURE_SIZE,
+                        help='analysis resolution as WxH, up to the sensor\'s full resolution; '
+                        'calibrate at the same size')
+    parser.add_argument('--detector', choices=sorted(detectors.DETECTORS),
+                        help='default absdiff, or the recipe\'s')
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='detector option, e.g. block=16; may be repeated')
+    parser.add_argument('--tiles', type=_pair, help='absdiff in ROWSxCOLS tiles on a thread pool')
+    parser.add_argument('--workers', type=int, help='threads for --tiles, default one per core')
+    parser.add_argument('--calibrate', type=int, metavar='FRAMES',
+                        help='save a baseline averaged over FRAMES frames and exit; with --recipe, '
+                        'that recipe\'s')
+    parser.add_argument('--capture-process', action='store_true',
+                        help='capture continuously in a separate process through shared memory')
+    parser.add_argument('--slots', type=int, default=ringbuffer.SLOTS,
+                        help='frames in the shared memory ring for --capture-process')
+    parser.add_argument('--simulate', action='store_true', help='use simulated camera and pins')
+    parser.add_argument('--period', type=float, default=1.0, help='simulated press cycle in seconds')
+    parser.add_argument('--log-file', help='also write a JSON-lines event log here')
+    parser.add_argument('--heatmap-every', type=float, default=heatmap.SAVE_EVERY, metavar='SECONDS',
+                        help='how often to save the defect heatmap, 0 for only on shutdown')
+    parser.add_argument('--signal-deadline', type=float, metavar='MS',
+                        help='signal reject if a trigger gets no verdict within MS milliseconds')
+    parser.add_argument('--output-priority', type=int, default=output.PRIORITY,
+                        help='SCHED_FIFO priority of the LED output thread, 0 to leave it alone')
+    parser.add_argument('--direct-output', action='store_true',
+                        help='drive the LEDs from the trigger thread, without an output thread')
+    parser.add_argument('--checkpoint', metavar='PATH',
+                        help='checkpoint file, default {}; with --simulate, none unless given'.format(
+                            checkpoint.CHECKPOINT_FILE))
+    parser.add_argument('--checkpoint-every', type=float, default=checkpoint.SAVE_EVERY, metavar='SECONDS',
+                        help='how often to checkpoint the run, 0 for only on shutdown')
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the checkpoint, with its recipe, detector and counters')
+    args = parser.parse_args()
+    events = eventlog.EventLog(args.log_file, console=sys.stderr).start()
+    try:
+        run(args)
+    finally:
+        events.stop()
+
+
+def run(args):
+    """Runs the service as configured by the command line arguments."""
+
+    if args.calibrate:
+        path = args.baseline
+        if args.recipe:
+            # with the recipe's camera settings, into its own baseline
+            try:
+                path = recipes.activate(args.recipe).baseline_path
+            except recipes.RecipeError as e:
+                raise SystemExit(str(e))
+        camera = open_camera(args)
+        try:
+            calibrate(camera, path, args.calibrate, args.size)
+        finally:
+            camera.close()
+        return
+
+    if args.simulate:
+        import simulate
+        led = simulate.SimulatedLED
+    else:
+        led = gpio.LED
+    pins = None
+    if not args.direct_output:
+        pins = output.OutputController(led, (LED_RED_PIN, LED_GREEN_PIN), args.output_priority or None,
+                                       args.signal_deadline / 1000.0 if args.signal_deadline else None)
+        eventlog.event(log, 'output', policy=pins.snapshot()['policy'], deadline_ms=args.signal_deadline)
+
+    min_size = analysis.MIN_OBJECT_SIZE
+    options = {}
+    recipe = args.recipe
+    # a simulated run must not overwrite the press's checkpoint
+    path = args.checkpoint or (None if args.simulate else checkpoint.CHECKPOINT_FILE)
+    base_path = baseline_path(args)
+    saved = None
+    if args.resume and path:
+        saved = load_checkpoint(path, args.size, recipe, base_path)
+    if saved is not None:
+        base_gray, noise = saved.mean, saved.noise
+        heat = saved.heatmap(every=args.heatmap_every)
+        camera = rectify.wrap(open_camera(args, color=bool(args.monitor_port)), saved.rectifier())
+        eventlog.event(log, 'resumed', path=path, recipe=recipe, cycles=saved.state.get('cycles', 0),
+                       age_s=round(time.time() - saved.state['saved'], 1))
+    elif args.simulate:
+        camera = open_camera(args, color=bool(args.monitor_port))
+        base_gray, noise = simulate.SimulatedCamera(args.size).background(), None
+        # kept in memory only
+        heat = heatmap.Heatmap(args.size)
+    else:
+        if args.recipe:
+            loaded = load_recipe(args.recipe, args.size)
+            base_gray, noise = loaded.mean, loaded.noise
+            min_size = loaded.recipe.min_size
+            if args.sensitivity is None:
+                args.sensitivity = loaded.recipe.sensitivity
+            if args.detector is None:
+                args.detector = loaded.recipe.detector
+                options = dict(loaded.recipe.options)
+            rectifier = loaded.rectifier
+            heat_path = heatmap.path_for(loaded.recipe.baseline_path)
+        else:
+            base = load_baseline(args.baseline, args.size)
+            base_gray, noise = base.mean, base.noise
+            rectifier = rectify.from_arrays(base.arrays)
+            heat_path = heatmap.path_for(args.baseline)
+        heat = heatmap.Heatmap.open(heat_path, capture.load_settings(), args.size, every=args.heatmap_every)
+        eventlog.event(log, 'heatmap', path=heat_path, cycles=heat.cycles, since=heat.started)
+        camera = rectify.wrap(open_camera(args, color=bool(args.monitor_port)), rectifier)
+    if args.simulate:
+        switch = simulate.SimulatedButton(args.period, jitter=args.period / 20, bounce=1)
+    else:
+        switch = gpio.Button(SWITCH_PIN)
+    if pins is None:
+        leds = [led(LED_RED_PIN), led(LED_GREEN_PIN), led(LED_FLASH_PIN)]
+    else:
+        leds = [None, None, led(LED_FLASH_PIN)]
+
+    latest = None
+    if args.monitor_port:
+        import monitor
+        latest = monitor.LatestResult()
+        try:
+            monitor.MonitorServer(latest, args.monitor_host, args.monitor_port).start()
+        except OSError as e:
+            # the press runs on without it
+            eventlog.event(log, 'monitor_failed', level=logging.WARNING, host=args.monitor_host,
+                           port=args.monitor_port, error=str(e))
+            latest = None
+
+    if saved is not None:
+        detector = saved.detector()
+        options = saved.state['detector']['options']
+        eventlog.event(log, 'detector', detector=detector.name, options=options)
+    else:
+        options.update(detectors.parse_option(o) for o in args.option)
+        if args.tiles:
+            options.update(tiles=args.tiles, workers=args.workers)
+        detector = args.detector or detectors.DEFAULT
+        min_size = analysis.scale_min_size(min_size, args.size)
+        eventlog.event(log, 'detector', detector=detector, options=options, min_size=min_size)
+    checkpointer = source = None
+    if path:
+        checkpointer = checkpoint.Checkpointer(path, capture.load_settings(), args.size, args.checkpoint_every)
+        source = None if base_path is None else checkpoint.provenance(base_path)
+
+    service = AnalysisService(camera, switch, *leds, base_gray=base_gray,
+                              sens=25 if args.sensitivity is None else args.sensitivity,
+                              noise=noise, min_size=min_size, latest=latest,
+                              policy=args.policy, debounce=args.debounce,
+                              detector=detector, options=options, heatmap=heat, output=pins,
+                              checkpoint=checkpointer, recipe=recipe, baseline=source)
+    if saved is not None:
+        service.restore(saved)
+    signal.signal(signal.SIGTERM, service.stop)
+    signal.signal(signal.SIGINT, service.stop)
+    signal.signal(signal.SIGUSR1, service.profiler.toggle)
+    try:
+        service.run()
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Simulated hardware for running the analysis without a Raspberry Pi.
+
+SimulatedCamera renders a synthetic mold (a grid of cup cavities) and randomly
+drops contamination onto it, and SimulatedButton/SimulatedLED stand in for the
+gpiozero devices, so the differencing, the monitoring server and the headless
+service can be exercised on any machine.
+"""
+import threading
+import time
+
+from startup import LazyModule
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+
+class SimulatedCamera(object):
+    """
+    Renders synthetic mold images.
+
+    Attributes:
+        size: The (width, height) of the captured images, like PiCamera.
+        defect_rate: The chance that a capture contains contamination.
+        noise: The maximum per-pixel sensor noise added to every capture.
+    """
+    def __init__(self, size=(400, 250), defect_rate=0.2, noise=2, seed=None):
+        self.size = size
+        self.defect_rate = defect_rate
+        self.noise = noise
+        self.rng = numpy.random.RandomState(seed)
+        self.last_boxes = []
+        self._background = self._render_background()
+        self._last = self._background
+
+    def _render_background(self):
+        w, h = self.size
+        img = numpy.full((h, w), 90, numpy.uint8)
+        cols, rows = 6, 3
+        radius = int(min(w / cols, h / rows) * 0.35)
+        for r in range(rows):
+            for c in range(cols):
+                center = (int((c + 0.5) * w / cols), int((r + 0.5) * h / rows))
+                cv2.circle(img, center, radius, 170, -1)
+        return img
+
+    def background(self):
+        """Returns the clean mold as a grayscale image."""
+        return self._background.copy()
+
+    def capture_gray(self):
+        """Returns a grayscale capture and the boxes (x, y, w, h) of any contamination."""
+        w, h = self.size
+        frame = self._background.copy()
+        boxes = []
+        if self.rng.rand() < self.defect_rate:
+            for _ in range(self.rng.randint(1, 3)):
+                bw, bh = self.rng.randint(40, 70, 2)
+                x = self.rng.randint(0, w - bw)
+                y = self.rng.randint(0, h - bh)
+                value = int(self.rng.choice([20, 240]))
+                cv2.ellipse(frame, (int(x + bw // 2), int(y + bh // 2)),
+                            (int(bw // 2), int(bh // 2)), 0, 0, 360, value, -1)
+                boxes.append((int(x), int(y), int(bw), int(bh)))
+        if self.noise:
+            noise = self.rng.randint(-self.noise, self.noise + 1, frame.shape)
+            frame = numpy.clip(frame + noise, 0, 255).astype(numpy.uint8)
+        return frame, boxes
+
+    def capture_bgr(self):
+        """Returns a three channel capture and the boxes of any contamination."""
+        frame, boxes = self.capture_gray()
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), boxes
+
+    def read_gray(self):
+        """Returns a grayscale capture, like capture.CameraSource; its boxes go to last_boxes."""
+        self._last, self.last_boxes = self.capture_gray()
+        return self._last
+
+    def color_image(self):
+        """Returns the last capture as an RGB array."""
+        return cv2.cvtColor(self._last, cv2.COLOR_GRAY2RGB)
+
+    def release(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class SimulatedButton(object):
+    """
+    Stands in for gpiozero.Button on the machine's switch.
+
+    A background thread calls when_pressed once per press cycle, like the
+    gpiozero callback thread does.
+
+    Attributes:
+        period: The seconds between simulated presses.
+        jitter: The largest random change to a single period, in seconds.
+        bounce: How many extra presses the switch bounces after each press.
+    """
+    def __init__(self, period=1.0, jitter=0.0, bounce=0, seed=None):
+        self.period = period
+        self.jitter = jitter
+        self.bounce = bounce
+        self.presses = 0
+        self.when_pressed = None
+        self.rng = numpy.random.RandomState(seed)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._press, name='switch', daemon=True)
+        self._thread.start()
+
+    def _press(self):
+        while not self._stop.wait(max(0.0, self.period + self.rng.uniform(-self.jitter, self.jitter))):
+            callback = self.when_pressed
+            if callback is None:
+                continue
+            self.presses += 1
+            for _ in range(1 + self.bounce):
+                callback()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class SimulatedLED(object):
+    """
+    Stands in for gpiozero.LED and remembers its state.
+
+    Attributes:
+        pin: The GPIO pin it stands in for.
+        delay: The seconds a write takes, spent busy like a real pin write.
+        is_lit: Whether it is on.
+        changed: The time.monotonic() of the last write.
+    """
+    def __init__(self, pin=None, delay=0.0):
+        self.pin = pin
+        self.delay = delay
+        self.is_lit = False
+        self.changed = None
+
+    def _write(self, lit):
+        if self.delay:
+            end = time.monotonic() + self.delay
+            while time.monotonic() < end:
+                pass
+        self.is_lit = lit
+        self.changed = time.monotonic()
+
+    def on(self):
+        self._write(True)
+
+    def off(self):
+        self._write(False)
+
+    def close(self):
+        self.is_lit = False
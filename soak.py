@@ -0,0 +1,276 @@
+"""
+Long-run soak test for the analysis loop.
+
+Runs the headless service's cycle against the simulated camera and pins for a
+large number of cycles (100k by default) without anybody watching, and every
+few cycles samples the process's resident memory, open file descriptors,
+thread count and the cycle latency. Every so often it also closes and
+reopens all devices, like leaving and re-entering the analysis page does.
+After a warm-up, the growth of each measure over the run is estimated with a
+least-squares fit; the test fails if any of them grows beyond its limit.
+
+With --gui it soaks the GUI's analysis page itself instead: in a scratch
+directory, on a simulated camera and pins, it presses the switch and pumps
+Tk until each cycle is shown, and every so often leaves the page while the
+switch is still being pressed and enters it again. It needs a display.
+
+    python soak.py --cycles 100000 --csv soak.csv
+    python soak.py --gui --cycles 20000 --reenter-every 500
+"""
+import argparse
+import csv
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from startup import LazyModule
+
+import baseline
+import capture
+import output
+import service
+import simulate
+
+numpy = LazyModule('numpy')
+
+
+def rss_bytes():
+    """Returns the resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak rather than current RSS, but still shows growth
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def open_fds():
+    """Returns the number of open file descriptors."""
+    for path in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return 0
+
+
+def thread_count():
+    """Returns the number of OS threads, or Python threads where that is unknown."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+def make_service(latest=None, seed=None):
+    """Returns an AnalysisService on simulated devices."""
+    camera = simulate.SimulatedCamera(seed=seed)
+    pins = output.OutputController(simulate.SimulatedLED, (service.LED_RED_PIN, service.LED_GREEN_PIN))
+    # the switch never fires by itself; the soak calls analyze() directly
+    switch = simulate.SimulatedButton(period=3600)
+    return service.AnalysisService(camera, switch, None, None, simulate.SimulatedLED(service.LED_FLASH_PIN),
+                                   base_gray=camera.background(), latest=latest, output=pins)
+
+
+def sample(cycle, window):
+    """Returns the measures after cycle, with the median latency of window."""
+    return {
+        'cycle': cycle,
+        'rss_mb': round(rss_bytes() / 1048576.0, 2),
+        'fds': open_fds(),
+        'threads': thread_count(),
+        'latency_ms': round(float(numpy.median(window)) * 1000.0, 3),
+    }
+
+
+def growth(xs, ys):
+    """Returns the least-squares growth of ys over the span of xs."""
+    xs = numpy.asarray(xs, numpy.float64)
+    ys = numpy.asarray(ys, numpy.float64)
+    if len(xs) < 2 or xs[-1] == xs[0]:
+        return 0.0
+    slope = numpy.polyfit(xs, ys, 1)[0]
+    return float(slope * (xs[-1] - xs[0]))
+
+
+def soak(cycles, sample_every=500, reenter_every=5000, monitor=True, seed=0):
+    """Runs the soak and returns the samples as a list of dicts."""
+    logging.getLogger('wincup.service').setLevel(logging.WARNING)
+    latest = None
+    if monitor:
+        import monitor as mon
+        latest = mon.LatestResult()
+    svc = make_service(latest, seed)
+    samples = []
+    window = []
+    try:
+        for i in range(1, cycles + 1):
+            start = time.perf_counter()
+            svc.analyze()
+            window.append(time.perf_counter() - start)
+            if latest is not None and i % 10 == 0:
+                latest.jpeg()
+            if reenter_every and i % reenter_every == 0:
+                svc.close()
+                svc = make_service(latest, seed + i)
+            if i % sample_every == 0:
+                samples.append(sample(i, window))
+                window = []
+    finally:
+        svc.close()
+    return samples
+
+
+def soak_gui(cycles, sample_every=500, reenter_every=5000, seed=0, timeout=5.0):
+    """
+    Runs the soak on the GUI's analysis page and returns the samples.
+
+    Each cycle presses the switch and pumps Tk until the page has finished
+    it. Leaving the page races one more press from another thread, which
+    must be ignored rather than left queued on the stopped scheduler.
+    """
+    import tkinter as tk
+    import wincup
+
+    logging.getLogger('wincup').setLevel(logging.WARNING)
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix='wincup-soak-')
+    for name in (capture.SETTINGS_FILE, 'wclogo.gif'):
+        shutil.copy(name, scratch)
+    os.chdir(scratch)
+    root = mainframe = None
+    try:
+        camera = simulate.SimulatedCamera(seed=seed)
+        background = camera.background()
+        baseline.save(baseline.BASELINE_FILE, {'mean': background}, capture.load_settings(), 1)
+        # the switch never fires by itself; the soak presses it
+        wincup.gpio = types.SimpleNamespace(Button=lambda pin: simulate.SimulatedButton(period=3600),
+                                            LED=simulate.SimulatedLED)
+        root = tk.Tk()
+        mainframe = wincup.MainFrame(root)
+        mainframe.open_camera = lambda color=False: simulate.SimulatedCamera(seed=seed)
+        mainframe.pack(side='top', fill='both', expand=True)
+        page = mainframe.frame_difference
+
+        def enter():
+            if page.main2inprogress() is False or page.detector is None:
+                raise RuntimeError('cannot start the analysis page')
+            # presses come one cycle apart here, far closer than on the machine
+            page.scheduler.debounce = 0.0
+
+        def leave():
+            racer = threading.Thread(target=page.on_press, name='soak-press')
+            racer.start()
+            page.inprogress2main()
+            racer.join()
+            if page.scheduler.trigger() is not None:
+                raise RuntimeError('the stopped scheduler took a press')
+
+        enter()
+        samples = []
+        window = []
+        for i in range(1, cycles + 1):
+            done = page.followup.done + 1
+            start = time.perf_counter()
+            page.on_press()
+            while page.followup.done < done:
+                root.update()
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError('cycle {} took longer than {} s'.format(i, timeout))
+                time.sleep(0.001)
+            window.append(time.perf_counter() - start)
+            if reenter_every and i % reenter_every == 0:
+                leave()
+                enter()
+            if i % sample_every == 0:
+                samples.append(sample(i, window))
+                window = []
+        leave()
+    finally:
+        if mainframe is not None:
+            mainframe.onQuit()
+            if mainframe.output is not None:
+                mainframe.output.close()
+        elif root is not None:
+            root.destroy()
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return samples
+
+
+def check(samples, warmup=0.1, max_rss_mb=20.0, max_fds=2, max_threads=1, max_latency=0.5):
+    """
+    Returns a list of failures for samples.
+
+    The first warmup fraction of samples is ignored. Latency may grow by
+    max_latency as a fraction of its starting value; the other limits are
+    absolute growth over the run.
+    """
+    samples = samples[int(len(samples) * warmup):]
+    if len(samples) < 2:
+        return ['too few samples; run more cycles']
+    xs = [s['cycle'] for s in samples]
+    failures = []
+    limits = [('rss_mb', max_rss_mb, 'MB'), ('fds', max_fds, ''), ('threads', max_threads, '')]
+    for key, limit, unit in limits:
+        g = growth(xs, [s[key] for s in samples])
+        if g > limit:
+            failures.append('{} grew by {:.2f}{} (limit {}{})'.format(key, g, unit, limit, unit))
+    latency = [s['latency_ms'] for s in samples]
+    first = float(numpy.median(latency[:max(1, len(latency) // 10)]))
+    g = growth(xs, latency)
+    if first and g / first > max_latency:
+        failures.append('latency grew by {:.0%} from {:.3f} ms'.format(g / first, first))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak the analysis loop on simulated hardware.')
+    parser.add_argument('--cycles', type=int, default=100000)
+    parser.add_argument('--sample-every', type=int, default=500)
+    parser.add_argument('--reenter-every', type=int, default=5000,
+                        help='reopen all devices every this many cycles, 0 never')
+    parser.add_argument('--no-monitor', action='store_true', help='skip annotation and JPEG encoding')
+    parser.add_argument('--gui', action='store_true',
+                        help="soak the GUI's analysis page instead of the service; needs a display")
+    parser.add_argument('--max-rss-mb', type=float, default=20.0)
+    parser.add_argument('--max-fds', type=int, default=2)
+    parser.add_argument('--max-threads', type=int, default=1)
+    parser.add_argument('--max-latency', type=float, default=0.5,
+                        help='allowed latency growth as a fraction')
+    parser.add_argument('--csv', help='write the samples to this file')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    if args.gui:
+        samples = soak_gui(args.cycles, args.sample_every, args.reenter_every)
+    else:
+        samples = soak(args.cycles, args.sample_every, args.reenter_every, not args.no_monitor)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(samples[0]))
+            writer.writeheader()
+            writer.writerows(samples)
+    first, last = samples[0], samples[-1]
+    print('{} cycles in {:.0f} s'.format(args.cycles, time.monotonic() - started))
+    for key in ('rss_mb', 'fds', 'threads', 'latency_ms'):
+        print('{:<11} {:>10} -> {}'.format(key, first[key], last[key]))
+
+    failures = check(samples, max_rss_mb=args.max_rss_mb, max_fds=args.max_fds,
+                     max_threads=args.max_threads, max_latency=args.max_latency)
+    for failure in failures:
+        print('FAIL: ' + failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Helpers for a fast cold start.
+
+LazyModule defers importing heavy modules (cv2, numpy, picamera, ...) until an
+attribute is first used, and StartupTimer records how long each startup phase
+took so the time to the splash screen can be reported.
+"""
+import importlib
+import sys
+import time
+
+
+class LazyModule(object):
+    """
+    Stands in for a module and imports it on first attribute access.
+
+    Attributes:
+        name: The dotted name of the module to import.
+    """
+    def __init__(self, name):
+        self.__dict__['name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return '<lazy module {!r} ({})>'.format(self.__dict__['name'], state)
+
+
+class StartupTimer(object):
+    """
+    Records the duration of each startup phase.
+
+    Attributes:
+        start: The perf_counter time the timer was created.
+        phases: A list of (name, seconds) in the order they were marked.
+    """
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []
+        self._last = self.start
+
+    def mark(self, name):
+        """Ends the current phase, naming it name."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.start
+
+    def report(self, file=None):
+        """Writes the phase breakdown to file (stderr by default)."""
+        file = sys.stderr if file is None else file
+        width = max([len(name) for name, _ in self.phases] + [5])
+        for name, seconds in self.phases:
+            file.write('{:<{}}  {:8.1f} ms\n'.format(name, width, seconds * 1000.0))
+        file.write('{:<{}}  {:8.1f} ms\n'.format('total', width, self.total * 1000.0))
@@ -0,0 +1,24 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, next to this directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def settings():
+    """Camera settings in the form of a camerasettings.json profile."""
+    return {'brightness': 50, 'contrast': 0, 'rotation': 0, 'sharpness': 0,
+            'shutter_speed': 2000, 'zoom': (0.0, 0.0, 1.0, 1.0)}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A scratch working directory holding a copy of camerasettings.json."""
+    shutil.copy(os.path.join(ROOT, 'camerasettings.json'), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,99 @@
+import json
+import struct
+
+import pytest
+
+from startup import LazyModule
+
+import baseline
+import capture
+import simulate
+
+numpy = LazyModule('numpy')
+
+
+@pytest.fixture
+def arrays():
+    camera = simulate.SimulatedCamera(seed=0)
+    return baseline.accumulate(camera.read_gray() for _ in range(5))
+
+
+def test_round_trip_through_memmap(tmp_path, arrays, settings):
+    path = str(tmp_path / 'baseline.wcb')
+    baseline.save(path, arrays, settings, 5, extra={'zoom_source': 'test'})
+    base = baseline.load(path, settings)
+    assert isinstance(base.mean, numpy.memmap)
+    assert not base.mean.flags.writeable
+    numpy.testing.assert_array_equal(base.mean, arrays['mean'])
+    numpy.testing.assert_array_equal(base.noise, arrays['noise'])
+    assert base.noise.dtype == numpy.float32
+    assert base.nbytes == arrays['mean'].nbytes + arrays['noise'].nbytes
+
+
+def test_header_records_provenance(tmp_path, arrays, settings):
+    path = str(tmp_path / 'baseline.wcb')
+    baseline.save(path, arrays, settings, 5, extra={'zoom_source': 'test'})
+    header = baseline.read_header(path)
+    assert header['version'] == baseline.VERSION
+    assert (header['width'], header['height']) == (400, 250)
+    assert header['frames'] == 5
+    assert header['settings_hash'] == baseline.settings_hash(settings)
+    assert header['settings']['zoom'] == list(settings['zoom'])
+    assert header['zoom_source'] == 'test'
+    assert {a['name'] for a in header['arrays']} == {'mean', 'noise'}
+    assert all(a['offset'] % baseline.ALIGN == 0 for a in header['arrays'])
+    # the header is plain JSON behind the magic and its length
+    with open(path, 'rb') as file:
+        assert file.read(len(baseline.MAGIC)) == baseline.MAGIC
+        length = struct.unpack('<I', file.read(4))[0]
+        assert json.loads(file.read(length).decode('utf-8'))['frames'] == 5
+
+
+def test_noise_is_optional(tmp_path, arrays, settings):
+    path = str(tmp_path / 'baseline.wcb')
+    baseline.save(path, {'mean': arrays['mean']}, settings, 1)
+    assert baseline.load(path, settings).noise is None
+
+
+def test_other_settings_are_rejected(tmp_path, arrays, settings):
+    path = str(tmp_path / 'baseline.wcb')
+    baseline.save(path, arrays, settings, 5)
+    with pytest.raises(baseline.BaselineMismatch):
+        baseline.load(path, dict(settings, brightness=60))
+    with pytest.raises(baseline.BaselineMismatch):
+        baseline.load(path, dict(settings, zoom=(0.1, 0.1, 0.8, 0.8)))
+    # without settings to check against it still loads
+    assert baseline.load(path).header['frames'] == 5
+
+
+def test_other_size_is_rejected(tmp_path, settings):
+    path = str(tmp_path / 'baseline.wcb')
+    mean = numpy.zeros((500, 800), numpy.uint8)
+    baseline.save(path, {'mean': mean}, settings, 1, size=(800, 500))
+    assert baseline.load(path, settings, size=(800, 500)).mean.shape == (500, 800)
+    with pytest.raises(baseline.BaselineMismatch):
+        baseline.load(path, settings)
+
+
+def test_broken_files_are_rejected(tmp_path, arrays, settings):
+    path = tmp_path / 'baseline.wcb'
+    path.write_bytes(b'not a baseline')
+    with pytest.raises(baseline.BaselineError):
+        baseline.load(str(path))
+    baseline.save(str(path), arrays, settings, 5)
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(baseline.BaselineError):
+        baseline.load(str(path), settings)
+    with pytest.raises(baseline.BaselineError):
+        baseline.load(str(tmp_path / 'missing.wcb'))
+
+
+def test_save_leaves_no_temporary_file(tmp_path, arrays, settings):
+    baseline.save(str(tmp_path / 'baseline.wcb'), arrays, settings, 5)
+    assert [p.name for p in tmp_path.iterdir()] == ['baseline.wcb']
+
+
+def test_load_current_checks_the_saved_settings(workdir, arrays):
+    baseline.save(baseline.BASELINE_FILE, arrays, capture.load_settings(), 5)
+    assert baseline.load_current().header['frames'] == 5
@@ -0,0 +1,106 @@
+import pytest
+
+from startup import LazyModule
+
+import baseline
+import checkpoint
+import detectors
+import heatmap as heatmaps
+import simulate
+import trigger
+
+numpy = LazyModule('numpy')
+
+
+@pytest.fixture
+def calibrated(tmp_path, settings):
+    """The path of a baseline calibrated from a clean simulated mold."""
+    camera = simulate.SimulatedCamera(defect_rate=0.0, seed=0)
+    path = str(tmp_path / 'baseline.wcb')
+    baseline.save(path, baseline.accumulate(camera.read_gray() for _ in range(5)), settings, 5)
+    return path
+
+
+def run(path, name, **options):
+    """Returns a detector, scheduler and heatmap that have seen a few cycles."""
+    base = baseline.load(path)
+    detector = detectors.create(name, base.mean, 25, noise=base.noise, **options)
+    camera = simulate.SimulatedCamera(defect_rate=0.5, seed=1)
+    heatmap = heatmaps.Heatmap(camera.size)
+    for _ in range(8):
+        heatmap.add(detector.detect(camera.read_gray()))
+    scheduler = trigger.TriggerScheduler(lambda cycle: None)
+    scheduler.restore({'triggers': 12, 'completed': 11, 'coalesced': 1, 'max_latency': 0.25})
+    return detector, scheduler, heatmap
+
+
+@pytest.mark.parametrize('name, options', [('absdiff', {'noise_factor': 3.0}), ('mog2', {})])
+def test_round_trip(tmp_path, calibrated, settings, name, options):
+    detector, scheduler, heatmap = run(calibrated, name, **options)
+    arrays, state = checkpoint.collect(detector, scheduler, heatmap, options=options, recipe=None,
+                                       baseline=checkpoint.provenance(calibrated), cycles=8)
+    path = str(tmp_path / 'checkpoint.wcb')
+    checkpoint.Checkpointer(path, settings).save(arrays, state)
+
+    saved = checkpoint.load(path, settings)
+    saved.check(None, calibrated)
+    assert saved.state['cycles'] == 8
+    assert saved.state['trigger'] == scheduler.counters()
+    numpy.testing.assert_array_equal(saved.mean, detector.base_gray)
+
+    restored = saved.detector()
+    assert (restored.name, restored.sens, restored.count) == (name, 25, 8)
+    if name == 'absdiff':
+        numpy.testing.assert_array_equal(restored.limit, detector.limit)
+    else:
+        numpy.testing.assert_array_equal(restored.subtractor.getBackgroundImage(),
+                                         detector.subtractor.getBackgroundImage())
+    frame = simulate.SimulatedCamera(defect_rate=1.0, seed=2).read_gray()
+    assert restored.detect(frame).boxes == detector.detect(frame).boxes
+
+    restored_heatmap = saved.heatmap(str(tmp_path / 'heatmap.wcb'))
+    numpy.testing.assert_array_equal(restored_heatmap.counts, heatmap.counts)
+    assert (restored_heatmap.cycles, restored_heatmap.started) == (8, heatmap.started)
+
+
+def save(tmp_path, path, settings, recipe=None):
+    detector, _, _ = run(path, 'absdiff')
+    arrays, state = checkpoint.collect(detector, recipe=recipe, baseline=checkpoint.provenance(path))
+    checkpoint.Checkpointer(str(tmp_path / 'checkpoint.wcb'), settings).save(arrays, state)
+    return checkpoint.load(str(tmp_path / 'checkpoint.wcb'), settings)
+
+
+def test_recalibrated_baseline_makes_it_stale(tmp_path, calibrated, settings):
+    saved = save(tmp_path, calibrated, settings)
+    base = baseline.load(calibrated)
+    arrays = {'mean': numpy.array(base.mean), 'noise': numpy.array(base.noise)}
+    # created has a resolution of a second; a recalibration is always later
+    baseline.save(calibrated, arrays, settings, 5, extra={'created': '2099-01-01T00:00:00'})
+    with pytest.raises(checkpoint.StaleCheckpoint):
+        saved.check(None, calibrated)
+
+
+def test_other_recipe_makes_it_stale(tmp_path, calibrated, settings):
+    saved = save(tmp_path, calibrated, settings, recipe='cup-12oz')
+    saved.check('cup-12oz', calibrated)
+    with pytest.raises(checkpoint.StaleCheckpoint):
+        saved.check('cup-16oz', calibrated)
+    with pytest.raises(checkpoint.StaleCheckpoint):
+        saved.check(None, calibrated)
+
+
+def test_missing_baseline_makes_it_stale(tmp_path, calibrated, settings):
+    saved = save(tmp_path, calibrated, settings)
+    with pytest.raises(checkpoint.StaleCheckpoint):
+        saved.check(None, None)
+
+
+def test_other_settings_are_refused(tmp_path, calibrated, settings):
+    save(tmp_path, calibrated, settings)
+    with pytest.raises(baseline.BaselineError):
+        checkpoint.load(str(tmp_path / 'checkpoint.wcb'), dict(settings, brightness=60))
+
+
+def test_a_baseline_is_not_a_checkpoint(calibrated, settings):
+    with pytest.raises(baseline.BaselineError):
+        checkpoint.load(calibrated, settings)
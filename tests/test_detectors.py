@@ -0,0 +1,124 @@
+import pytest
+
+import baseline
+import detectors
+import simulate
+
+
+@pytest.fixture(scope='module')
+def base():
+    camera = simulate.SimulatedCamera(defect_rate=0.0, seed=0)
+    return baseline.accumulate(camera.read_gray() for _ in range(10))
+
+
+@pytest.fixture
+def camera():
+    return simulate.SimulatedCamera(defect_rate=0.0, seed=1)
+
+
+def contaminated(camera):
+    """Returns a frame with contamination and the boxes it was dropped in."""
+    camera.defect_rate = 1.0
+    frame = camera.read_gray()
+    camera.defect_rate = 0.0
+    return frame, camera.last_boxes
+
+
+def overlaps(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+def test_registry():
+    assert set(detectors.DETECTORS) == {'absdiff', 'ssim', 'mog2'}
+    assert detectors.DEFAULT in detectors.DETECTORS
+    for name, cls in detectors.DETECTORS.items():
+        assert cls.name == name
+        assert issubclass(cls, detectors.Detector)
+
+
+def test_create_unknown_detector(base):
+    with pytest.raises(ValueError, match='absdiff, mog2, ssim'):
+        detectors.create('nope', base['mean'])
+
+
+def test_create_passes_options(base):
+    detector = detectors.create('ssim', base['mean'], 30, 7, block=16)
+    assert (detector.sens, detector.min_size, detector.block) == (30, 7, 16)
+    with pytest.raises(TypeError):
+        detectors.create('ssim', base['mean'], unknown=1)
+
+
+@pytest.mark.parametrize('text, option', [
+    ('noise_factor=3', ('noise_factor', 3)),
+    ('learning_rate=0.01', ('learning_rate', 0.01)),
+    ('tiles=(2, 3)', ('tiles', (2, 3))),
+    ('threshold=None', ('threshold', None)),
+    ('mode=fast', ('mode', 'fast')),
+    ('mode=', ('mode', '')),
+    ('flag', ('flag', '')),
+])
+def test_parse_option(text, option):
+    assert detectors.parse_option(text) == option
+
+
+@pytest.mark.parametrize('name, options', [
+    ('absdiff', {}),
+    ('absdiff', {'noise_factor': 3.0}),
+    ('ssim', {}),
+    ('mog2', {}),
+])
+def test_finds_contamination(base, camera, name, options):
+    detector = detectors.create(name, base['mean'], noise=base['noise'], **options)
+    for _ in range(3):
+        assert not detector.detect(camera.read_gray()).reject
+
+    frame, dropped = contaminated(camera)
+    detection = detector.detect(frame)
+    assert detection.reject and detection.complete
+    assert detection.detector == name
+    for box in dropped:
+        assert any(overlaps(box, found) for found in detection.boxes)
+    for found in detection.boxes:
+        assert any(overlaps(box, found) for box in dropped)
+
+    first = detector.detect(frame, first=True)
+    assert first.reject
+    if not first.complete:
+        assert len(first.boxes) == 1
+        detector.finish(first)
+    assert sorted(first.boxes) == sorted(detection.boxes)
+    assert detector.count == 5
+    assert detector.snapshot()['frames'] == 5
+    detector.close()
+
+
+def test_tiled_absdiff_finds_the_same_boxes(base, camera):
+    plain = detectors.create('absdiff', base['mean'])
+    tiled = detectors.create('absdiff', base['mean'], tiles=(2, 2), workers=2)
+    try:
+        frame, _ = contaminated(camera)
+        assert sorted(tiled.detect(frame, first=True).boxes) == sorted(plain.detect(frame).boxes)
+    finally:
+        tiled.close()
+
+
+def test_ssim_ignores_a_global_brightness_change(base, camera):
+    detector = detectors.create('ssim', base['mean'])
+    frame = camera.read_gray()
+    assert not detector.detect(frame + 6).reject
+
+
+def test_mog2_restores_its_background(base, camera):
+    detector = detectors.create('mog2', base['mean'], learning_rate=0.05)
+    for _ in range(5):
+        detector.detect(camera.read_gray())
+    counters, arrays = detector.state()
+    assert counters['count'] == 5
+    assert arrays['background'].shape == base['mean'].shape
+    restored = detectors.create('mog2', base['mean'], learning_rate=0.05)
+    restored.restore(counters, arrays)
+    assert restored.count == 5
+    frame, _ = contaminated(camera)
+    assert sorted(restored.detect(frame).boxes) == sorted(detector.detect(frame).boxes)
@@ -0,0 +1,113 @@
+import io
+import itertools
+import json
+import logging
+import os
+import threading
+
+import pytest
+
+from startup import LazyModule
+
+import eventlog
+
+numpy = LazyModule('numpy')
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def name():
+    """A logger of its own, so tests do not see each other's handlers."""
+    return 'wincup.test{}'.format(next(_names))
+
+
+def read(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_events_are_json_lines(tmp_path, name):
+    path = str(tmp_path / 'logs' / 'events.jsonl')
+    log = eventlog.EventLog(path, logger=name).start()
+    try:
+        eventlog.event(logging.getLogger(name), 'verdict', cycle=12, verdict='reject',
+                       objects=numpy.int64(2), boxes=numpy.array([[1, 2, 3, 4]]))
+        logging.getLogger(name + '.gui').warning('%d frames late', 3)
+    finally:
+        log.stop()
+    first, second = read(path)
+    assert first['event'] == 'verdict'
+    assert (first['level'], first['logger']) == ('INFO', name)
+    assert (first['cycle'], first['verdict'], first['objects']) == (12, 'reject', 2)
+    assert first['boxes'] == [[1, 2, 3, 4]]
+    assert second['event'] == '3 frames late'
+    assert (second['level'], second['logger']) == ('WARNING', name + '.gui')
+
+
+def test_written_by_the_listener_thread(tmp_path, name, monkeypatch):
+    threads = []
+    format = eventlog.JSONFormatter.format
+
+    def recording(self, record):
+        threads.append(threading.current_thread())
+        return format(self, record)
+
+    monkeypatch.setattr(eventlog.JSONFormatter, 'format', recording)
+    path = str(tmp_path / 'events.jsonl')
+    log = eventlog.EventLog(path, logger=name).start()
+    try:
+        for cycle in range(10):
+            eventlog.event(logging.getLogger(name), 'cycle', cycle=cycle)
+    finally:
+        log.stop()
+    assert threads
+    assert threading.current_thread() not in threads
+    # stop() writes out everything that was queued
+    assert [entry['cycle'] for entry in read(path)] == list(range(10))
+
+
+def test_file_rotates(tmp_path, name):
+    path = str(tmp_path / 'events.jsonl')
+    log = eventlog.EventLog(path, max_bytes=500, backups=2, logger=name).start()
+    try:
+        for cycle in range(100):
+            eventlog.event(logging.getLogger(name), 'cycle', cycle=cycle)
+    finally:
+        log.stop()
+    assert os.path.exists(path + '.1') and os.path.exists(path + '.2')
+    assert not os.path.exists(path + '.3')
+    kept = read(path + '.2') + read(path + '.1') + read(path)
+    assert all(os.path.getsize(p) <= 500 for p in (path, path + '.1', path + '.2'))
+    # the newest events are kept, whole and in order
+    cycles = [entry['cycle'] for entry in kept]
+    assert cycles == list(range(100 - len(cycles), 100))
+
+
+def test_exceptions_are_formatted(tmp_path, name):
+    path = str(tmp_path / 'events.jsonl')
+    log = eventlog.EventLog(path, logger=name).start()
+    try:
+        try:
+            raise RuntimeError('camera gone')
+        except RuntimeError:
+            logging.getLogger(name).exception('capture failed')
+    finally:
+        log.stop()
+    entry, = read(path)
+    assert entry['event'] == 'capture failed'
+    assert 'RuntimeError: camera gone' in entry['exc']
+
+
+def test_level_and_console(tmp_path, name):
+    console = io.StringIO()
+    log = eventlog.EventLog(None, level=logging.WARNING, logger=name, console=console).start()
+    try:
+        eventlog.event(logging.getLogger(name), 'verdict', verdict='pass')
+        eventlog.event(logging.getLogger(name), 'overrun', level=logging.WARNING, cycle=4, ms=12.5)
+    finally:
+        log.stop()
+    lines = console.getvalue().splitlines()
+    assert len(lines) == 1
+    assert lines[0].endswith('{} WARNING overrun cycle=4 ms=12.5'.format(name))
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from startup import LazyModule
+
+import baseline
+import detectors
+import heatmap as heatmaps
+
+numpy = LazyModule('numpy')
+
+SIZE = (400, 250)
+
+
+def mask_with(*boxes):
+    mask = numpy.zeros(SIZE[::-1], numpy.uint8)
+    for x, y, w, h in boxes:
+        mask[y:y + h, x:x + w] = 255
+    return mask
+
+
+def test_counts_accumulate_per_cell():
+    heatmap = heatmaps.Heatmap(SIZE)
+    # 400 x 250 is 50 x 32 cells, the last row only partly in the frame
+    assert heatmap.counts.shape == (32, 50)
+    for _ in range(3):
+        heatmap.add_mask(mask_with((0, 0, 1, 1)))
+    heatmap.add_mask(mask_with((16, 8, 9, 1), (399, 249, 1, 1)))
+    heatmap.add_mask(mask_with())
+    assert heatmap.cycles == 5
+    assert heatmap.counts[0, 0] == 3
+    # a blob counts once in every cell it touches, however much of it
+    numpy.testing.assert_array_equal(heatmap.counts[1, 2:5], [1, 1, 0])
+    assert heatmap.counts[31, 49] == 1
+    assert heatmap.counts.sum() == 3 + 2 + 1
+    assert heatmap.rates()[0, 0] == pytest.approx(0.6)
+    assert heatmap.hottest(1) == [(0, 0, 8, 8, 3)]
+    assert len(heatmap.hottest(10)) == 4
+
+
+def test_boxes_count_like_their_mask():
+    by_mask, by_boxes = heatmaps.Heatmap(SIZE), heatmaps.Heatmap(SIZE)
+    boxes = [(5, 5, 20, 11), (100, 200, 8, 8), (392, 242, 8, 8)]
+    by_mask.add_mask(mask_with(*boxes))
+    by_boxes.add(detectors.Detection('absdiff', boxes, None, 0.0))
+    numpy.testing.assert_array_equal(by_boxes.counts, by_mask.counts)
+
+
+def test_memory_is_constant():
+    heatmap = heatmaps.Heatmap(SIZE)
+    before = heatmap.counts
+    mask = mask_with((0, 0, 400, 250))
+    for _ in range(100):
+        heatmap.add_mask(mask)
+    assert heatmap.counts is before
+    assert heatmap.counts.dtype == numpy.uint32
+    assert heatmap.counts.max() == 100
+
+
+def test_reset_starts_the_next_shift():
+    heatmap = heatmaps.Heatmap(SIZE)
+    heatmap.add_mask(mask_with((0, 0, 10, 10)))
+    assert heatmap.started is not None
+    heatmap.reset()
+    assert (heatmap.cycles, heatmap.started, heatmap.counts.max()) == (0, None, 0)
+    assert heatmap.overlay(mask_with()).shape == SIZE[::-1] + (3,)
+
+
+def test_saved_and_reopened(tmp_path, settings):
+    path = str(tmp_path / heatmaps.HEATMAP_FILE)
+    heatmap = heatmaps.Heatmap.open(path, settings, SIZE)
+    heatmap.add_mask(mask_with((40, 40, 16, 16)))
+    heatmap.save()
+    reopened = heatmaps.Heatmap.open(path, settings, SIZE)
+    numpy.testing.assert_array_equal(reopened.counts, heatmap.counts)
+    assert (reopened.cycles, reopened.started) == (1, heatmap.started)
+    reopened.add_mask(mask_with((40, 40, 1, 1)))
+    assert reopened.counts[5, 5] == 2
+
+
+def test_other_settings_start_afresh(tmp_path, settings):
+    path = str(tmp_path / heatmaps.HEATMAP_FILE)
+    heatmap = heatmaps.Heatmap(SIZE, path=path, settings=settings)
+    heatmap.add_mask(mask_with((40, 40, 16, 16)))
+    heatmap.save()
+    with pytest.raises(baseline.BaselineError):
+        heatmaps.Heatmap.load(path, dict(settings, brightness=60), SIZE)
+    fresh = heatmaps.Heatmap.open(path, dict(settings, brightness=60), SIZE)
+    assert (fresh.cycles, fresh.counts.max()) == (0, 0)
+    assert heatmaps.Heatmap.open(path, settings, SIZE, cell=16).cycles == 0
+
+
+def test_autosave_waits_for_every(tmp_path, settings):
+    path = str(tmp_path / heatmaps.HEATMAP_FILE)
+    heatmap = heatmaps.Heatmap(SIZE, path=path, settings=settings, every=60.0)
+    heatmap.autosave()
+    assert not os.path.exists(path)
+    heatmap.every = 1e-9
+    heatmap.autosave()
+    assert os.path.exists(path)
+
+
+def test_lives_next_to_its_baseline():
+    assert heatmaps.path_for(os.path.join('recipes', 'cup', 'baseline.wcb')) == \
+        os.path.join('recipes', 'cup', heatmaps.HEATMAP_FILE)
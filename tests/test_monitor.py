@@ -0,0 +1,100 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import monitor
+import simulate
+
+BOUNDARY = b'--' + monitor.BOUNDARY
+
+
+@pytest.fixture
+def server():
+    server = monitor.MonitorServer(monitor.LatestResult(), port=0, max_fps=50, keepalive=0.1).start()
+    yield server
+    server.stop()
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.01)
+
+
+def open_stream(server):
+    client = socket.create_connection(('127.0.0.1', server.port), timeout=2.0)
+    client.sendall(b'GET /stream.mjpg HTTP/1.0\r\n\r\n')
+    head = b''
+    while b'\r\n\r\n' not in head:
+        head += client.recv(1)
+    assert head.startswith(b'HTTP/1.0 200 OK')
+    return client
+
+
+def read_until(client, count, marker=BOUNDARY):
+    data = b''
+    while data.count(marker) < count:
+        chunk = client.recv(65536)
+        assert chunk, 'the server closed the stream'
+        data += chunk
+    return data
+
+
+def publish(latest):
+    camera = simulate.SimulatedCamera(seed=0)
+    camera.read_gray()
+    latest.publish(camera.color_image(), [], 0.001)
+
+
+def test_stream_is_released_when_the_client_hangs_up(server):
+    client = open_stream(server)
+    wait_for(lambda: server.streams == 1)
+    # no frame is ever published, so nothing is written that could fail
+    client.close()
+    wait_for(lambda: server.streams == 0)
+
+
+def test_stream_resends_the_last_frame_to_keep_alive(server):
+    publish(server.latest)
+    client = open_stream(server)
+    try:
+        # one frame, then keep-alives without a new one
+        read_until(client, 3)
+    finally:
+        client.close()
+    wait_for(lambda: server.streams == 0)
+
+
+def test_each_client_gets_new_frames(server):
+    clients = [open_stream(server) for _ in range(3)]
+    try:
+        wait_for(lambda: server.streams == 3)
+        publish(server.latest)
+        for client in clients:
+            assert b'Content-Type: image/jpeg' in read_until(client, 1)
+    finally:
+        for client in clients:
+            client.close()
+    wait_for(lambda: server.streams == 0)
+
+
+def test_stop_with_a_stream_connected(caplog):
+    server = monitor.MonitorServer(monitor.LatestResult(), port=0, max_fps=50).start()
+    publish(server.latest)
+    client = open_stream(server)
+    try:
+        read_until(client, 1)
+        stopper = threading.Thread(target=server.stop)
+        stopper.start()
+        stopper.join(5.0)
+        assert not stopper.is_alive(), 'stop() hung'
+        # the stream was ended rather than left pending
+        while client.recv(65536):
+            pass
+    finally:
+        client.close()
+    assert server.streams == 0
+    assert not [r for r in caplog.records if r.name == 'asyncio']
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+import output
+import simulate
+
+DEADLINE = 0.05
+
+
+@pytest.fixture
+def controller():
+    controller = output.OutputController(simulate.SimulatedLED, (5, 6), priority=None, deadline=DEADLINE)
+    yield controller
+    controller.close()
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.001)
+
+
+def test_verdict_in_time_is_put_out(controller):
+    triggered = time.monotonic()
+    controller.arm(triggered)
+    request = controller.signal(False, triggered)
+    assert controller.signaled(request, timeout=1.0) is not None
+    time.sleep(2 * DEADLINE)
+    snapshot = controller.snapshot()
+    assert snapshot['verdict'] == 'pass'
+    assert snapshot['late'] == 0
+
+
+def test_missed_deadline_rejects(controller):
+    controller.arm(time.monotonic())
+    wait_for(lambda: controller.snapshot()['late'] == 1)
+    assert controller.snapshot()['verdict'] == 'reject'
+
+
+def test_late_pass_does_not_undo_the_reject(controller):
+    triggered = time.monotonic()
+    controller.arm(triggered)
+    wait_for(lambda: controller.snapshot()['late'] == 1)
+    request = controller.signal(False, triggered)
+    wait_for(lambda: controller.snapshot()['dropped'] == 1)
+    assert controller.signaled(request) is None
+    assert controller.snapshot()['verdict'] == 'reject'
+
+
+def test_next_trigger_is_answered_after_a_reject(controller):
+    first = time.monotonic()
+    controller.arm(first)
+    wait_for(lambda: controller.snapshot()['late'] == 1)
+    second = time.monotonic()
+    controller.arm(second)
+    assert controller.signaled(controller.signal(False, second), timeout=1.0) is not None
+    assert controller.snapshot()['verdict'] == 'pass'
+
+
+def test_off_forgets_armed_triggers(controller):
+    controller.arm(time.monotonic())
+    controller.off()
+    time.sleep(3 * DEADLINE)
+    snapshot = controller.snapshot()
+    assert snapshot['late'] == 0
+    assert snapshot['verdict'] is None
+
+
+def test_no_deadline_never_rejects():
+    controller = output.OutputController(simulate.SimulatedLED, (5, 6), priority=None)
+    try:
+        controller.arm(time.monotonic())
+        time.sleep(3 * DEADLINE)
+        assert controller.snapshot()['late'] == 0
+        assert controller.snapshot()['verdict'] is None
+    finally:
+        controller.close()
+
+
+def test_percentile_is_never_above_the_maximum():
+    histogram = output.Histogram()
+    for ms in (0.1, 0.15, 0.216):
+        histogram.add(ms / 1000.0)
+    assert histogram.percentile(99) == 0.216
+    assert histogram.snapshot()['p99_ms'] <= histogram.snapshot()['max_ms']
+
+
+def test_percentile_is_the_bucket_edge_below_the_maximum():
+    histogram = output.Histogram()
+    for _ in range(99):
+        histogram.add(0.0003)
+    histogram.add(0.0069)
+    assert histogram.percentile(50) == 0.5
+    assert histogram.percentile(100) == 6.9
+    histogram.add(0.2)
+    assert histogram.percentile(100) == 200.0
@@ -0,0 +1,104 @@
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+import pytest
+
+import profiling
+
+REPORTS = {'cpu.txt', 'cpu.prof', 'memory.txt', 'objects.txt', 'summary.json'}
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    path = str(tmp_path / 'profiles')
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', path)
+    return path
+
+
+def cycle(seen):
+    """A cycle handler that counts its calls."""
+    seen.append(None)
+    return len(seen)
+
+
+def profiled(path):
+    """Returns how many times cycle() was called under the profiler."""
+    stats = pstats.Stats(os.path.join(path, 'cpu.prof')).stats
+    return sum(calls for (_, _, name), (_, calls, _, _, _) in stats.items() if name == 'cycle')
+
+
+def summary(path):
+    with open(os.path.join(path, 'summary.json')) as file:
+        return json.load(file)
+
+
+def wait_stopped(session, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while session.last_dir is None:
+        assert time.monotonic() < deadline, 'the session did not stop'
+        time.sleep(0.01)
+
+
+def test_off_costs_nothing(profile_dir):
+    seen = []
+    session = profiling.ProfileSession()
+    wrapped = session.wrap(lambda: cycle(seen))
+    assert [wrapped() for _ in range(3)] == [1, 2, 3]
+    assert not tracemalloc.is_tracing()
+    session.stop()
+    assert not os.path.exists(profile_dir)
+
+
+def test_start_and_stop_write_the_reports(profile_dir):
+    seen = []
+    session = profiling.ProfileSession(cycles=50)
+    wrapped = session.wrap(lambda: cycle(seen))
+    session.start()
+    assert session.active and tracemalloc.is_tracing()
+    for _ in range(5):
+        wrapped()
+    session.stop()
+    wrapped()
+    assert not session.active and not tracemalloc.is_tracing()
+    assert len(seen) == 6
+    assert os.path.dirname(session.last_dir) == profile_dir
+    assert set(os.listdir(session.last_dir)) == REPORTS
+    assert summary(session.last_dir)['cycles'] == 5
+    assert profiled(session.last_dir) == 5
+    with open(os.path.join(session.last_dir, 'cpu.txt')) as file:
+        assert 'cycle' in file.read()
+
+
+def test_stops_itself_after_its_cycles():
+    seen = []
+    session = profiling.ProfileSession(cycles=3)
+    wrapped = session.wrap(lambda: cycle(seen))
+    session.start()
+    for _ in range(5):
+        wrapped()
+    wait_stopped(session)
+    assert not session.active
+    assert len(seen) == 5
+    assert summary(session.last_dir)['cycles'] == 3
+    assert profiled(session.last_dir) == 3
+
+
+def test_stops_itself_after_max_seconds():
+    session = profiling.ProfileSession(max_seconds=0.05)
+    session.toggle()
+    assert session.active
+    wait_stopped(session)
+    assert not session.active
+    with open(os.path.join(session.last_dir, 'cpu.txt')) as file:
+        assert file.read() == 'No cycles were sampled.\n'
+
+
+def test_toggle_stops_a_running_session():
+    session = profiling.ProfileSession()
+    session.toggle()
+    session.toggle()
+    assert not session.active
+    assert summary(session.last_dir)['cycles'] == 0
@@ -0,0 +1,115 @@
+import pytest
+
+from startup import LazyModule
+
+import baseline
+import capture
+import recipes
+import simulate
+
+numpy = LazyModule('numpy')
+
+
+def calibrate(recipe, size=capture.CAPTURE_SIZE, seed=0):
+    """Saves a baseline of a clean simulated mold for recipe, with its settings, and the recipe."""
+    camera = simulate.SimulatedCamera(size, defect_rate=0.0, seed=seed)
+    recipes.save_recipe(recipe)
+    baseline.save(recipe.baseline_path, baseline.accumulate(camera.read_gray() for _ in range(3)),
+                  recipe.settings, 3, size)
+    return recipe
+
+
+@pytest.fixture
+def saved(workdir, settings):
+    """Three calibrated recipes, a, b and c."""
+    return {name: calibrate(recipes.Recipe(name, settings), seed=i) for i, name in enumerate('abc')}
+
+
+def test_hit_returns_the_same_entry(saved):
+    cache = recipes.RecipeCache()
+    first = cache.get('a')
+    assert cache.get('a') is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    numpy.testing.assert_array_equal(first.mean, baseline.load(saved['a'].baseline_path).mean)
+
+
+def test_least_recently_used_is_evicted(saved):
+    probe = recipes.RecipeCache()
+    one = probe.get('a').nbytes
+    cache = recipes.RecipeCache(budget=2 * one)
+    cache.get('a')
+    cache.get('b')
+    cache.get('a')
+    cache.get('c')
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert cache.nbytes <= cache.budget
+
+
+def test_most_recent_is_kept_over_budget(saved):
+    cache = recipes.RecipeCache(budget=1)
+    cache.get('a')
+    cache.get('b')
+    assert len(cache) == 1
+    assert 'b' in cache
+
+
+def test_hit_sees_the_edited_recipe(saved):
+    cache = recipes.RecipeCache()
+    entry = cache.get('a')
+    edited = recipes.load_recipe('a')
+    edited.sensitivity = 40
+    recipes.save_recipe(edited)
+    assert cache.get('a') is entry
+    assert entry.recipe.sensitivity == 40
+    assert entry.detector().sens == 40
+
+
+def test_changed_settings_invalidate_the_entry(saved):
+    cache = recipes.RecipeCache()
+    cache.get('a')
+    recipe = recipes.load_recipe('a')
+    recipe.settings['brightness'] = 60
+    recipes.save_recipe(recipe)
+    # the cached baseline no longer matches, and neither does the one on disk
+    with pytest.raises(baseline.BaselineError):
+        cache.get('a')
+    assert 'a' not in cache
+    calibrate(recipe)
+    entry = cache.get('a')
+    assert entry.settings_hash == baseline.settings_hash(recipe.settings)
+    assert cache.misses == 3
+
+
+def test_other_size_is_checked_again(saved):
+    cache = recipes.RecipeCache()
+    cache.get('a')
+    with pytest.raises(baseline.BaselineError):
+        cache.get('a', (320, 200))
+    calibrate(saved['a'], (320, 200))
+    assert cache.get('a', (320, 200)).mean.shape == (200, 320)
+
+
+def test_invalidate_reloads(saved):
+    cache = recipes.RecipeCache()
+    entry = cache.get('a')
+    cache.invalidate('a')
+    assert cache.get('a') is not entry
+    assert cache.misses == 2
+
+
+def test_update_settings_removes_settings_set_to_none(workdir, settings):
+    calibrate(recipes.Recipe('a', dict(settings, iso=400)))
+    recipes.activate('a')
+    assert capture.load_settings()['iso'] == 400
+    recipes.update_settings({'iso': None, 'brightness': 60})
+    for profile in (capture.load_settings(), recipes.load_recipe('a').settings):
+        assert 'iso' not in profile
+        assert profile['brightness'] == 60
+
+
+def test_update_settings_without_a_recipe(workdir, settings):
+    recipes.activate(None)
+    recipes.update_settings({'brightness': 60, 'missing': None})
+    assert capture.load_settings() == dict(settings, brightness=60)
+    assert recipes.list_recipes() == []
@@ -0,0 +1,71 @@
+import pytest
+
+from startup import LazyModule
+
+import rectify
+import simulate
+
+numpy = LazyModule('numpy')
+
+FULL = [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]
+SIZE = (400, 250)
+
+
+@pytest.fixture
+def frame():
+    return simulate.SimulatedCamera(SIZE, seed=0).read_gray()
+
+
+def test_nothing_to_correct(settings):
+    assert rectify.build(settings, SIZE) is None
+    source = simulate.SimulatedCamera(SIZE)
+    assert rectify.wrap(source, None) is source
+
+
+def test_whole_frame_is_the_identity(settings, frame):
+    rectifier = rectify.build(dict(settings, corners=FULL), SIZE)
+    assert rectifier.size == SIZE
+    numpy.testing.assert_array_equal(rectifier.apply(frame), frame)
+
+
+def test_lens_without_distortion_is_the_identity(settings, frame):
+    lens = {'matrix': [[300.0, 0.0, 199.5], [0.0, 300.0, 124.5], [0.0, 0.0, 1.0]],
+            'dist': [0.0, 0.0, 0.0, 0.0, 0.0], 'size': list(SIZE)}
+    rectifier = rectify.build(dict(settings, lens=lens, corners=FULL), SIZE)
+    numpy.testing.assert_array_equal(rectifier.apply(frame), frame)
+
+
+def test_corners_are_stretched_onto_the_frame(settings):
+    image = numpy.zeros(SIZE[::-1], numpy.uint8)
+    image[125:, 200:] = 255
+    # the bottom right quarter fills the rectified frame
+    rectifier = rectify.build(dict(settings, corners=[[0.5, 0.5], [1.0, 0.5], [1.0, 1.0], [0.5, 1.0]]), SIZE)
+    rectified = rectifier.apply(image)
+    assert rectified[2:, 2:].min() == 255
+
+
+def test_lens_matrix_is_scaled_to_the_frames():
+    lens = {'matrix': [[300.0, 0.0, 200.0], [0.0, 300.0, 125.0], [0.0, 0.0, 1.0]], 'size': [400, 250]}
+    matrix = rectify.lens_matrix(lens, (800, 500))
+    numpy.testing.assert_allclose(matrix, [[600.0, 0.0, 400.0], [0.0, 600.0, 250.0], [0.0, 0.0, 1.0]])
+
+
+def test_tables_round_trip_through_arrays(settings, frame):
+    rectifier = rectify.build(dict(settings, corners=[[0.1, 0.0], [0.9, 0.1], [1.0, 1.0], [0.0, 0.9]]), SIZE)
+    restored = rectify.from_arrays(rectifier.arrays())
+    assert restored.nbytes == rectifier.nbytes
+    numpy.testing.assert_array_equal(restored.apply(frame), rectifier.apply(frame))
+    assert rectify.from_arrays({'mean': frame}) is None
+
+
+def test_rectified_source_reuses_its_frame(settings):
+    rectifier = rectify.build(dict(settings, corners=FULL), SIZE)
+    source = rectify.wrap(simulate.SimulatedCamera(SIZE, seed=0), rectifier)
+    first = source.read_gray()
+    assert source.read_gray() is first
+    assert source.color_image().shape == SIZE[::-1] + (3,)
+    assert source.defect_rate == 0.2
+
+
+def test_order_corners():
+    assert rectify.order_corners([(9, 9), (0, 0), (0, 9), (9, 0)]) == [(0, 0), (9, 0), (9, 9), (0, 9)]
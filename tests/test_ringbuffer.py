@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from startup import LazyModule
+
+import ringbuffer
+import simulate
+
+numpy = LazyModule('numpy')
+
+
+def frame(value):
+    return numpy.full((25, 40), value, numpy.uint8)
+
+
+def test_newest_frame_is_handed_out_without_waiting():
+    ring = ringbuffer.FrameRing((40, 25), slots=4)
+    try:
+        for value in (1, 2, 3):
+            ring.write(frame(value))
+        started = time.monotonic()
+        assert ring.newer(0) == 3
+        assert time.monotonic() - started < 0.05
+        assert ring.gray(3)[0, 0] == 3
+        with pytest.raises(TimeoutError):
+            ring.newer(3, timeout=0.05)
+    finally:
+        ring.close()
+
+
+def test_recycled_slot_is_not_valid():
+    ring = ringbuffer.FrameRing((40, 25), slots=2)
+    try:
+        ring.write(frame(1))
+        assert ring.valid(1)
+        ring.write(frame(2))
+        ring.write(frame(3))
+        assert not ring.valid(1)
+        assert ring.valid(3)
+    finally:
+        ring.close()
+
+
+def test_capture_process_reads_newest_frames_with_color():
+    capture = ringbuffer.CaptureProcess(simulate.SimulatedCamera, (400, 250), color=True, period=0.01)
+    try:
+        first = capture.read_gray()
+        assert first.shape == (250, 400)
+        assert capture.color_image().shape == (250, 400, 3)
+        assert capture.release()
+        time.sleep(0.1)
+        capture.read_gray()
+        capture.release()
+        snapshot = capture.snapshot()
+        assert snapshot['read'] == 2
+        # the frames captured in between were skipped, not waited for
+        assert snapshot['dropped'] > 0
+        assert snapshot['overwritten'] == 0
+    finally:
+        capture.close()
@@ -0,0 +1,88 @@
+import pytest
+
+from startup import LazyModule
+
+import analysis
+import simulate
+import tiles
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+SIZE = (400, 250)
+
+
+def untiled(base, image, sens, min_size):
+    return sorted(analysis.find_objects(analysis.difference(base, image, sens), min_size))
+
+
+@pytest.fixture(params=[(2, 2), (1, 4), (3, 3)], ids=lambda grid: '{}x{}'.format(*grid))
+def tiled(request):
+    tiled = tiles.TiledDifference((SIZE[1], SIZE[0]), request.param, workers=2)
+    yield tiled
+    tiled.close()
+
+
+def frame_with(*shapes):
+    image = numpy.full((SIZE[1], SIZE[0]), 100, numpy.uint8)
+    for draw in shapes:
+        draw(image)
+    return image
+
+
+def rect(x0, y0, x1, y1):
+    return lambda image: cv2.rectangle(image, (x0, y0), (x1, y1), 200, cv2.FILLED)
+
+
+def ring(x, y, radius):
+    return lambda image: cv2.circle(image, (x, y), radius, 200, 4)
+
+
+SHAPES = {
+    # across the vertical seam of every grid
+    'bar': [rect(150, 40, 260, 60)],
+    # across the horizontal and vertical seams, so in four tiles at once
+    'corner': [rect(180, 100, 220, 150)],
+    # two arms each cut by a seam, joined only far from the overlap
+    'u': [rect(180, 60, 190, 200), rect(210, 60, 220, 200), rect(180, 190, 220, 200)],
+    # hollow, so a fill would claim its inside
+    'ring': [ring(200, 125, 60)],
+    # two blobs a pixel apart across a seam stay two
+    'pair': [rect(150, 80, 198, 90), rect(200, 80, 250, 90)],
+    # a blob in the hole of a ring cut by the seams is not external
+    'ring-with-core': [ring(200, 125, 60), rect(190, 115, 215, 140)],
+    # but one in the bay of a C is
+    'c-with-core': [rect(150, 60, 250, 70), rect(150, 60, 160, 190), rect(150, 180, 250, 190),
+                    rect(190, 115, 215, 140)],
+    # too small on either side of the seam, but big enough once joined
+    'small-halves': [rect(190, 10, 210, 18)],
+}
+
+
+@pytest.mark.parametrize('name', sorted(SHAPES))
+def test_tiled_matches_untiled_across_seams(tiled, name):
+    base = frame_with()
+    image = frame_with(*SHAPES[name])
+    for min_size in (0, 5, 15):
+        expected = untiled(base, image, 25, min_size)
+        assert sorted(tiled.find_objects(base, image, 25, min_size)) == expected
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_tiled_matches_untiled_on_simulated_frames(tiled, seed):
+    camera = simulate.SimulatedCamera(SIZE, defect_rate=1.0, noise=2, seed=seed)
+    base = camera.background()
+    for _ in range(5):
+        image = camera.read_gray()
+        expected = untiled(base, image, 25, 5)
+        assert sorted(tiled.find_objects(base, image, 25, 5)) == expected
+
+
+def test_tiled_matches_untiled_with_a_noise_map(tiled):
+    camera = simulate.SimulatedCamera(SIZE, defect_rate=1.0, noise=4, seed=7)
+    base = camera.background()
+    noise = numpy.random.RandomState(7).uniform(0, 3, base.shape).astype(numpy.float32)
+    sens = analysis.threshold_map(noise, 20)
+    for _ in range(5):
+        image = camera.read_gray()
+        assert sorted(tiled.find_objects(base, image, sens, 5)) == untiled(base, image, sens, 5)
@@ -0,0 +1,174 @@
+import threading
+import time
+
+import pytest
+
+import simulate
+import trigger
+
+
+def test_trigger_after_stop_is_ignored():
+    ran = []
+    scheduler = trigger.TriggerScheduler(ran.append).start()
+    scheduler.stop()
+    assert scheduler.trigger() is None
+    assert scheduler.snapshot()['triggers'] == 0
+    assert ran == []
+
+
+def test_trigger_before_start_is_ignored():
+    scheduler = trigger.TriggerScheduler(lambda cycle: None)
+    assert scheduler.trigger() is None
+
+
+def test_press_racing_stop_leaves_nothing_queued():
+    done = threading.Event()
+    scheduler = trigger.TriggerScheduler(lambda cycle: done.set(), debounce=0.0).start()
+    presser = threading.Thread(target=lambda: [scheduler.trigger() for _ in range(1000)])
+    presser.start()
+    scheduler.stop()
+    presser.join()
+    assert scheduler.trigger() is None
+    assert scheduler._pending is None
+
+
+class Gate(object):
+    """A handler that holds each cycle until it is released."""
+    def __init__(self):
+        self.cycles = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def __call__(self, cycle):
+        self.cycles.append(cycle)
+        self.started.release()
+        self.release.wait(5)
+
+
+def wait_completed(scheduler, n, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while scheduler.completed < n:
+        assert time.monotonic() < deadline, 'cycles did not complete'
+        time.sleep(0.001)
+
+
+def test_bounce_within_debounce_is_ignored():
+    scheduler = trigger.TriggerScheduler(lambda cycle: None, debounce=0.05).start()
+    try:
+        base = time.monotonic()
+        assert scheduler.trigger(base) is not None
+        assert scheduler.trigger(base + 0.01) is None
+        assert scheduler.trigger(base + 0.049) is None
+        assert scheduler.trigger(base + 1.0) is not None
+        assert scheduler.bounces == 2
+        assert scheduler.triggers == 2
+        # the bounces do not count toward the period
+        assert scheduler.period == 1.0
+    finally:
+        scheduler.stop()
+
+
+def test_simulated_switch_bounce_runs_one_cycle_per_press():
+    ran = []
+    scheduler = trigger.TriggerScheduler(ran.append, debounce=0.05).start()
+    button = simulate.SimulatedButton(period=0.1, bounce=3, seed=0)
+    button.when_pressed = scheduler.trigger
+    try:
+        while button.presses < 3:
+            time.sleep(0.01)
+        button.when_pressed = None
+        wait_completed(scheduler, scheduler.triggers)
+    finally:
+        button.close()
+        scheduler.stop()
+    assert scheduler.triggers == button.presses
+    assert scheduler.bounces == 3 * button.presses
+    assert len(ran) == button.presses
+
+
+def test_coalesce_keeps_only_the_newest_waiting_trigger():
+    gate = Gate()
+    scheduler = trigger.TriggerScheduler(gate, trigger.COALESCE, debounce=0.0).start()
+    try:
+        base = time.monotonic()
+        first = scheduler.trigger(base)
+        assert gate.started.acquire(timeout=5)
+        scheduler.trigger(base + 0.1)
+        scheduler.trigger(base + 0.2)
+        newest = scheduler.trigger(base + 0.3)
+        gate.release.set()
+        wait_completed(scheduler, 2)
+    finally:
+        scheduler.stop()
+    assert [c.index for c in gate.cycles] == [first.index, newest.index]
+    assert scheduler.coalesced == 2
+    assert scheduler.missed == 2
+
+
+def test_reject_drops_triggers_while_busy():
+    gate = Gate()
+    scheduler = trigger.TriggerScheduler(gate, trigger.REJECT, debounce=0.0).start()
+    try:
+        base = time.monotonic()
+        scheduler.trigger(base)
+        assert gate.started.acquire(timeout=5)
+        assert scheduler.trigger(base + 0.1) is None
+        assert scheduler.trigger(base + 0.2) is None
+        gate.release.set()
+        wait_completed(scheduler, 1)
+    finally:
+        scheduler.stop()
+    assert len(gate.cycles) == 1
+    assert scheduler.rejected == 2
+    assert scheduler.missed == 2
+
+
+def test_deadline_follows_the_period_and_counts_overruns():
+    scheduler = trigger.TriggerScheduler(lambda cycle: time.sleep(0.05), debounce=0.0,
+                                         deadline_fraction=0.5).start()
+    try:
+        base = time.monotonic() - 0.02
+        first = scheduler.trigger(base)
+        assert first.deadline is None
+        wait_completed(scheduler, 1)
+        # a period of 0.02 s leaves 0.01 s, which the 0.05 s handler overruns
+        second = scheduler.trigger(base + 0.02)
+        assert second.deadline == pytest.approx(base + 0.03)
+        wait_completed(scheduler, 2)
+    finally:
+        scheduler.stop()
+    assert not first.overran
+    assert second.overran
+    assert scheduler.overruns == 1
+
+
+def test_restore_continues_the_counters_of_a_checkpoint():
+    before = trigger.TriggerScheduler(lambda cycle: None, debounce=0.05).start()
+    try:
+        base = time.monotonic()
+        before.trigger(base)
+        before.trigger(base + 0.01)
+        before.trigger(base + 1.0)
+        wait_completed(before, 1)
+    finally:
+        before.stop()
+    saved = before.counters()
+    assert set(saved) == set(trigger.TriggerScheduler.COUNTERS)
+
+    after = trigger.TriggerScheduler(lambda cycle: None, debounce=0.05)
+    after.restore(dict(saved, unknown=1))
+    assert after.counters() == saved
+    assert not hasattr(after, 'unknown')
+    after.start()
+    try:
+        base = time.monotonic()
+        cycle = after.trigger(base)
+        after.trigger(base + 0.01)
+        wait_completed(after, saved['completed'] + 1)
+    finally:
+        after.stop()
+    # the cycles are numbered on from the saved run, and the period carries over
+    assert cycle.index == saved['triggers'] + 1
+    assert after.triggers == saved['triggers'] + 1
+    assert after.bounces == saved['bounces'] + 1
+    assert after.period == saved['period'] == 1.0
@@ -0,0 +1,217 @@
+"""
+Tile-parallel differencing.
+
+Analyzing at the camera's native resolution is too slow on one core for the
+press cycle. TiledDifference splits the frame and the baseline into
+overlapping tiles and runs absdiff, threshold and contour extraction for each
+tile on a thread pool; OpenCV releases the GIL, so the tiles run on all cores.
+Blobs cut by a tile border show up in both tiles' overlap. Each tile labels
+the pixels of its blobs there, and parts that share a pixel in the overlap
+are merged back into one before the size filter is applied. A blob that
+lies in the hole of a blob cut by a border looks external to every tile, so
+the external contours of the region around such blobs are found once more on
+the whole; the result matches analysis.find_objects() on the whole frame.
+
+It is used by service.py --tiles and bench.py --tiles. The GUI analyzes at
+capture.CAPTURE_SIZE, which one core keeps up with, and has no tiled path.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from startup import LazyModule
+
+import analysis
+
+cv2 = LazyModule('cv2')
+numpy = LazyModule('numpy')
+
+OVERLAP = 8
+
+
+def tile_slices(shape, grid, overlap=OVERLAP):
+    """Returns (row slice, column slice) pairs covering shape in a grid of (rows, cols) tiles."""
+    h, w = shape[:2]
+    rows, cols = grid
+    slices = []
+    for r in range(rows):
+        y0, y1 = h * r // rows, h * (r + 1) // rows
+        for c in range(cols):
+            x0, x1 = w * c // cols, w * (c + 1) // cols
+            slices.append((slice(max(0, y0 - overlap), min(h, y1 + overlap)),
+                           slice(max(0, x0 - overlap), min(w, x1 + overlap))))
+    return slices
+
+
+def tile_overlaps(slices):
+    """Returns (i, j, row slice, column slice) for each pair of tiles i < j that share pixels."""
+    overlaps = []
+    for i, (ri, ci) in enumerate(slices):
+        for j in range(i + 1, len(slices)):
+            rj, cj = slices[j]
+            rows = slice(max(ri.start, rj.start), min(ri.stop, rj.stop))
+            cols = slice(max(ci.start, cj.start), min(ci.stop, cj.stop))
+            if rows.start < rows.stop and cols.start < cols.stop:
+                overlaps.append((i, j, rows, cols))
+    return overlaps
+
+
+def merge_blobs(boxes, links):
+    """
+    Merges the parts of blobs that tile borders cut apart.
+
+    boxes are the parts' bounding boxes and links the (i, j) index pairs of
+    parts that share pixels; each group of linked parts is joined into its
+    common bounding box.
+    """
+    parent = list(range(len(boxes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in links:
+        parent[find(i)] = find(j)
+    groups = {}
+    for i, (x, y, w, h) in enumerate(boxes):
+        groups.setdefault(find(i), []).append((x, y, x + w, y + h))
+    merged = []
+    for corners in groups.values():
+        x0, y0 = min(c[0] for c in corners), min(c[1] for c in corners)
+        x1, y1 = max(c[2] for c in corners), max(c[3] for c in corners)
+        merged.append((x0, y0, x1 - x0, y1 - y0))
+    return merged
+
+
+class TiledDifference(object):
+    """
+    Differences frames of one shape tile by tile on a thread pool.
+
+    Attributes:
+        shape: The (height, width) of the frames.
+        grid: The (rows, cols) of tiles.
+        slices: The precomputed tile slices, overlap included.
+        overlaps: The (i, j, row slice, column slice) of each pair of tiles that overlap.
+        regions: For each tile, the (index into overlaps, row slice, column
+            slice) of the overlaps it is in, in the tile's coordinates.
+        workers: The number of threads.
+    """
+    def __init__(self, shape, grid=(2, 2), overlap=OVERLAP, workers=None):
+        self.shape = shape[:2]
+        self.grid = grid
+        self.overlap = overlap
+        self.slices = tile_slices(shape, grid, overlap)
+        self.overlaps = tile_overlaps(self.slices)
+        # for each tile, the overlaps it is in, in its own coordinates
+        self.regions = [[] for _ in self.slices]
+        for k, (i, j, rows, cols) in enumerate(self.overlaps):
+            for t in (i, j):
+                top, left = self.slices[t][0].start, self.slices[t][1].start
+                self.regions[t].append((k, slice(rows.start - top, rows.stop - top),
+                                        slice(cols.start - left, cols.stop - left)))
+        self.workers = workers or os.cpu_count() or 4
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='tile')
+
+    def _tile(self, base_gray, image_gray, sens, rows, cols, min_size, regions):
+        diff = cv2.absdiff(base_gray[rows, cols], image_gray[rows, cols])
+        if getattr(sens, 'ndim', 0):
+            thresh = cv2.compare(diff, sens[rows, cols], cv2.CMP_GT)
+        else:
+            thresh = cv2.threshold(diff, sens, 255, cv2.THRESH_BINARY)[1]
+        conts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        h, w = self.shape
+        # the bands shared with the neighbouring tiles; there are none at
+        # the edges of the frame
+        band = 2 * self.overlap
+        th, tw = thresh.shape
+        top = band if rows.start > 0 else 0
+        left = band if cols.start > 0 else 0
+        bottom = th - band if rows.stop < h else th
+        right = tw - band if cols.stop < w else tw
+        blobs, shared = [], []
+        for c in conts:
+            x, y, bw, bh = cv2.boundingRect(c)
+            box = (x + cols.start, y + rows.start, bw, bh)
+            if y < top or x < left or y + bh > bottom or x + bw > right:
+                shared.append((box, c, x, y, x + bw, y + bh))
+            elif bw > min_size and bh > min_size:
+                blobs.append((box, 0))
+        labels = {}
+        if shared:
+            # each overlap with the blobs in it filled with their number,
+            # from 1; a fill covers a blob's holes too, so those are cleared
+            for k, r, c in regions:
+                region = numpy.zeros((r.stop - r.start, c.stop - c.start), numpy.int32)
+                for label, (box, cont, x0, y0, x1, y1) in enumerate(shared, 1):
+                    if x0 < c.stop and c.start < x1 and y0 < r.stop and r.start < y1:
+                        cv2.drawContours(region, [cont], -1, label, cv2.FILLED, offset=(-c.start, -r.start))
+                region[thresh[r, c] == 0] = 0
+                labels[k] = region
+            blobs.extend((blob[0], label) for label, blob in enumerate(shared, 1))
+        return blobs, labels
+
+    def find_objects(self, base_gray, image_gray, sens, min_size=analysis.MIN_OBJECT_SIZE):
+        """Returns the boxes of blobs wider and taller than min_size, like analysis.find_objects()."""
+        futures = [self.pool.submit(self._tile, base_gray, image_gray, sens, rows, cols, min_size, regions)
+                   for (rows, cols), regions in zip(self.slices, self.regions)]
+        results = [future.result() for future in futures]
+        boxes, parts = [], []
+        for blobs, labels in results:
+            # label in the tile -> index in boxes, for the blobs in its shared bands
+            tile_parts = {}
+            for box, label in blobs:
+                if label:
+                    tile_parts[label] = len(boxes)
+                boxes.append(box)
+            parts.append(tile_parts)
+        # parts of one blob share its pixels where their tiles overlap; a
+        # blob that lies in an overlap is found by both tiles and joined too
+        links = []
+        for k, (i, j, rows, cols) in enumerate(self.overlaps):
+            if not parts[i] or not parts[j]:
+                continue
+            a, b = results[i][1][k], results[j][1][k]
+            both = (a > 0) & (b > 0)
+            if not both.any():
+                continue
+            keys = numpy.unique(a[both].astype(numpy.int64) << 32 | b[both])
+            for key in keys.tolist():
+                label_a, label_b = key >> 32, key & 0xffffffff
+                if label_a in parts[i] and label_b in parts[j]:
+                    links.append((parts[i][label_a], parts[j][label_b]))
+        boxes = [b for b in merge_blobs(boxes, links) if b[2] > min_size and b[3] > min_size]
+        return self._drop_enclosed(boxes, base_gray, image_gray, sens)
+
+    def _drop_enclosed(self, boxes, base_gray, image_gray, sens):
+        """
+        Drops the boxes of blobs inside another blob's hole.
+
+        Only a box within another box can be; the outer box is differenced
+        again as one piece, with a background frame around it, and whatever
+        in it is not among its external contours goes.
+        """
+        inner = {}
+        for i, (x, y, w, h) in enumerate(boxes):
+            for j, (ox, oy, ow, oh) in enumerate(boxes):
+                if i != j and ox <= x and oy <= y and x + w <= ox + ow and y + h <= oy + oh:
+                    inner.setdefault(j, []).append(i)
+        if not inner:
+            return boxes
+        dropped = set()
+        for j, members in inner.items():
+            ox, oy, ow, oh = boxes[j]
+            rows, cols = slice(oy, oy + oh), slice(ox, ox + ow)
+            region_sens = sens[rows, cols] if getattr(sens, 'ndim', 0) else sens
+            thresh = analysis.difference(base_gray[rows, cols], image_gray[rows, cols], region_sens)
+            thresh = cv2.copyMakeBorder(thresh, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+            conts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+            external = set()
+            for c in conts:
+                x, y, w, h = cv2.boundingRect(c)
+                external.add((x + ox - 1, y + oy - 1, w, h))
+            dropped.update(i for i in members if boxes[i] not in external)
+        return [b for i, b in enumerate(boxes) if i not in dropped]
+
+    def close(self):
+        self.pool.shutdown()
@@ -0,0 +1,290 @@
+"""
+Trigger scheduling for the analysis loop.
+
+The machine's switch fires once per press cycle. TriggerScheduler takes those
+triggers from the GPIO callback, debounces them, measures the press's cycle
+period, and hands each accepted trigger to a worker thread with a deadline
+(the time the next cycle is expected). Triggers that arrive while a cycle is
+still being analyzed are coalesced or rejected by policy, and overruns and
+missed cycles are counted, so it is visible whether the analysis keeps up with
+the press.
+
+Only the verdict has to beat the press. A handler that sets Cycle.signaled the
+moment its verdict is out can hand everything else (annotating, display,
+logging) to a Followup, which runs it on another thread. The scheduler then
+reports the trigger-to-signal latency next to the cycle's latency.
+"""
+import logging
+import queue
+import threading
+import time
+
+COALESCE = 'coalesce'
+REJECT = 'reject'
+POLICIES = (COALESCE, REJECT)
+
+log = logging.getLogger('wincup.trigger')
+
+
+class Cycle(object):
+    """
+    One accepted trigger.
+
+    Attributes:
+        index: The number of the cycle, counting from 1.
+        triggered: The time.monotonic() of the trigger.
+        deadline: The time the cycle should be done by, or None until the
+            period is known.
+        started: The time the worker started the cycle.
+        signaled: The time the handler put out the verdict, if it records it.
+        finished: The time the worker finished the cycle.
+    """
+    def __init__(self, index, triggered, deadline):
+        self.index = index
+        self.triggered = triggered
+        self.deadline = deadline
+        self.started = None
+        self.signaled = None
+        self.finished = None
+
+    @property
+    def latency(self):
+        """Seconds from the trigger to the end of the cycle."""
+        return self.finished - self.triggered
+
+    @property
+    def signal_latency(self):
+        """Seconds from the trigger to the verdict, or None if it was not recorded."""
+        return None if self.signaled is None else self.signaled - self.triggered
+
+    @property
+    def overran(self):
+        return self.deadline is not None and self.finished > self.deadline
+
+
+class TriggerScheduler(object):
+    """
+    Runs a handler on a worker thread for every accepted trigger.
+
+    Attributes:
+        handler: Called with a Cycle for each trigger that is run.
+        policy: What to do with a trigger that arrives while a cycle is running;
+            COALESCE keeps only the newest one waiting, REJECT drops it.
+        debounce: Triggers closer than this many seconds to the previous one
+            are ignored as switch bounce.
+        deadline_fraction: The part of the measured period a cycle may take.
+        smoothing: The weight of the newest interval in the period estimate.
+    """
+    # the counters a checkpoint carries over a restart
+    COUNTERS = ('period', 'triggers', 'bounces', 'coalesced', 'rejected', 'completed', 'overruns',
+                'max_latency', 'max_signal')
+
+    def __init__(self, handler, policy=COALESCE, debounce=0.05,
+                 deadline_fraction=1.0, smoothing=0.2):
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of {}'.format(POLICIES))
+        self.handler = handler
+        self.policy = policy
+        self.debounce = debounce
+        self.deadline_fraction = deadline_fraction
+        self.smoothing = smoothing
+        self.period = None
+        self.triggers = 0
+        self.bounces = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.completed = 0
+        self.overruns = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.last_signal = 0.0
+        self.max_signal = 0.0
+        self._cond = threading.Condition()
+        self._last = None
+        self._pending = None
+        self._busy = False
+        self._running = False
+        self._thread = None
+
+    @property
+    def missed(self):
+        """Press cycles that were never analyzed."""
+        return self.coalesced + self.rejected
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._work, name='trigger', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops the worker after the running cycle; pending triggers are dropped."""
+        with self._cond:
+            self._running = False
+            self._pending = None
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def trigger(self, now=None):
+        """
+        Registers a press and returns its Cycle, or None if it was ignored
+        as bounce or rejected, or the scheduler is not running; safe to use
+        directly as a gpiozero callback.
+        """
+        now = time.monotonic() if now is None else now
+        with self._cond:
+            if not self._running:
+                # a press racing stop() must not leave a cycle nobody runs
+                return None
+            if self._last is not None:
+                interval = now - self._last
+                if interval < self.debounce:
+                    self.bounces += 1
+                    return None
+                if self.period is None:
+                    self.period = interval
+                else:
+                    self.period += self.smoothing * (interval - self.period)
+            self._last = now
+            self.triggers += 1
+            deadline = None
+            if self.period is not None:
+                deadline = now + self.period * self.deadline_fraction
+            cycle = Cycle(self.triggers, now, deadline)
+
+            if self._busy or self._pending is not None:
+                if self.policy == REJECT:
+                    self.rejected += 1
+                    return None
+                if self._pending is not None:
+                    self.coalesced += 1
+            self._pending = cycle
+            self._cond.notify()
+            return cycle
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._running and self._pending is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                cycle, self._pending = self._pending, None
+                self._busy = True
+            cycle.started = time.monotonic()
+            try:
+                self.handler(cycle)
+            except Exception:
+                log.exception('cycle %d failed', cycle.index)
+            cycle.finished = time.monotonic()
+            with self._cond:
+                self._busy = False
+                self.completed += 1
+                self.overruns += 1 if cycle.overran else 0
+                self.last_latency = cycle.latency
+                self.max_latency = max(self.max_latency, cycle.latency)
+                if cycle.signaled is not None:
+                    self.last_signal = cycle.signal_latency
+                    self.max_signal = max(self.max_signal, cycle.signal_latency)
+
+    def counters(self):
+        """Returns the COUNTERS, unrounded, as a dict."""
+        with self._cond:
+            return {name: getattr(self, name) for name in self.COUNTERS}
+
+    def restore(self, counters):
+        """Continues the counters of an earlier run, e.g. from a checkpoint."""
+        with self._cond:
+            for name in self.COUNTERS:
+                if name in counters:
+                    setattr(self, name, counters[name])
+
+    def snapshot(self):
+        """Returns the counters as a dict."""
+        with self._cond:
+            return {
+                'policy': self.policy,
+                'period_ms': round(self.period * 1000.0, 1) if self.period else None,
+                'triggers': self.triggers,
+                'bounces': self.bounces,
+                'completed': self.completed,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'missed': self.missed,
+                'overruns': self.overruns,
+                'latency_last_ms': round(self.last_latency * 1000.0, 2),
+                'latency_max_ms': round(self.max_latency * 1000.0, 2),
+                'signal_last_ms': round(self.last_signal * 1000.0, 2),
+                'signal_max_ms': round(self.max_signal * 1000.0, 2),
+            }
+
+
+class Followup(object):
+    """
+    Runs the part of each cycle that can wait until its verdict is out.
+
+    submit() queues the handler's arguments and returns; a worker thread runs
+    the handler for each in order. When backlog items are waiting, submit()
+    blocks until there is room, so nothing is dropped and a follow-up that
+    cannot keep up with the press shows as waits instead of growing memory.
+
+    Attributes:
+        handler: Called with the arguments of each submit().
+        backlog: The most submissions waiting at once.
+        done: The submissions handled.
+        waits: The submit() calls that had to wait for room.
+    """
+    _STOP = object()
+
+    def __init__(self, handler, backlog=4):
+        self.handler = handler
+        self.backlog = backlog
+        self.done = 0
+        self.waits = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self._queue = queue.Queue(backlog)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._work, name='followup', daemon=True)
+        self._thread.start()
+
+    def submit(self, *args):
+        try:
+            self._queue.put_nowait(args)
+        except queue.Full:
+            self.waits += 1
+            self._queue.put(args)
+
+    def _work(self):
+        while True:
+            args = self._queue.get()
+            if args is self._STOP:
+                return
+            start = time.monotonic()
+            try:
+                self.handler(*args)
+            except Exception:
+                log.exception('follow-up failed')
+            seconds = time.monotonic() - start
+            self.done += 1
+            self.total += seconds
+            self.worst = max(self.worst, seconds)
+
+    def stop(self, timeout=None):
+        """Runs what is still queued, then stops the worker."""
+        if not self._stopped:
+            self._stopped = True
+            self._queue.put(self._STOP)
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def snapshot(self):
+        """Returns the counters as a dict."""
+        return {
+            'done': self.done,
+            'pending': self._queue.qsize(),
+            'waits': self.waits,
+            'mean_ms': round(self.total / self.done * 1000.0, 2) if self.done else None,
+            'max_ms': round(self.worst * 1000.0, 2),
+        }
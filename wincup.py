@@ -6,23 +6,58 @@ molds. The Raspberry Pi uses a switch (connected to a GPIO pin) from the
 machine to determine when to capture the image. LEDs are also connected to GPIO
 pins to monitor activity while not looking at the screen.
 """
-from ast import literal_eval
-from datetime import datetime
 import time
+_STARTED = time.perf_counter()
+
+from ast import literal_eval
+import argparse
 import json
+import logging
 import os
+import queue
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
+from tkinter import simpledialog
+
+from startup import LazyModule, StartupTimer
+
+# Heavy modules are only imported once a frame first needs them so the splash
+# screen comes up quickly after a power cycle.
+cv2 = LazyModule('cv2')
+gpio = LazyModule('gpiozero')
+numpy = LazyModule('numpy')
+picamera = LazyModule('picamera')
+Image = LazyModule('PIL.Image')
+ImageTk = LazyModule('PIL.ImageTk')
+
+import analysis
+import baseline
+from capture import CAPTURE_SIZE, CameraSource, LivePreview, init_camera, load_settings
+import checkpoint
+import detectors
+import eventlog
+import frames
+import heatmap
+import monitor
+from output import OutputController
+from profiling import ProfileSession
+import recipes
+import rectify
+import ringbuffer
+from trigger import Followup, TriggerScheduler
 
-import cv2
-import gpiozero as gpio
-import numpy
-from picamera import PiCamera
-from picamera.array import PiRGBArray
-from PIL import Image, ImageTk
+NO_RECIPE = '(none)'
+PREVIEW_MS = 50
+DISPLAY_MS = 50
+
+log = logging.getLogger('wincup.gui')
 
-import frames
+
+def clear(frame):
+    """Destroys the widgets of a page before it is built again."""
+    for child in frame.winfo_children():
+        child.destroy()
 
 
 class RectTracker(object):
@@ -129,10 +164,14 @@ class SettingsFrame(ttk.Frame):
         self.frame_settings = ttk.Frame(self, pad=5)
         self.frame_zoom = ttk.Frame(self, pad=5)
         self.frame_zoom_confirm = ttk.Frame(self, pad=5)
+        self.frame_corners = ttk.Frame(self, pad=5)
         self.frame_manual = ttk.Frame(self, pad=5)
 
         self.zoom_finished = False
         self.using_auto = None
+        self.preview = None
+        self.preview_seq = 0
+        self.preview_job = None
 
         self.init_vars()
         self.init_main()
@@ -157,6 +196,16 @@ class SettingsFrame(ttk.Frame):
         self.cus_sha = tk.IntVar(value=settings['custom']['sharpness'])
         self.cus_shu = tk.IntVar(value=settings['custom']['shutter_speed'])
         self.cus_zoo = tk.StringVar(value=str(settings['custom']['zoom']))
+        # the perspective correction of the zoomed image, see rectify.py
+        self.def_corners = settings['default'].get('corners')
+        self.cus_corners = settings['custom'].get('corners')
+        self.manual_vars = {
+            'brightness': self.cus_bri,
+            'contrast': self.cus_con,
+            'rotation': self.cus_rot,
+            'sharpness': self.cus_sha,
+            'shutter_speed': self.cus_shu,
+        }
 
     def save_vars(self):
         vars = {
@@ -167,9 +216,33 @@ class SettingsFrame(ttk.Frame):
             'shutter_speed': self.cus_shu.get(),
             'zoom': literal_eval(self.cus_zoo.get())
         }
+        with open('camerasettings.json') as file:
+            self.json_settings = json.load(file)
+        # only present when set, so settings without a correction hash as before;
+        # the lens is measured by rectify.py, not on these pages, through the
+        # zoom it records (or, from before it did, the zoom saved with it),
+        # and does not fit another one
+        lens = self.json_settings['custom'].get('lens')
+        if lens:
+            measured = lens.get('zoom', self.json_settings['custom']['zoom'])
+            if [float(v) for v in measured] == [float(v) for v in vars['zoom']]:
+                vars['lens'] = lens
+            else:
+                eventlog.event(log, 'lens_dropped', level=logging.WARNING, measured=list(measured),
+                               zoom=list(vars['zoom']))
+        if self.cus_corners:
+            vars['corners'] = self.cus_corners
         self.json_settings['custom'] = vars
         with open('camerasettings.json', 'w') as file:
             json.dump(self.json_settings, file, indent=4, sort_keys=True)
+        if self.json_settings.get('recipe') is not None:
+            recipe = recipes.load_recipe(self.json_settings['recipe'])
+            recipe.settings = vars
+            recipes.save_recipe(recipe)
+            # its baseline was captured with the old settings
+            self.master.recipes.invalidate(recipe.name)
+        eventlog.event(log, 'settings_saved', settings=vars, recipe=self.json_settings.get('recipe'),
+                       mode='auto' if self.using_auto else 'manual')
 
     def init_main(self):
         description = 'Configure the camera settings.\nGood camera settings make the analysis more accurate.'
@@ -312,36 +385,92 @@ class SettingsFrame(ttk.Frame):
         self.frame_zoom.columnconfigure(3, weight=1)
 
     def init_zoom_confirm(self):
+        clear(self.frame_zoom_confirm)
         self.zoom_test()
         time.sleep(0.1)
-        img = tk.PhotoImage(file='zoom_test.gif')
+        # shown the way the analysis will see it
+        test = numpy.array(Image.open('zoom_test.gif').convert('RGB'))
+        rectifier = rectify.build(load_settings(), (test.shape[1], test.shape[0]))
+        if rectifier is not None:
+            test = rectifier.apply(test)
+        img = ImageTk.PhotoImage(Image.fromarray(test))
         self.label_zoom_conf = ttk.Label(self.frame_zoom_confirm, text='Is this correct?', font='-weight bold -size 20')
         self.label_zoom_conf_img = ttk.Label(self.frame_zoom_confirm, image=img)
         self.label_zoom_conf_img.img = img
         self.button_zoom_y = ttk.Button(self.frame_zoom_confirm, text='Yes', command=self.conf2settings)
         self.button_zoom_n = ttk.Button(self.frame_zoom_confirm, text='No', command=self.conf2zoom)
+        self.button_zoom_corners = ttk.Button(self.frame_zoom_confirm, text='Straighten', command=self.conf2corners)
 
-        self.label_zoom_conf.grid(row=1, column=1, columnspan=2)
-        self.label_zoom_conf_img.grid(row=2, column=1, columnspan=2)
+        self.label_zoom_conf.grid(row=1, column=1, columnspan=3)
+        self.label_zoom_conf_img.grid(row=2, column=1, columnspan=3)
         self.button_zoom_n.grid(row=3, column=1)
-        self.button_zoom_y.grid(row=3, column=2)
+        self.button_zoom_corners.grid(row=3, column=2)
+        self.button_zoom_y.grid(row=3, column=3)
 
         self.frame_zoom_confirm.rowconfigure(0, weight=1)
         self.frame_zoom_confirm.rowconfigure(4, weight=1)
         self.frame_zoom_confirm.columnconfigure(0, weight=1)
-        self.frame_zoom_confirm.columnconfigure(3, weight=1)
+        self.frame_zoom_confirm.columnconfigure(4, weight=1)
+
+    def init_corners(self):
+        """Builds the page to click the four corners of the mold, to square it up."""
+        clear(self.frame_corners)
+        image = numpy.array(Image.open('zoom_test.gif').convert('RGB'))
+        lens = load_settings().get('lens')
+        if lens:
+            image = rectify.undistort(image, lens)
+        img = ImageTk.PhotoImage(Image.fromarray(image))
+        self.corner_points = []
+
+        self.label_corners = ttk.Label(self.frame_corners, text='Click the four corners of the mold:', font='-weight bold -size 20')
+        self.canvas_corners = tk.Canvas(self.frame_corners, width=img.width(), height=img.height())
+        self.canvas_corners.create_image(img.width() / 2, img.height() / 2, image=img)
+        self.canvas_corners.img = img
+        self.canvas_corners.bind('<ButtonPress-1>', self.add_corner)
+        self.button_corners_back = ttk.Button(self.frame_corners, text='Back', command=self.corners2conf)
+        self.button_corners_clear = ttk.Button(self.frame_corners, text='Clear', command=self.clear_corners)
+        self.button_corners_done = ttk.Button(self.frame_corners, text='Done', command=self.corners2conf_done)
+
+        self.label_corners.grid(row=1, column=1, columnspan=3, pady=20)
+        self.canvas_corners.grid(row=2, column=1, columnspan=3)
+        self.button_corners_back.grid(row=3, column=1, pady=10)
+        self.button_corners_clear.grid(row=3, column=2, pady=10)
+        self.button_corners_done.grid(row=3, column=3, pady=10)
+
+        self.frame_corners.rowconfigure(0, weight=1)
+        self.frame_corners.rowconfigure(4, weight=1)
+        self.frame_corners.columnconfigure(0, weight=1)
+        self.frame_corners.columnconfigure(4, weight=1)
+
+    def add_corner(self, event):
+        if len(self.corner_points) == 4:
+            return
+        x, y = self.canvas_corners.canvasx(event.x), self.canvas_corners.canvasy(event.y)
+        self.corner_points.append((x, y))
+        self.canvas_corners.create_oval(x - 3, y - 3, x + 3, y + 3, outline='red', tags='corners')
+        if len(self.corner_points) == 4:
+            ordered = rectify.order_corners(self.corner_points)
+            self.canvas_corners.create_polygon(*[c for p in ordered for c in p], outline='red',
+                                               fill='', tags='corners')
+
+    def clear_corners(self):
+        self.corner_points = []
+        self.canvas_corners.delete('corners')
 
     def init_manual(self):
+        clear(self.frame_manual)
         self.label_manual = ttk.Label(self.frame_manual, text='Camera Settings - Manual Setup', font='-weight bold', pad=15)
         self.separator_manual_1 = ttk.Separator(self.frame_manual, orient='horizontal')
         self.separator_manual_2 = ttk.Separator(self.frame_manual, orient='vertical')
         self.separator_manual_3 = ttk.Separator(self.frame_manual, orient='horizontal')
         self.separator_manual_4 = ttk.Separator(self.frame_manual, orient='vertical')
-        self.frame_man_bri = frames.BrightnessFrame(self.frame_manual, self.cus_bri, pad=15)
-        self.frame_man_con = frames.ContrastFrame(self.frame_manual, self.cus_con, pad=15)
-        self.frame_man_rot = frames.RotationFrame(self.frame_manual, self.cus_rot, pad=15)
-        self.frame_man_sha = frames.SharpnessFrame(self.frame_manual, self.cus_sha, pad=15)
-        self.frame_man_shu = frames.ShutterSpeedFrame(self.frame_manual, self.cus_shu, pad=15)
+        self.separator_manual_5 = ttk.Separator(self.frame_manual, orient='vertical')
+        self.frame_man_bri = frames.ParameterFrame(self.frame_manual, 'brightness', self.cus_bri, self.apply_setting, pad=15)
+        self.frame_man_con = frames.ParameterFrame(self.frame_manual, 'contrast', self.cus_con, self.apply_setting, pad=15)
+        self.frame_man_rot = frames.ParameterFrame(self.frame_manual, 'rotation', self.cus_rot, self.apply_setting, pad=15)
+        self.frame_man_sha = frames.ParameterFrame(self.frame_manual, 'sharpness', self.cus_sha, self.apply_setting, pad=15)
+        self.frame_man_shu = frames.ParameterFrame(self.frame_manual, 'shutter_speed', self.cus_shu, self.apply_setting, pad=15)
+        self.label_preview = ttk.Label(self.frame_manual, text='Starting camera...', justify='center')
         self.button_reset_settings = ttk.Button(self.frame_manual, text='Reset to default', command=self.reset_to_default)
         self.button_manual2zoom = ttk.Button(self.frame_manual, text='Next', command=self.manual2zoom)
         self.button_manual2main = ttk.Button(self.frame_manual, text='Back', command=self.manual2main)
@@ -356,6 +485,8 @@ class SettingsFrame(ttk.Frame):
         self.separator_manual_4.grid(row=3, column=4, rowspan=3, sticky='ns')
         self.frame_man_sha.grid(row=3, column=5, sticky='w')
         self.frame_man_shu.grid(row=5, column=5)
+        self.separator_manual_5.grid(row=3, column=6, rowspan=3, sticky='ns')
+        self.label_preview.grid(row=3, column=7, rowspan=3, padx=15)
         self.button_reset_settings.grid(row=6, column=2, columnspan=3, padx=30, pady=15)
         self.button_manual2zoom.grid(row=6, column=3, columnspan=3, sticky='e', padx=30, pady=15)
         self.button_manual2main.grid(row=6, column=1, columnspan=3, sticky='w', padx=30, pady=15)
@@ -363,7 +494,56 @@ class SettingsFrame(ttk.Frame):
         self.frame_manual.rowconfigure(0, weight=1)
         self.frame_manual.rowconfigure(8, weight=1)
         self.frame_manual.columnconfigure(0, weight=1)
-        self.frame_manual.columnconfigure(6, weight=1)
+        self.frame_manual.columnconfigure(8, weight=1)
+
+        self.open_preview()
+
+    def open_preview(self):
+        """Starts the live camera view on the manual page with the settings being edited."""
+        self.close_preview()
+        try:
+            self.preview = LivePreview()
+        except Exception as e:
+            self.label_preview.configure(text='No camera preview:\n{}'.format(e))
+            return
+        self.preview.apply_all(self.preview_settings())
+        self.update_preview()
+
+    def update_preview(self):
+        seq, frame = self.preview.latest()
+        if seq != self.preview_seq:
+            self.preview_seq = seq
+            image = ImageTk.PhotoImage(Image.fromarray(frame))
+            self.label_preview.configure(image=image)
+            self.label_preview.img = image
+        self.preview_job = self.after(PREVIEW_MS, self.update_preview)
+
+    def close_preview(self):
+        if self.preview_job is not None:
+            self.after_cancel(self.preview_job)
+            self.preview_job = None
+        if self.preview is not None:
+            self.preview.close()
+            self.preview = None
+            self.preview_seq = 0
+
+    def preview_settings(self):
+        """Returns the manual settings being edited and the zoom, as the live view takes them."""
+        values = {name: var.get() for name, var in self.manual_vars.items()}
+        values['zoom'] = literal_eval(self.cus_zoo.get())
+        return values
+
+    def apply_setting(self, name, value):
+        """Applies a changed manual setting to the live view."""
+        eventlog.event(log, 'setting_changed', setting=name, value=value)
+        if self.preview is not None:
+            self.preview.apply(name, value)
+
+    def apply_settings(self, values):
+        """Applies several changed settings to the live view at once, as one change."""
+        eventlog.event(log, 'settings_changed', settings=values)
+        if self.preview is not None:
+            self.preview.apply_all(values)
 
     def main2settings(self):
         self.using_auto = True
@@ -397,7 +577,8 @@ class SettingsFrame(ttk.Frame):
         self.frame_zoom.pack_forget()
         self.save_vars()
         self.cus_zoo.set(str(self.getzoomcoords()))
-        self.zoom_test()
+        # corners picked on the old zoom would not fit the new one
+        self.cus_corners = None
         self.init_zoom_confirm()
         self.frame_zoom_confirm.pack(side="top", fill="both", expand=True)
 
@@ -420,6 +601,29 @@ class SettingsFrame(ttk.Frame):
         self.init_settings()
         self.frame_settings.pack(side="top", fill="both", expand=True)
 
+    def conf2corners(self):
+        self.init_corners()
+        self.frame_zoom_confirm.pack_forget()
+        self.frame_corners.pack(side="top", fill="both", expand=True)
+
+    def corners2conf(self):
+        self.frame_corners.pack_forget()
+        self.init_zoom_confirm()
+        self.frame_zoom_confirm.pack(side="top", fill="both", expand=True)
+
+    def corners2conf_done(self):
+        """Keeps four clicked corners, or removes the correction if none were clicked."""
+        if len(self.corner_points) not in (0, 4):
+            messagebox.showwarning('Straighten', 'Click all four corners, or Clear to remove the correction.')
+            return
+        w, h = float(self.canvas_corners.img.width() - 1), float(self.canvas_corners.img.height() - 1)
+        self.cus_corners = None
+        if self.corner_points:
+            self.cus_corners = [[round(x / w, 4), round(y / h, 4)]
+                                for x, y in rectify.order_corners(self.corner_points)]
+        eventlog.event(log, 'corners_changed', corners=self.cus_corners)
+        self.corners2conf()
+
     def conf2zoom(self):
         self.init_zoom()
         self.frame_zoom_confirm.pack_forget()
@@ -432,11 +636,13 @@ class SettingsFrame(ttk.Frame):
         self.frame_manual.pack(side="top", fill="both", expand=True)
 
     def manual2zoom(self):
+        self.close_preview()
         self.init_zoom()
         self.frame_manual.pack_forget()
         self.frame_zoom.pack(side="top", fill="both", expand=True)
 
     def manual2main(self):
+        self.close_preview()
         self.using_auto = None
         self.frame_manual.pack_forget()
         self.frame_main.pack(side="top", fill="both", expand=True)
@@ -448,6 +654,8 @@ class SettingsFrame(ttk.Frame):
         self.cus_sha.set(self.def_sha.get())
         self.cus_shu.set(self.def_shu.get())
         self.cus_zoo.set(self.def_zoo.get())
+        self.cus_corners = self.def_corners
+        self.apply_settings(self.preview_settings())
 
     def getzoomcoords(self):
         global dx, dy, ux, uy
@@ -469,14 +677,14 @@ class SettingsFrame(ttk.Frame):
 
     def capture_image_zoom(self):
         self.save_vars()
-        with PiCamera() as camera:
+        with picamera.PiCamera() as camera:
             camera = init_camera(camera)
             camera.zoom = (0.0, 0.0, 1.0, 1.0)
             camera.capture('zoom_bg.gif', resize=(400, 250))
 
     def zoom_test(self):
         self.save_vars()
-        with PiCamera() as camera:
+        with picamera.PiCamera() as camera:
             camera = init_camera(camera)
             camera.capture('zoom_test.gif', resize=(400, 250))
 
@@ -494,6 +702,7 @@ class CalibrationFrame(ttk.Frame):
         self.init_main()
 
     def init_main(self):
+        clear(self.frame_main)
         description = 'Calibrates the base image used to analyze the molds.\nMolds must be empty and clean to ensure accuracy'
         self.frame_main.pack(side="top", fill="both", expand=True)
         self.label_title = ttk.Label(self.frame_main, text='Mold Calibration', font='-weight bold -size 20')
@@ -520,6 +729,7 @@ class CalibrationFrame(ttk.Frame):
         self.frame_main.columnconfigure(3, weight=1)
 
     def init_inprogress(self):
+        clear(self.frame_inprogress)
         self.label_prog_text = ttk.Label(self.frame_inprogress, text='Calibration in Progress', font='-weight bold -size 20')
         self.label_prog_img = ttk.Label(self.frame_inprogress)
         self.pb_calibration = ttk.Progressbar(self.frame_inprogress, orient='horizontal', mode='determinate', maximum=self.num_total.get(), variable=self.num_current)
@@ -535,49 +745,55 @@ class CalibrationFrame(ttk.Frame):
         self.frame_inprogress.columnconfigure(0, weight=1)
         self.frame_inprogress.columnconfigure(3, weight=1)
 
-    def calibrate_start(self):
-        self.main2inprogress()
-        # capture
-        with PiCamera() as camera:
-            camera = init_camera(camera)
-            fns = []
-            for i in range(1, self.num_total.get() + 1):
-                fns.append('img{:0>2}.jpg'.format(i))
-                camera.capture('img{:0>2}.jpg'.format(i), resize=(400, 250))
-                image = ImageTk.PhotoImage(Image.open('img{:0>2}.jpg'.format(i)))
-                self.label_prog_img.configure(image=image)
-                self.label_prog_img.img = image
-                self.num_current.set(i)
-                self.master.root.update()
-            # average
-            self.pb_calibration.configure(mode='indeterminate')
-            self.pb_calibration.start()
-            images = []
-            for fn in fns:
-                img = Image.open(fn)
-                images.append(img)
-            w, h = images[0].size
-            N = len(images)
-            avgImgArr = numpy.zeros((h, w, 3), numpy.float)
-            for img in images:
-                imgArr = numpy.array(img, dtype=numpy.float)
-                avgImgArr = avgImgArr + imgArr / N
-            avgImgArr = numpy.array(numpy.round(avgImgArr), dtype=numpy.uint8)
-            avgImg = Image.fromarray(numpy.uint8(avgImgArr))
-            avgImg.save('average.jpg')
-            image = ImageTk.PhotoImage(Image.open('average.jpg'))
+    def capture_frames(self, source, total):
+        """Yields total frames from source, showing each one as it is captured."""
+        for i in range(1, total + 1):
+            gray = source.read_gray()
+            yield gray
+            image = ImageTk.PhotoImage(Image.fromarray(gray))
             self.label_prog_img.configure(image=image)
             self.label_prog_img.img = image
+            self.num_current.set(i)
             self.master.root.update()
-            # delete
-            for i in range(1, self.num_total.get() + 1):
-                os.remove('img{:0>2}.jpg'.format(i))
-            self.pb_calibration.stop()
-            self.pb_calibration.grid_forget()
-            # add exit button
-            self.button_back.grid(row=4, column=1, pady=10)
-            self.button_finish.grid(row=4, column=2, pady=10)
-            self.label_prog_text.configure(text='Calibration Complete')
+
+    def calibrate_start(self):
+        self.main2inprogress()
+        total = self.num_total.get()
+        path = recipes.baseline_path()
+        started = time.monotonic()
+        eventlog.event(log, 'calibration_started', frames=total, path=path, recipe=recipes.active_name())
+        # capture
+        settings = load_settings()
+        rectifier = rectify.build(settings)
+        source = rectify.wrap(self.master.open_camera(), rectifier)
+        try:
+            arrays = baseline.accumulate(self.capture_frames(source, total))
+        finally:
+            source.close()
+        # average
+        self.pb_calibration.configure(mode='indeterminate')
+        self.pb_calibration.start()
+        average = arrays['mean']
+        if rectifier is not None:
+            # saved with the baseline, so analysis does not rebuild them
+            arrays.update(rectifier.arrays())
+        baseline.save(path, arrays, settings, total)
+        eventlog.event(log, 'calibration_finished', frames=total, path=path,
+                       seconds=round(time.monotonic() - started, 2),
+                       noise_mean=round(float(arrays['noise'].mean()), 3),
+                       noise_max=round(float(arrays['noise'].max()), 3))
+        if recipes.active_name() is not None:
+            self.master.recipes.invalidate(recipes.active_name())
+        image = ImageTk.PhotoImage(Image.fromarray(average))
+        self.label_prog_img.configure(image=image)
+        self.label_prog_img.img = image
+        self.master.root.update()
+        self.pb_calibration.stop()
+        self.pb_calibration.grid_forget()
+        # add exit button
+        self.button_back.grid(row=4, column=1, pady=10)
+        self.button_finish.grid(row=4, column=2, pady=10)
+        self.label_prog_text.configure(text='Calibration Complete')
 
     def main2inprogress(self):
         self.init_inprogress()
@@ -602,10 +818,34 @@ class DifferenceFrame(ttk.Frame):
         self.frame_main = ttk.Frame(self, pad=5)
         self.frame_inprogress = ttk.Frame(self, pad=5)
         self.sens = tk.IntVar(value=25)
+        self.recipe = tk.StringVar(value=recipes.active_name() or NO_RECIPE)
+        self.min_size = analysis.MIN_OBJECT_SIZE
+        self.detector_name = tk.StringVar(value=detectors.DEFAULT)
+        self.detector_options = {}
+        self.detector = None
+        self.heatmap = None
+        self.show_heatmap = tk.BooleanVar(value=False)
+        self.overlay_heatmap = False
+        self.recipe_name = None
+        # the last finished cycle, handed from the follow-up thread to Tk
+        self.display = queue.Queue(1)
+        self.display_job = None
+        self.checkpoint = None
+        self.baseline = None
+        self.switch = None
+        self.output = None
+        self.led_r = self.led_g = None
+        if self.recipe.get() != NO_RECIPE:
+            # already active; only its values are taken
+            try:
+                self.use_recipe(recipes.load_recipe(self.recipe.get()))
+            except recipes.RecipeError as e:
+                messagebox.showerror('Product', str(e))
 
         self.init_main()
 
     def init_main(self):
+        clear(self.frame_main)
         description = 'Analyzes molds using image differencing to\ndetect changes; checks molds after each cycle.\nEnsure that camera is calibrated and settings are\nadjusted for best results.'
         self.frame_main.pack(side="top", fill="both", expand=True)
         self.label_title = ttk.Label(self.frame_main, text='Mold Analysis', font='-weight bold -size 20')
@@ -615,80 +855,247 @@ class DifferenceFrame(ttk.Frame):
         self.label_sens = ttk.Label(self.frame_main, pad=5, text='Sensitivity:', font='-weight bold')
         self.label_sens_val = ttk.Label(self.frame_main, textvariable=self.sens, font='-weight bold')
         self.scale_sens = tk.Scale(self.frame_main, variable=self.sens, orient='horizontal', from_=0, to=50, command=self.check_sens, showvalue=0)
+        self.label_recipe = ttk.Label(self.frame_main, pad=5, text='Product:', font='-weight bold')
+        self.combo_recipe = ttk.Combobox(self.frame_main, textvariable=self.recipe, state='readonly',
+                                         values=[NO_RECIPE] + recipes.list_recipes())
+        self.combo_recipe.bind('<<ComboboxSelected>>', self.select_recipe)
+        self.button_save_recipe = ttk.Button(self.frame_main, text='Save as Product', command=self.save_recipe)
+        self.label_detector = ttk.Label(self.frame_main, pad=5, text='Detector:', font='-weight bold')
+        self.combo_detector = ttk.Combobox(self.frame_main, textvariable=self.detector_name, state='readonly',
+                                           values=sorted(detectors.DETECTORS))
+        self.combo_detector.bind('<<ComboboxSelected>>', self.select_detector)
 
         self.label_title.grid(row=1, column=1, columnspan=2)
         self.label_description.grid(row=2, column=1, columnspan=2)
-        self.label_sens.grid(row=3, column=1, sticky='e', padx=3, pady=5)
-        self.label_sens_val.grid(row=3, column=2, sticky='w', padx=3, pady=5)
-        self.scale_sens.grid(row=4, column=1, columnspan=2, pady=5)
-        self.button_home.grid(row=5, column=1, padx=15, pady=20)
-        self.button_start.grid(row=5, column=2, padx=15, pady=20)
+        self.label_recipe.grid(row=3, column=1, sticky='e', padx=3, pady=5)
+        self.combo_recipe.grid(row=3, column=2, sticky='w', padx=3, pady=5)
+        self.label_detector.grid(row=4, column=1, sticky='e', padx=3, pady=5)
+        self.combo_detector.grid(row=4, column=2, sticky='w', padx=3, pady=5)
+        self.button_save_recipe.grid(row=5, column=1, columnspan=2, pady=5)
+        self.label_sens.grid(row=6, column=1, sticky='e', padx=3, pady=5)
+        self.label_sens_val.grid(row=6, column=2, sticky='w', padx=3, pady=5)
+        self.scale_sens.grid(row=7, column=1, columnspan=2, pady=5)
+        self.button_home.grid(row=8, column=1, padx=15, pady=20)
+        self.button_start.grid(row=8, column=2, padx=15, pady=20)
 
         self.frame_main.rowconfigure(0, weight=1)
-        self.frame_main.rowconfigure(6, weight=1)
+        self.frame_main.rowconfigure(9, weight=1)
         self.frame_main.columnconfigure(0, weight=1)
         self.frame_main.columnconfigure(3, weight=1)
 
-    def init_inprogress(self):
-        self.switch = gpio.Button(26)
-        self.switch.when_pressed = self.run_dif
-        self.led_r = gpio.LED(5)
-        self.led_g = gpio.LED(6)
-        self.led_flash = gpio.LED(19)
+    def init_inprogress(self, saved=None):
+        """Starts analyzing; from the checkpoint.Checkpoint saved, if given."""
+        try:
+            if saved is not None:
+                self.detector = saved.detector()
+                rectifier = saved.rectifier()
+                path = saved.state['baseline']['path']
+            elif self.recipe.get() == NO_RECIPE:
+                base = baseline.load_current()
+                self.detector = detectors.create(self.detector_name.get(), base.mean, self.sens.get(),
+                                                 self.min_size, base.noise, **self.detector_options)
+                rectifier = rectify.from_arrays(base.arrays)
+                path = baseline.BASELINE_FILE
+            else:
+                loaded = self.master.recipes.get(self.recipe.get())
+                self.detector = loaded.detector(self.sens.get(), self.detector_name.get(),
+                                                self.detector_options)
+                rectifier = loaded.rectifier
+                path = loaded.recipe.baseline_path
+            self.baseline = saved.state['baseline'] if saved is not None else checkpoint.provenance(path)
+        except (baseline.BaselineError, recipes.RecipeError) as e:
+            messagebox.showerror('Calibration needed', str(e))
+            return False
+        self.heatmap = None if saved is None else saved.heatmap()
+        if self.heatmap is None:
+            self.heatmap = heatmap.Heatmap.open(heatmap.path_for(path), load_settings())
+        self.master.latest.metrics['heatmap'] = self.heatmap.snapshot
+        self.checkpoint = checkpoint.Checkpointer(checkpoint.CHECKPOINT_FILE, load_settings(), CAPTURE_SIZE)
+        self.master.latest.metrics['checkpoint'] = self.checkpoint.snapshot
+        self.init_pins()
+        if self.output is not None:
+            self.master.latest.metrics['output'] = self.output.snapshot
+        source = self.master.open_camera(color=True)
+        if self.master.capture_process:
+            self.master.latest.metrics['capture'] = source.snapshot
+        self.source = rectify.wrap(source, rectifier)
+        self.scheduler = TriggerScheduler(self.master.profiler.wrap(self.run_dif)).start()
+        if saved is not None:
+            self.scheduler.restore(saved.state.get('trigger', {}))
+        self.followup = Followup(self.report_dif)
+        self.master.latest.metrics['followup'] = self.followup.snapshot
+        self.master.latest.metrics['trigger'] = self.scheduler.snapshot
+        self.master.latest.metrics['detector'] = self.detector.snapshot
+        clear(self.frame_inprogress)
 
         self.label_prog = ttk.Label(self.frame_inprogress, text='Analyzing', font='-weight bold -size 20')
         self.label_img = ttk.Label(self.frame_inprogress)
+        self.label_stats = ttk.Label(self.frame_inprogress, font='-size 10')
         self.button_back = ttk.Button(self.frame_inprogress, text='Back', command=self.inprogress2main)
         self.pb_dif = ttk.Progressbar(self.frame_inprogress, orient='horizontal', mode='indeterminate', length=400)
+        self.check_heatmap = ttk.Checkbutton(self.frame_inprogress, text='Show defect heatmap', variable=self.show_heatmap,
+                                            command=self.toggle_heatmap)
 
         self.label_prog.grid(row=1, column=1)
         self.label_img.grid(row=2, column=1)
-        self.pb_dif.grid(row=3, column=1)
-        self.button_back.grid(row=4, column=1)
+        self.label_stats.grid(row=3, column=1)
+        self.pb_dif.grid(row=4, column=1)
+        self.check_heatmap.grid(row=5, column=1, pady=5)
+        self.button_back.grid(row=6, column=1)
 
         self.frame_inprogress.rowconfigure(0, weight=1)
-        self.frame_inprogress.rowconfigure(5, weight=1)
+        self.frame_inprogress.rowconfigure(7, weight=1)
         self.frame_inprogress.columnconfigure(0, weight=1)
         self.frame_inprogress.columnconfigure(2, weight=1)
 
-    def run_dif(self):
-        self.pb_dif.start()
-        base_gray = cv2.imread('average.jpg', 0)
-        with PiCamera() as camera:
-            camera = init_camera(camera)
-            with PiRGBArray(camera, size=(400, 250)) as rawCapture:
-                self.led_flash.on()
-                camera.capture(rawCapture, format='bgr', resize=(400, 250))
-                filename = datetime.now().strftime('%Y-%m-%d %H:%M:%S') + '.jpg'
-                self.led_flash.off()
-                image = rawCapture.array
-                rawCapture.truncate(0)
-                image_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-                diff = cv2.absdiff(base_gray, image_gray)
-                thresh = cv2.threshold(diff, self.sens.get(), 255, cv2.THRESH_BINARY)[1]
-                conts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[1]
-
-                obj = 0
-                for c in conts:
-                    (x, y, w, h) = cv2.boundingRect(c)
-                    if w > 35 and h > 35:
-                        cv2.rectangle(image, (x, y), (x + w, y + h), (255, 0, 0), 2)
-                        obj += 1
-
-                if obj:
-                    self.led_r.on()
-                    self.led_g.off()
-                else:
-                    self.led_r.off()
-                    self.led_g.on()
+        # plain copies of the Tk variables, which the follow-up thread can read
+        self.recipe_name = None if self.recipe.get() == NO_RECIPE else self.recipe.get()
+        self.overlay_heatmap = self.show_heatmap.get()
+        self.poll_display()
+        self.switch.when_pressed = self.on_press
+        eventlog.event(log, 'analysis_started', recipe=self.recipe.get(), detector=self.detector.name,
+                       sensitivity=self.sens.get(), min_size=self.min_size,
+                       resumed=None if saved is None else saved.state.get('cycles', 0))
+
+    def init_pins(self):
+        """
+        Claims the GPIO pins on first use; they stay claimed until close_pins().
+
+        The red and green LEDs belong to the output thread. If it cannot
+        start, they are driven from the trigger thread instead, as
+        service.py --direct-output does, without the deadline.
+        """
+        if self.switch is None:
+            self.output = self.master.start_output()
+            if self.output is None:
+                self.led_r = gpio.LED(5)
+                self.led_g = gpio.LED(6)
+            self.switch = gpio.Button(26)
+            self.led_flash = gpio.LED(19)
+
+    def close_pins(self):
+        """Releases the pins init_pins() claimed; the output thread runs on until the GUI quits."""
+        if self.switch is not None:
+            for device in (self.switch, self.led_flash, self.led_r, self.led_g):
+                if device is not None:
+                    device.close()
+            self.switch = None
+            self.led_r = self.led_g = None
+            self.output = None
+
+    def set_leds(self, reject):
+        """Drives the red and green LEDs directly, when there is no output thread."""
+        if reject:
+            self.led_r.on()
+            self.led_g.off()
+        else:
+            self.led_r.off()
+            self.led_g.on()
+
+    def on_press(self):
+        cycle = self.scheduler.trigger()
+        if cycle is not None and self.output is not None:
+            self.output.arm(cycle.triggered)
+
+    def run_dif(self, cycle=None):
+        """Captures and checks one mold and drives the LEDs; the rest is left to report_dif()."""
+        start = time.monotonic()
+        triggered = start if cycle is None else cycle.triggered
+        index = self.scheduler.completed + 1 if cycle is None else cycle.index
+        self.led_flash.on()
+        image_gray = self.source.read_gray()
+        self.led_flash.off()
+
+        detection = self.detector.detect(image_gray, first=True)
+
+        request = None
+        if self.output is not None:
+            request = self.output.signal(detection.reject, triggered)
+        else:
+            self.set_leds(detection.reject)
+        signaled = time.monotonic()
+        if cycle is not None:
+            cycle.signaled = signaled
+        # the frame is only ours until it is released
+        image = self.source.color_image()
+        self.source.release()
+        self.followup.submit(index, detection, image, triggered, start, signaled, request)
+
+    def report_dif(self, index, detection, image, triggered, start, signaled, request):
+        """
+        Finishes a cycle after its verdict is out: boxes, logging and heatmap.
+
+        It runs on the follow-up thread, so it leaves the display to
+        poll_display() on the Tk thread.
+        """
+        if request is not None:
+            # the time the output thread actually set the pins
+            signaled = self.output.signaled(request) or signaled
+        boxes = self.detector.finish(detection).boxes
+        self.heatmap.add(detection)
+        # None when the frame was overwritten before it could be copied
+        if image is not None:
+            if self.overlay_heatmap:
+                image = self.heatmap.overlay(image)
+            image = analysis.annotate(image, boxes)
+            self.master.latest.publish(image, boxes, signaled - start)
+        signal_ms = round((signaled - triggered) * 1000.0, 2)
+        eventlog.event(log, 'verdict', cycle=index, verdict='reject' if boxes else 'pass',
+                       objects=len(boxes), boxes=boxes, detector=detection.detector,
+                       detect_ms=round(detection.seconds * 1000.0, 2),
+                       wait_ms=round((start - triggered) * 1000.0, 2), signal_ms=signal_ms,
+                       cycle_ms=round((time.monotonic() - triggered) * 1000.0, 2))
+        self.show(index, image, signal_ms)
+        self.heatmap.autosave()
+        self.checkpoint.autosave(self.checkpoint_state)
+
+    def show(self, index, image, signal_ms):
+        """Hands a finished cycle to poll_display(), replacing one it has not shown yet; never blocks."""
+        try:
+            self.display.get_nowait()
+        except queue.Empty:
+            pass
+        self.display.put_nowait((index, image, signal_ms))
 
+    def poll_display(self):
+        """Shows the last cycle handed to show(), on the Tk thread, every DISPLAY_MS."""
+        try:
+            index, image, signal_ms = self.display.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            if image is not None:
                 img = ImageTk.PhotoImage(image=Image.fromarray(image))
                 self.label_img.configure(image=img)
                 self.label_img.img = img
+            self.update_stats(index, signal_ms)
+            self.pb_dif.step()
+        self.display_job = self.after(DISPLAY_MS, self.poll_display)
+
+    def stop_display(self):
+        if self.display_job is not None:
+            self.after_cancel(self.display_job)
+            self.display_job = None
+        try:
+            self.display.get_nowait()
+        except queue.Empty:
+            pass
 
-                self.pb_dif.stop()
-                self.master.root.update()
+    def toggle_heatmap(self):
+        self.overlay_heatmap = self.show_heatmap.get()
+
+    def checkpoint_state(self):
+        """Returns the arrays and state of the running analysis, for a checkpoint."""
+        return checkpoint.collect(self.detector, self.scheduler, self.heatmap,
+                                  getattr(self.source, 'rectifier', None), self.detector_options,
+                                  recipe=self.recipe_name, baseline=self.baseline,
+                                  cycles=self.scheduler.completed)
+
+    def update_stats(self, index, signal_ms):
+        stats = self.scheduler.snapshot()
+        text = 'Cycles: {}   Period: {} ms   Signal: {} ms   Overruns: {}   Missed: {}'
+        self.label_stats.configure(text=text.format(
+            index, stats['period_ms'] or '-', signal_ms, stats['overruns'], stats['missed']))
 
     def update_label(self):
         if self.text == '':
@@ -714,8 +1121,9 @@ class DifferenceFrame(ttk.Frame):
     def difference2splash(self):
         self.master.difference2splash()
 
-    def main2inprogress(self):
-        self.init_inprogress()
+    def main2inprogress(self, saved=None):
+        if self.init_inprogress(saved) is False:
+            return
         self.frame_main.pack_forget()
         self.frame_inprogress.pack(side="top", fill="both", expand=True)
 
@@ -723,10 +1131,105 @@ class DifferenceFrame(ttk.Frame):
         self.init_main()
         self.frame_inprogress.pack_forget()
         self.frame_main.pack(side="top", fill="both", expand=True)
-        self.led_r.close()
-        self.led_g.close()
-        self.led_flash.close()
-        self.switch.close()
+        # stopped first, so a press arriving meanwhile is ignored rather than queued
+        self.scheduler.stop()
+        self.switch.when_pressed = None
+        self.followup.stop()
+        self.stop_display()
+        if self.output is not None:
+            self.output.off()
+        else:
+            self.led_r.off()
+            self.led_g.off()
+        self.led_flash.off()
+        self.master.latest.metrics.pop('trigger', None)
+        self.master.latest.metrics.pop('capture', None)
+        self.master.latest.metrics.pop('detector', None)
+        self.master.latest.metrics.pop('heatmap', None)
+        self.master.latest.metrics.pop('followup', None)
+        self.master.latest.metrics.pop('output', None)
+        self.master.latest.metrics.pop('checkpoint', None)
+        eventlog.event(log, 'analysis_stopped', trigger=self.scheduler.snapshot(),
+                       followup=self.followup.snapshot(), detector=self.detector.snapshot(),
+                       heatmap=self.heatmap.snapshot(),
+                       output=self.output.snapshot() if self.output is not None else None)
+        self.source.close()
+        self.close_heatmap()
+        self.detector.close()
+        self.detector = None
+
+    def close_heatmap(self):
+        """
+        Lets the queued follow-ups finish, then saves the heatmap and a last
+        checkpoint of the analysis that ran last.
+        """
+        if self.heatmap is not None:
+            self.followup.stop()
+            self.heatmap.save()
+            self.checkpoint.save(*self.checkpoint_state())
+            self.heatmap = None
+
+    def resume(self, saved):
+        """Goes straight back into the analysis of the checkpoint.Checkpoint saved."""
+        state = saved.state['detector']
+        self.recipe.set(saved.state.get('recipe') or NO_RECIPE)
+        self.sens.set(state['sensitivity'])
+        self.min_size = state['min_size']
+        self.detector_name.set(state['name'])
+        self.detector_options = dict(state['options'])
+        self.main2inprogress(saved)
+
+    def select_recipe(self, e=None):
+        """Activates the product the user chose, which rewrites the camera settings."""
+        name = self.recipe.get()
+        try:
+            recipe = recipes.activate(None if name == NO_RECIPE else name)
+        except recipes.RecipeError as e:
+            messagebox.showerror('Product', str(e))
+            self.recipe.set(recipes.active_name() or NO_RECIPE)
+            return
+        self.master.settings_changed()
+        eventlog.event(log, 'recipe_selected', recipe=None if recipe is None else name)
+        self.use_recipe(recipe)
+
+    def use_recipe(self, recipe):
+        """Takes the values of recipe, or the defaults for None, and preloads its baseline."""
+        if recipe is None:
+            self.min_size = analysis.MIN_OBJECT_SIZE
+            self.detector_name.set(detectors.DEFAULT)
+            self.detector_options = {}
+            return
+        self.sens.set(recipe.sensitivity)
+        self.min_size = recipe.min_size
+        self.detector_name.set(recipe.detector)
+        self.detector_options = dict(recipe.options)
+        try:
+            self.master.recipes.get(recipe.name)
+        except (baseline.BaselineError, recipes.RecipeError) as e:
+            messagebox.showwarning('Calibration needed', str(e))
+
+    def save_recipe(self):
+        """Saves the current camera settings, sensitivity and baseline as a product."""
+        name = simpledialog.askstring('Save as Product', 'Product name:', parent=self)
+        if not name:
+            return
+        recipe = recipes.Recipe(name, load_settings(), self.sens.get(), self.min_size,
+                                self.detector_name.get(), self.detector_options)
+        src = recipes.baseline_path()
+        try:
+            recipes.save_recipe(recipe, src if os.path.exists(src) else None)
+        except (recipes.RecipeError, OSError) as e:
+            messagebox.showerror('Save as Product', str(e))
+            return
+        eventlog.event(log, 'recipe_saved', recipe=name, **recipe.to_dict())
+        self.master.recipes.invalidate(name)
+        self.recipe.set(name)
+        self.combo_recipe.configure(values=[NO_RECIPE] + recipes.list_recipes())
+        self.select_recipe()
+
+    def select_detector(self, e=None):
+        """Switches detector; options belong to the recipe's detector, so they are dropped."""
+        self.detector_options = {}
 
     def check_sens(self, e=None):
         value = self.sens.get()
@@ -740,13 +1243,74 @@ class MainFrame(ttk.Frame):
         ttk.Frame.__init__(self, root, *args, **kwargs)
 
         self.root = root
+        self.latest = monitor.LatestResult()
+        self.recipes = recipes.RecipeCache()
+        self.profiler = ProfileSession()
+        self.capture_process = False
+        # the output.OutputController driving the red and green LEDs, started
+        # by start_output() on the first analysis, and its deadline in seconds
+        self.output = None
+        self.signal_deadline = None
+        self.root.bind('<F9>', self.profiler.toggle)
+        self.frames = {}
         self.frame_splash = SplashFrame(self, pad=5)
-        self.frame_settings = SettingsFrame(self, pad=5)
-        self.frame_calibration = CalibrationFrame(self, pad=5)
-        self.frame_difference = DifferenceFrame(self, pad=5)
 
         self.frame_splash.pack(side="top", fill="both", expand=True)
 
+    def start_output(self):
+        """
+        Starts the output thread on first use and returns it; returns None,
+        logged, if it cannot run, e.g. off a Raspberry Pi or with a pin busy.
+
+        It is started only now, so the GUI starts without gpiozero or the pins.
+        """
+        if self.output is None:
+            try:
+                self.output = OutputController(gpio.LED, (5, 6), deadline=self.signal_deadline)
+            except Exception as e:
+                # gpiozero's own errors for a missing pin factory or a pin in use too
+                eventlog.event(log, 'output_failed', level=logging.WARNING, error=str(e))
+                return None
+            eventlog.event(log, 'output', policy=self.output.snapshot()['policy'],
+                           deadline_ms=self.signal_deadline * 1000.0 if self.signal_deadline else None)
+        return self.output
+
+    def open_camera(self, color=False):
+        """
+        Returns the frame source for calibrating and analyzing: both go
+        through the same port, so the baseline and the frames compared with
+        it are processed alike.
+        """
+        if self.capture_process:
+            return ringbuffer.CaptureProcess(CameraSource, CAPTURE_SIZE, color,
+                                             source_kwargs={'color': color, 'video': True})
+        return CameraSource(color=color)
+
+    def get_frame(self, cls):
+        """Returns the page of class cls, building it on first use."""
+        frame = self.frames.get(cls)
+        if frame is None:
+            frame = cls(self, pad=5)
+            self.frames[cls] = frame
+        return frame
+
+    def settings_changed(self):
+        """Reloads the camera settings page after the saved settings changed."""
+        if SettingsFrame in self.frames:
+            self.frames[SettingsFrame].init_vars()
+
+    @property
+    def frame_settings(self):
+        return self.get_frame(SettingsFrame)
+
+    @property
+    def frame_calibration(self):
+        return self.get_frame(CalibrationFrame)
+
+    @property
+    def frame_difference(self):
+        return self.get_frame(DifferenceFrame)
+
     def splash2settings(self):
         self.frame_splash.pack_forget()
         self.frame_settings.pack(side="top", fill="both", expand=True)
@@ -759,6 +1323,24 @@ class MainFrame(ttk.Frame):
         self.frame_splash.pack_forget()
         self.frame_difference.pack(side="top", fill="both", expand=True)
 
+    def resume(self, path=checkpoint.CHECKPOINT_FILE):
+        """
+        Opens the analysis page and carries on from the checkpoint at path,
+        unless it is of another product than the active one or of an older
+        calibration.
+        """
+        try:
+            saved = checkpoint.load(path, load_settings(), CAPTURE_SIZE)
+            saved.check(recipes.active_name(), recipes.baseline_path())
+        except baseline.BaselineError as e:
+            eventlog.event(log, 'resume_failed', path=path, error=str(e))
+            messagebox.showwarning('Cannot resume', str(e))
+            return
+        eventlog.event(log, 'resumed', path=path, recipe=saved.state.get('recipe'),
+                       cycles=saved.state.get('cycles', 0), age_s=round(time.time() - saved.state['saved'], 1))
+        self.splash2difference()
+        self.frame_difference.resume(saved)
+
     def settings2splash(self):
         self.frame_settings.pack_forget()
         self.frame_splash.pack(side="top", fill="both", expand=True)
@@ -772,26 +1354,66 @@ class MainFrame(ttk.Frame):
         self.frame_splash.pack(side="top", fill="both", expand=True)
 
     def onQuit(self):
+        if SettingsFrame in self.frames:
+            self.frames[SettingsFrame].close_preview()
+        if DifferenceFrame in self.frames:
+            self.frames[DifferenceFrame].close_heatmap()
+            self.frames[DifferenceFrame].close_pins()
         self.root.destroy()
 
 
-def init_camera(camera):
-    """Takes in a PiCamera object and applies settings to it."""
-    with open('camerasettings.json') as file:
-        settings = json.load(file)
-    settings['custom']['zoom'] = tuple(settings['custom']['zoom'])
-    for k, v in settings['custom'].items():
-        setattr(camera, k, v)
-    camera.resolution = (640, 368)
-    camera.awb_mode = 'auto'
-    return camera
-
-
 def main():
+    timer = StartupTimer(_STARTED)
+    timer.mark('imports')
+    parser = argparse.ArgumentParser(description='WinCup Mold Analysis System')
+    parser.add_argument('--monitor-port', type=int, default=8000,
+                        help='port for the monitoring server, 0 to disable')
+    parser.add_argument('--monitor-host', default='127.0.0.1',
+                        help='interface for the monitoring server, e.g. 0.0.0.0 for all')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print how long each startup phase took')
+    parser.add_argument('--capture-process', action='store_true',
+                        help='capture in a separate process through shared memory, from the '
+                        'video port; calibrate with it too')
+    parser.add_argument('--signal-deadline', type=float, metavar='MS',
+                        help='signal reject if a trigger gets no verdict within MS milliseconds')
+    parser.add_argument('--log-file', default=eventlog.LOG_FILE,
+                        help='JSON-lines event log, empty to disable')
+    parser.add_argument('--resume', action='store_true',
+                        help='go straight back into analysis from the last checkpoint')
+    args = parser.parse_args()
+    events = eventlog.EventLog(args.log_file).start() if args.log_file else None
+
     root = tk.Tk()
-    MainFrame(root).pack(side="top", fill="both", expand=True)
+    timer.mark('tk')
+    mainframe = MainFrame(root)
+    mainframe.capture_process = args.capture_process
+    mainframe.signal_deadline = args.signal_deadline / 1000.0 if args.signal_deadline else None
+    mainframe.pack(side="top", fill="both", expand=True)
     root.attributes('-zoomed', True)
-    root.mainloop()
+    timer.mark('splash')
+    root.update()
+    timer.mark('first paint')
+    if args.monitor_port:
+        try:
+            monitor.MonitorServer(mainframe.latest, args.monitor_host, args.monitor_port).start()
+        except OSError as e:
+            eventlog.event(log, 'monitor_failed', level=logging.WARNING, host=args.monitor_host,
+                           port=args.monitor_port, error=str(e))
+        timer.mark('monitor')
+    if args.startup_report:
+        timer.report()
+    eventlog.event(log, 'started', startup_s=round(timer.total, 3))
+    if args.resume:
+        mainframe.resume()
+    try:
+        root.mainloop()
+    finally:
+        if mainframe.output is not None:
+            mainframe.output.close()
+        eventlog.event(log, 'stopped')
+        if events is not None:
+            events.stop()
 
 
 if __name__ == '__main__':